@@ -0,0 +1,23 @@
+from aiogram import Bot, Dispatcher
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ParseMode
+from app.core.config import settings
+from app.Bot.handlers import chat_edit
+
+# Единственный экземпляр бота в процессе: его сессию используют
+# и поллинг, и отправка уведомлений из API.
+# TELEGRAM_API_URL позволяет работать через локальный Bot API сервер
+# (или его имитацию в нагрузочных тестах)
+session = (
+    AiohttpSession(api=TelegramAPIServer.from_base(settings.config.telegram_api_url))
+    if settings.config.telegram_api_url else None
+)
+bot = Bot(token=settings.config.bot_token,
+        session=session,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+
+# Диспетчер с подключенными обработчиками команд
+dp = Dispatcher()
+dp.include_router(chat_edit.router)
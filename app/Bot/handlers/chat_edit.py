@@ -3,6 +3,7 @@ from aiogram.filters import CommandStart
 from app.Bot.handlers.keyboards import model_keyboard
 from app.db.models import User
 from app.db.database import add_to_table
+from app.core.cache import user_cache
 
 router = Router(name=__name__)
 
@@ -18,7 +19,9 @@ async def command_start(message: types.Message):
     user_data = {
         'user_id': message.from_user.id,
         'first_name': message.from_user.first_name,
-        'last_name': message.from_user.last_name
+        'last_name': message.from_user.last_name,
+        'unreachable_at': None  # пользователь снова написал боту - рассылки ему возобновляются
     }
 
     await add_to_table(User, user_data)
+    user_cache.invalidate(message.from_user.id)
@@ -1,15 +1,25 @@
-from aiogram import Bot
-
-import aiohttp
+from app.Bot.bot import bot
 from app.core.logging import logs_bot
-from typing import Optional
-from aiogram.types import BufferedInputFile
+from app.core.http import http_client, origin_error
+from app.core.metrics import MEDIA_DOWNLOAD_BYTES, MEDIA_DOWNLOAD_DURATION
+from typing import AsyncIterator, List, Optional
+from aiogram.types import BufferedInputFile, FSInputFile, InputFile, InputMediaPhoto, InputMediaVideo, Message
+from aiogram.exceptions import TelegramBadRequest
 from app.core.config import settings
-
-bot = Bot(token=settings.config.bot_token)
+from app.core.rate_limiter import scheduler
+from app.services.file_id_cache import file_id_cache, extract_file_id, is_file_id_error
+from app.services.media_store import media_store
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass
+import aiofiles
+import asyncio
+import math
+import tempfile
+import os
+import time
 
 
-async def send_message(chat_id: int, text: str, parse_mode: Optional[str] = None):
+async def send_message(chat_id: int, text: str, parse_mode: Optional[str] = None, priority: str = "normal"):
     """
     Отправляет текстовое сообщение в указанный чат.
     
@@ -18,38 +28,126 @@ async def send_message(chat_id: int, text: str, parse_mode: Optional[str] = None
     - chat_id: ID чата, куда будет отправлено сообщение.
     - text: текст сообщения, который нужно отправить.
     - parse_mode: режим парсинга текста (например, HTML или Markdown).
+    - priority: приоритет в планировщике отправок (high, normal, low).
     """
     if text is None:
         raise ValueError("The 'text' argument is required and cannot be None.")
     
-    await bot.send_message(
+    await scheduler.send(
+        bot.send_message,
         chat_id=chat_id,
+        priority=priority,
         text=text,
         parse_mode="HTML"
     )
 
 
-async def download_file(url: str) -> tuple[bytes, str, str]:
+@dataclass
+class DownloadedMedia:
     """
-    Скачивает файл по URL с отключенной SSL-проверкой.
-    
+    Скачанный медиа-файл, готовый к загрузке в Telegram.
+
+    input_file - BufferedInputFile для небольших файлов или FSInputFile
+    для файлов, сброшенных во временный файл на диске.
+    """
+    input_file: InputFile
+    content_type: str
+    ext: str
+    size: int
+
+
+@asynccontextmanager
+async def download_media(url: str) -> AsyncIterator[DownloadedMedia]:
+    """
+    Потоково скачивает файл по URL через общий пул соединений http_client
+    (с отключенной SSL-проверкой).
+
+    Файлы до media_spool_threshold байт собираются в памяти, более крупные
+    (или с неизвестным размером) пишутся во временный файл по частям,
+    так что целиком в памяти они не держатся. Размер проверяется заранее
+    по Content-Length и по счетчику во время скачивания: файлы больше
+    media_max_bytes отклоняются. Временный файл удаляется при выходе из контекста.
+
+    Если задан MEDIA_CACHE_DIR, файл берется из дискового кэша media_store.
+
     Параметры:
     - url: URL файла, который нужно скачать.
-    
-    Возвращает:
-    - кортеж из байтовых данных файла, его content-type и расширения.
+
+    Использование:
+        async with download_media(url) as media:
+            await bot.send_photo(chat_id, media.input_file)
     """
-    connector = aiohttp.TCPConnector(ssl=False)  # Отключаем SSL проверку
-    async with aiohttp.ClientSession(connector=connector) as session:
-        async with session.get(url) as response:
+    max_bytes = settings.config.media_max_bytes
+    threshold = settings.config.media_spool_threshold
+    chunk_size = settings.config.media_chunk_size
+    tmp_path = None
+
+    if media_store.enabled:
+        # Локальный кэш на диске: повторные отправки не обращаются к источнику
+        async with media_store.open(url) as cached:
+            ext = get_file_extension(cached.content_type)
+            yield DownloadedMedia(
+                input_file=FSInputFile(cached.path, filename=f"file{ext}", chunk_size=chunk_size),
+                content_type=cached.content_type,
+                ext=ext,
+                size=cached.size
+            )
+        return
+
+    started_at = time.perf_counter()
+    try:
+        async with http_client.request("GET", url) as response:
             if response.status != 200:
                 error_text = await response.text()
                 await logs_bot("error", f"Ошибка скачивания: {response.status}, Ответ: {error_text}")
-                raise ValueError(f"Ошибка загрузки: {response.status}")
-                
+                raise ValueError(f"Ошибка загрузки: {response.status}") from origin_error(response)
+
             content_type = response.headers.get('Content-Type', 'application/octet-stream')
             ext = get_file_extension(content_type)
-            return await response.read(), content_type, ext
+
+            content_length = response.content_length
+            if content_length is not None and content_length > max_bytes:
+                raise ValueError(f"Файл слишком большой: {content_length} байт (максимум {max_bytes})")
+
+            size = 0
+            buffer = bytearray()
+            tmp_file = None
+            try:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise ValueError(f"Файл слишком большой: больше {max_bytes} байт")
+
+                    if tmp_file is None and (content_length is None or size > threshold):
+                        fd, tmp_path = tempfile.mkstemp(suffix=ext, dir=settings.config.media_tmp_dir)
+                        os.close(fd)
+                        tmp_file = await aiofiles.open(tmp_path, "wb")
+                        await tmp_file.write(bytes(buffer))
+                        buffer = None
+
+                    if tmp_file is not None:
+                        await tmp_file.write(chunk)
+                    else:
+                        buffer.extend(chunk)
+            finally:
+                if tmp_file is not None:
+                    await tmp_file.close()
+
+        http_client.bytes_received += size
+        MEDIA_DOWNLOAD_BYTES.inc(amount=size)
+        MEDIA_DOWNLOAD_DURATION.observe(time.perf_counter() - started_at)
+
+        file_name = f"file{ext}"
+        if tmp_path is not None:
+            input_file = FSInputFile(tmp_path, filename=file_name, chunk_size=chunk_size)
+        else:
+            input_file = BufferedInputFile(bytes(buffer), filename=file_name)
+
+        yield DownloadedMedia(input_file=input_file, content_type=content_type, ext=ext, size=size)
+
+    finally:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 def get_file_extension(content_type: str) -> str:
     """
@@ -71,7 +169,8 @@ async def send_media(
             file_url: str,
             media_type: str,
             caption: Optional[str] = None,
-            parse_mode: str = "HTML"
+            parse_mode: str = "HTML",
+            priority: str = "normal"
         ) -> dict:
     """
     Универсальная функция для отправки медиа-файлов.
@@ -82,50 +181,74 @@ async def send_media(
     - media_type: тип медиа (например, 'photo', 'video').
     - caption: подпись к медиа (опционально).
     - parse_mode: режим парсинга текста (по умолчанию HTML).
+    - priority: приоритет в планировщике отправок (high, normal, low).
     
     Возвращает:
     - ответ от Telegram API после отправки медиа.
+
+    После первой загрузки file_id из ответа Telegram кэшируется,
+    и повторные отправки того же URL не скачивают и не загружают файл заново.
     """
-    try:
-        file_data, content_type, ext = await download_file(file_url)
-        file_name = f"file{ext}"
-        
-        input_file = BufferedInputFile(file_data, filename=file_name)
-        
-        methods = {
-            'photo': bot.send_photo,
-            'video': bot.send_video,
-            'animation': bot.send_animation,
-            'document': bot.send_document
-        }
-        
-        send_method = methods.get(media_type)
-        if not send_method:
-            raise ValueError(f"Неподдерживаемый тип медиа: {media_type}")
-            
+    methods = {
+        'photo': bot.send_photo,
+        'video': bot.send_video,
+        'animation': bot.send_animation,
+        'document': bot.send_document
+    }
+
+    async def send(media) -> Message:
         params = {
-            'chat_id': chat_id,
-            media_type: input_file,
+            media_type: media,
             'caption': caption,
             'parse_mode': parse_mode
         }
-        
+
         if media_type == 'video':
             params.update({'supports_streaming': True, 'width': 1920, 'height': 1080})
-            
-        response = await send_method(**params)
+
+        response = await scheduler.send(methods[media_type], chat_id=chat_id, priority=priority, **params)
         if not response:
             raise ValueError(f"Telegram API не вернул ответ при отправке {media_type}")
-            
         return response
+
+    try:
+        if media_type not in methods:
+            raise ValueError(f"Неподдерживаемый тип медиа: {media_type}")
+
+        # Файл уже загружался в Telegram - отправляем по file_id без скачивания
+        file_id = await file_id_cache.get(media_type, file_url)
+        if file_id:
+            try:
+                return await send(file_id)
+            except TelegramBadRequest as e:
+                # Остальные ошибки (подпись, разметка, чат) повторная загрузка файла не исправит
+                if not is_file_id_error(e):
+                    raise
+                await logs_bot("warning", f"Cached file_id rejected for {file_url}: {str(e)}")
+                await file_id_cache.invalidate(media_type, file_url)
+
+        # Первая загрузка файла выполняется один раз, остальные отправки ждут ее file_id
+        async with file_id_cache.lock(media_type, file_url):
+            file_id = await file_id_cache.get(media_type, file_url)
+            if file_id:
+                return await send(file_id)
+
+            async with download_media(file_url) as media:
+                response = await send(media.input_file)
+
+            file_id = extract_file_id(response, media_type)
+            if file_id:
+                await file_id_cache.set(media_type, file_url, file_id)
+
+            return response
         
     except Exception as e:
         error_msg = f"Ошибка при отправке {media_type}: {str(e)}"
         await logs_bot("error", error_msg)
-        raise ValueError(error_msg)
+        raise ValueError(error_msg) from e
 
 # Специализированные функции отправки медиа
-async def send_photo(chat_id: int, photo: str, caption: str = "", parse_mode: str = "HTML"):
+async def send_photo(chat_id: int, photo: str, caption: str = "", parse_mode: str = "HTML", priority: str = "normal"):
     """
     Отправляет фотографию в указанный чат.
     
@@ -134,10 +257,11 @@ async def send_photo(chat_id: int, photo: str, caption: str = "", parse_mode: st
     - photo: URL или путь к фотографии.
     - caption: подпись к фотографии (опционально).
     - parse_mode: режим парсинга текста (по умолчанию HTML).
+    - priority: приоритет в планировщике отправок (high, normal, low).
     """
-    return await send_media(chat_id, photo, 'photo', caption, parse_mode)
+    return await send_media(chat_id, photo, 'photo', caption, parse_mode, priority)
 
-async def send_video(chat_id: int, video: str, caption: str = None, parse_mode: str = "HTML"):
+async def send_video(chat_id: int, video: str, caption: str = None, parse_mode: str = "HTML", priority: str = "normal"):
     """
     Отправляет видео в указанный чат.
     
@@ -146,10 +270,11 @@ async def send_video(chat_id: int, video: str, caption: str = None, parse_mode:
     - video: URL или путь к видео.
     - caption: подпись к видео (опционально).
     - parse_mode: режим парсинга текста (по умолчанию HTML).
+    - priority: приоритет в планировщике отправок (high, normal, low).
     """
-    return await send_media(chat_id, video, 'video', caption, parse_mode)
+    return await send_media(chat_id, video, 'video', caption, parse_mode, priority)
 
-async def send_animation(chat_id: int, animation: str, caption: str = "", parse_mode: str = "HTML"):
+async def send_animation(chat_id: int, animation: str, caption: str = "", parse_mode: str = "HTML", priority: str = "normal"):
     """
     Отправляет анимацию в указанный чат.
     
@@ -158,10 +283,11 @@ async def send_animation(chat_id: int, animation: str, caption: str = "", parse_
     - animation: URL или путь к анимации.
     - caption: подпись к анимации (опционально).
     - parse_mode: режим парсинга текста (по умолчанию HTML).
+    - priority: приоритет в планировщике отправок (high, normal, low).
     """
-    return await send_media(chat_id, animation, 'animation', caption, parse_mode)
+    return await send_media(chat_id, animation, 'animation', caption, parse_mode, priority)
 
-async def send_document(chat_id: int, document: str, caption: str = None, parse_mode: str = "HTML"):
+async def send_document(chat_id: int, document: str, caption: str = None, parse_mode: str = "HTML", priority: str = "normal"):
     """
     Отправляет документ в указанный чат.
     
@@ -170,5 +296,144 @@ async def send_document(chat_id: int, document: str, caption: str = None, parse_
     - document: URL или путь к документу.
     - caption: подпись к документу (опционально).
     - parse_mode: режим парсинга текста (по умолчанию HTML).
+    - priority: приоритет в планировщике отправок (high, normal, low).
+    """
+    return await send_media(chat_id, document, 'document', caption, parse_mode, priority)
+
+# Ограничение Telegram на число элементов в одном альбоме
+MEDIA_GROUP_LIMIT = 10
+
+def split_media_group(items: list) -> List[list]:
+    """
+    Делит элементы альбома на части не больше MEDIA_GROUP_LIMIT.
+
+    Части выравниваются по размеру (11 элементов - 6 и 5, а не 10 и 1),
+    так как sendMediaGroup принимает не меньше 2 элементов.
+    """
+    chunks = math.ceil(len(items) / MEDIA_GROUP_LIMIT)
+    size, extra = divmod(len(items), chunks)
+    result, start = [], 0
+    for index in range(chunks):
+        end = start + size + (1 if index < extra else 0)
+        result.append(items[start:end])
+        start = end
+    return result
+
+async def send_media_group_chunk(
+            chat_id: int,
+            items: List[dict],
+            parse_mode: str = "HTML",
+            priority: str = "normal",
+            use_cache: bool = True
+        ) -> List[Message]:
+    """
+    Отправляет одну часть альбома (2-10 элементов) одним вызовом sendMediaGroup.
+
+    Элементы с file_id в кэше отправляются без скачивания, остальные
+    скачиваются одновременно через download_media. На время загрузки
+    удерживаются блокировки file_id_cache этих файлов (в одном порядке,
+    чтобы не было взаимных блокировок), поэтому при рассылке альбома
+    многим получателям каждый файл скачивается и загружается один раз.
+    """
+    media_classes = {'photo': InputMediaPhoto, 'video': InputMediaVideo}
+
+    def input_media(item: dict, media) -> object:
+        params = {'media': media, 'caption': item.get('caption') or None, 'parse_mode': parse_mode}
+        if item['type'] == 'video':
+            params.update({'supports_streaming': True, 'width': 1920, 'height': 1080})
+        return media_classes[item['type']](**params)
+
+    async def cached_file_ids() -> List[Optional[str]]:
+        if not use_cache:
+            return [None] * len(items)
+        return list(await asyncio.gather(*(file_id_cache.get(item['type'], item['url']) for item in items)))
+
+    file_ids = await cached_file_ids()
+    async with AsyncExitStack() as stack:
+        missing = sorted({(item['type'], item['url']) for item, file_id in zip(items, file_ids) if not file_id})
+        if missing:
+            for media_type, url in missing:
+                await stack.enter_async_context(file_id_cache.lock(media_type, url))
+            # Пока ждали блокировки, файлы мог загрузить другой получатель
+            file_ids = await cached_file_ids()
+
+        downloads = {}
+        urls = list(dict.fromkeys(item['url'] for item, file_id in zip(items, file_ids) if not file_id))
+        results = await asyncio.gather(
+            *(stack.enter_async_context(download_media(url)) for url in urls),
+            return_exceptions=True
+        )
+        for url, result in zip(urls, results):
+            if isinstance(result, BaseException):
+                raise result
+            downloads[url] = result
+
+        media = [
+            input_media(item, file_id or downloads[item['url']].input_file)
+            for item, file_id in zip(items, file_ids)
+        ]
+        stale = []
+        try:
+            response = await scheduler.send(bot.send_media_group, chat_id=chat_id, priority=priority, media=media)
+        except TelegramBadRequest as e:
+            stale = [item for item, file_id in zip(items, file_ids) if file_id]
+            if not stale or not is_file_id_error(e):
+                raise
+            await logs_bot("warning", f"Media group rejected with cached file_id: {str(e)}")
+        else:
+            if not response:
+                raise ValueError("Telegram API не вернул ответ при отправке альбома")
+            for item, file_id, message in zip(items, file_ids, response):
+                if not file_id:
+                    new_file_id = extract_file_id(message, item['type'])
+                    if new_file_id:
+                        await file_id_cache.set(item['type'], item['url'], new_file_id)
+
+    if stale:
+        # Один из закэшированных file_id устарел - загружаем часть заново (уже без блокировок)
+        for item in stale:
+            await file_id_cache.invalidate(item['type'], item['url'])
+        return await send_media_group_chunk(chat_id, items, parse_mode, priority, use_cache=False)
+    return response
+
+async def send_media_group(
+            chat_id: int,
+            items: List[dict],
+            caption: Optional[str] = None,
+            parse_mode: str = "HTML",
+            priority: str = "normal"
+        ) -> List[Message]:
+    """
+    Отправляет несколько фото и видео одним альбомом (sendMediaGroup).
+
+    Параметры:
+    - chat_id: ID чата, куда будет отправлен альбом.
+    - items: элементы альбома [{"type": "photo" | "video", "url": ..., "caption": ...}].
+    - caption: общая подпись, ставится первому элементу каждой части, если у него нет своей.
+    - parse_mode: режим парсинга текста (по умолчанию HTML).
+    - priority: приоритет в планировщике отправок (high, normal, low).
+
+    Возвращает:
+    - список сообщений, отправленных Telegram.
+
+    Больше MEDIA_GROUP_LIMIT элементов отправляются несколькими альбомами,
+    один элемент - обычной отправкой через send_media.
     """
-    return await send_media(chat_id, document, 'document', caption, parse_mode)
\ No newline at end of file
+    try:
+        if not items:
+            raise ValueError("Альбом не содержит элементов")
+        if len(items) == 1:
+            item = items[0]
+            return [await send_media(chat_id, item['url'], item['type'], item.get('caption') or caption, parse_mode, priority)]
+
+        messages = []
+        for chunk in split_media_group(items):
+            if caption and not chunk[0].get('caption'):
+                chunk = [{**chunk[0], 'caption': caption}] + chunk[1:]
+            messages.extend(await send_media_group_chunk(chat_id, chunk, parse_mode, priority))
+        return messages
+
+    except Exception as e:
+        error_msg = f"Ошибка при отправке альбома: {str(e)}"
+        await logs_bot("error", error_msg)
+        raise ValueError(error_msg) from e
@@ -1,54 +1,221 @@
-from fastapi import Request, HTTPException
-from fastapi.security import HTTPBearer
+from fastapi import Request, HTTPException, Depends
+from fastapi.security import APIKeyHeader
+from app.core.cache import TTLCache
 from app.core.config import settings
+from app.core.metrics import registry
+from app.core.rate_limiter import TokenBucket
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import hashlib
+import hmac
+import math
 
-security = HTTPBearer()
+api_key_header = APIKeyHeader(name="Authorization", auto_error=False)
 
-async def verify_token(request: Request):
+
+def hash_api_key(key: str) -> str:
+    """Хэш ключа в формате, который принимает API_KEYS: sha256:<hex>."""
+    return "sha256:" + hashlib.sha256(key.encode()).hexdigest()
+
+
+def check_key_hash(key: str, stored_hash: str) -> bool:
     """
-    Проверяет токен авторизации в заголовке запроса.
-    Токен должен быть передан в заголовке Authorization: Bearer <token>
+    Сравнивает ключ с сохраненным хэшем за постоянное время.
+
+    Форматы хэша:
+    - sha256:<hex>;
+    - pbkdf2_sha256:<итерации>:<соль>:<hex>.
+    """
+    algorithm, _, value = stored_hash.partition(":")
+    if algorithm == "sha256":
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return hmac.compare_digest(digest, value)
+    if algorithm == "pbkdf2_sha256":
+        iterations, salt, expected = value.split(":", 2)
+        digest = hashlib.pbkdf2_hmac("sha256", key.encode(), salt.encode(), int(iterations)).hex()
+        return hmac.compare_digest(digest, expected)
+    return False
+
+
+def validate_key_hash(stored_hash: str) -> None:
+    """Проверяет формат хэша из API_KEYS при загрузке; неверный формат - ValueError."""
+    algorithm, _, value = stored_hash.partition(":")
+    if algorithm == "sha256":
+        if len(value) != 64:
+            raise ValueError("sha256 hash must be sha256:<64 hex characters>")
+        bytes.fromhex(value)
+        return
+    if algorithm == "pbkdf2_sha256":
+        parts = value.split(":", 2)
+        if len(parts) != 3 or not all(parts):
+            raise ValueError("pbkdf2 hash must be pbkdf2_sha256:<iterations>:<salt>:<hex>")
+        iterations, _, expected = parts
+        if not iterations.isdigit() or int(iterations) <= 0:
+            raise ValueError(f"pbkdf2 iterations must be a positive integer, got {iterations!r}")
+        bytes.fromhex(expected)
+        return
+    raise ValueError(f"Unsupported key hash algorithm: {algorithm!r}")
+
+
+@dataclass
+class ApiKey:
+    """
+    Именованный API-ключ.
+
+    scopes - разрешенные права: read (GET), write (остальные методы), admin
+    (служебные эндпоинты) или * - все права. rate_limit - запросов в минуту
+    (0 - без ограничения).
     """
-    # Получаем токен из переменных окружения
-    api_token = settings.config.api_token
-    if not api_token:
-        raise HTTPException(
-            status_code=500,
-            detail="Ошибка конфигурации сервера: API_TOKEN не настроен"
+    name: str
+    key_hash: str
+    scopes: List[str] = field(default_factory=lambda: ["*"])
+    rate_limit: int = 0
+    requests: int = 0
+    rejected: int = 0
+    bucket: Optional[TokenBucket] = None
+
+    def __post_init__(self):
+        if self.rate_limit > 0:
+            self.bucket = TokenBucket(rate=self.rate_limit / 60, capacity=self.rate_limit)
+
+    def allows(self, scope: str) -> bool:
+        return "*" in self.scopes or scope in self.scopes
+
+
+class ApiKeyStore:
+    """
+    Проверка API-ключей с кэшем проверенных ключей.
+
+    Ключи хранятся только в виде хэшей. Предъявленный ключ сравнивается
+    со всеми хэшами за постоянное время (без раннего выхода), результат
+    кэшируется по sha256 предъявленного ключа, поэтому дорогие хэши
+    (pbkdf2) вычисляются один раз на cache_ttl секунд.
+    """
+
+    def __init__(self, keys: List[ApiKey], cache_size: int, cache_ttl: float):
+        self.keys = keys
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+
+    def verify(self, presented: str) -> Optional[ApiKey]:
+        """Возвращает ключ, соответствующий предъявленному значению, или None."""
+        fingerprint = hashlib.sha256(presented.encode()).digest()
+        cached = self._cache.get(fingerprint)
+        if cached is not None:
+            return cached or None
+
+        matched = None
+        for key in self.keys:
+            if check_key_hash(presented, key.key_hash) and matched is None:
+                matched = key
+
+        # False - отрицательный результат, тоже кэшируется
+        self._cache.set(fingerprint, matched or False)
+        return matched
+
+    def stats(self) -> Dict[str, dict]:
+        return {key.name: {"requests": key.requests, "rejected": key.rejected} for key in self.keys}
+
+
+def load_api_keys() -> List[ApiKey]:
+    """
+    Ключи из API_KEYS (JSON-список {"name", "key_hash", "scopes", "rate_limit"})
+    и ключ default со всеми правами из API_TOKEN.
+
+    Хэши проверяются при загрузке: неверный формат останавливает запуск (ValueError),
+    а не превращается в 500 на каждый запрос.
+    """
+    for item in settings.config.api_keys:
+        try:
+            validate_key_hash(item["key_hash"])
+        except ValueError as e:
+            raise ValueError(f"Invalid key_hash for API key '{item.get('name')}': {e}") from e
+
+    keys = [
+        ApiKey(
+            name=item["name"],
+            key_hash=item["key_hash"],
+            scopes=list(item.get("scopes") or ["*"]),
+            rate_limit=int(item.get("rate_limit") or 0)
         )
+        for item in settings.config.api_keys
+    ]
+    if settings.config.api_token:
+        keys.append(ApiKey(
+            name="default",
+            key_hash=hash_api_key(settings.config.api_token),
+            rate_limit=settings.config.api_token_rate_limit
+        ))
+    return keys
 
-    try:
-        # Получаем токен из заголовка
-        auth_header = request.headers.get("Authorization")
-        if not auth_header:
-            raise HTTPException(status_code=401, detail="Неверный токен авторизации")
 
-        # Убираем проверку на Bearer и берем токен как есть
-        token = auth_header
+api_keys = ApiKeyStore(
+    keys=load_api_keys(),
+    cache_size=settings.config.auth_cache_size,
+    cache_ttl=settings.config.auth_cache_ttl
+)
 
-        # Проверяем токен
-        if not token:
-            raise HTTPException(
-                status_code=401,
-                detail="Токен авторизации не может быть пустым"
-            )
+registry.callback(
+    "api_key_requests_total",
+    "Authenticated API requests per key",
+    lambda: [
+        pair
+        for key in api_keys.keys
+        for pair in (((key.name, "accepted"), key.requests), ((key.name, "rejected"), key.rejected))
+    ],
+    ("key", "result"),
+    kind="counter"
+)
 
-        if token != api_token:
+
+async def verify_token(request: Request, api_key: Optional[str] = Depends(api_key_header)) -> ApiKey:
+    """
+    Проверяет API-ключ из заголовка Authorization ("<ключ>" или "Bearer <ключ>").
+
+    Требуемое право определяется методом запроса: GET/HEAD - read, остальные - write;
+    эндпоинты с require_scope дополнительно требуют свое право.
+    Ошибки: 401 - ключ отсутствует или неверен, 403 - нет права,
+    429 - превышен лимит запросов ключа (с заголовком Retry-After).
+
+    Возвращает:
+    - ApiKey, он же доступен как request.state.api_key.
+    """
+    if not api_key:
+        raise HTTPException(status_code=401, detail="API key is missing")
+    if api_key.startswith("Bearer "):
+        api_key = api_key[len("Bearer "):]
+
+    key = api_keys.verify(api_key)
+    if key is None:
+        raise HTTPException(status_code=401, detail="Неверный токен авторизации")
+
+    scope = "read" if request.method in ("GET", "HEAD") else "write"
+    if not key.allows(scope):
+        key.rejected += 1
+        raise HTTPException(status_code=403, detail=f"API key '{key.name}' has no '{scope}' scope")
+
+    if key.bucket is not None:
+        wait = key.bucket.wait_time()
+        if wait > 0:
+            key.rejected += 1
             raise HTTPException(
-                status_code=401,
-                detail="Неверный токен авторизации"
+                status_code=429,
+                detail=f"Rate limit exceeded for API key '{key.name}'",
+                headers={"Retry-After": str(math.ceil(wait))}
             )
+        key.bucket.take()
+
+    key.requests += 1
+    request.state.api_key = key
+    return key
+
 
-        # Если всё хорошо, продолжаем обработку запроса
-        return True
+def require_scope(scope: str):
+    """Зависимость для эндпоинтов, требующих отдельного права (например, admin)."""
 
-    except HTTPException:
-        # Пробрасываем ошибки HTTPException как есть
-        raise
+    async def check_scope(key: ApiKey = Depends(verify_token)) -> ApiKey:
+        if not key.allows(scope):
+            key.rejected += 1
+            raise HTTPException(status_code=403, detail=f"API key '{key.name}' has no '{scope}' scope")
+        return key
 
-    except Exception as e:
-        # Логируем неожиданные ошибки
-        raise HTTPException(
-            status_code=500,
-            detail="Внутренняя ошибка сервера при проверке авторизации"
-        )
\ No newline at end of file
+    return check_scope
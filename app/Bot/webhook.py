@@ -0,0 +1,127 @@
+from aiogram.types import Update
+from fastapi import APIRouter, Header, HTTPException, Request
+from pydantic import ValidationError
+from app.Bot.bot import bot, dp
+from app.core.config import settings
+from app.core.logging import logs_bot
+from app.core.metrics import registry
+from typing import Optional, Set
+import asyncio
+import hmac
+
+
+class WebhookProcessor:
+    """
+    Обработка входящих обновлений Telegram в фоне с ограниченным параллелизмом.
+
+    Эндпоинт только ставит обновление в обработку и сразу отвечает 200,
+    чтобы Telegram не ждал выполнения обработчиков. Одновременно выполняется
+    не больше concurrency обработчиков; если в обработке уже max_pending
+    обновлений, новые отклоняются с 503 и Telegram доставит их повторно.
+    """
+
+    def __init__(self, concurrency: int, max_pending: int):
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    def submit(self, update: Update) -> bool:
+        """Ставит обновление в обработку; False - очередь переполнена."""
+        if len(self._tasks) >= self.max_pending:
+            self.rejected += 1
+            return False
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _process(self, update: Update) -> None:
+        async with self._semaphore:
+            try:
+                await dp.feed_update(bot, update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                await logs_bot("error", f"Webhook update {update.update_id} failed: {e}")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Дожидается обработки принятых обновлений (не дольше timeout секунд)."""
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+webhook_processor = WebhookProcessor(
+    concurrency=settings.config.webhook_concurrency,
+    max_pending=settings.config.webhook_max_pending
+)
+
+registry.callback(
+    "webhook_updates_total",
+    "Telegram webhook updates by result",
+    lambda: [
+        (("processed",), webhook_processor.processed),
+        (("failed",), webhook_processor.failed),
+        (("rejected",), webhook_processor.rejected)
+    ],
+    ("result",),
+    kind="counter"
+)
+registry.callback("webhook_updates_pending", "Webhook updates being processed", lambda: [((), webhook_processor.pending())])
+
+
+# Роутер подключается без проверки API-ключа: Telegram подтверждает запрос
+# секретом из заголовка X-Telegram-Bot-Api-Secret-Token
+router = APIRouter()
+
+
+@router.post(settings.config.webhook_path, include_in_schema=False)
+async def telegram_webhook(
+    request: Request,
+    secret_token: Optional[str] = Header(None, alias="X-Telegram-Bot-Api-Secret-Token")
+):
+    """
+    Прием обновлений Telegram в режиме BOT_UPDATE_MODE=webhook.
+
+    Ошибки: 401 - неверный секрет (или режим webhook не настроен),
+    400 - тело не является обновлением, 503 - превышен WEBHOOK_MAX_PENDING.
+    """
+    secret = settings.config.webhook_secret
+    if not secret or not secret_token or not hmac.compare_digest(secret_token, secret):
+        raise HTTPException(status_code=401, detail="Invalid webhook secret")
+
+    try:
+        update = Update.model_validate(await request.json(), context={"bot": bot})
+    except (ValueError, ValidationError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid update: {e}")
+
+    if not webhook_processor.submit(update):
+        raise HTTPException(status_code=503, detail="Too many updates in progress")
+    return {"ok": True}
+
+
+async def set_webhook() -> None:
+    """
+    Регистрирует вебхук в Telegram: WEBHOOK_URL + WEBHOOK_PATH с секретом WEBHOOK_SECRET.
+
+    Вызов идемпотентный, поэтому его можно выполнять при старте каждого процесса.
+    """
+    config = settings.config
+    if not config.webhook_url or not config.webhook_secret:
+        raise ValueError("BOT_UPDATE_MODE=webhook requires WEBHOOK_URL and WEBHOOK_SECRET")
+
+    await bot.set_webhook(
+        url=config.webhook_url.rstrip("/") + config.webhook_path,
+        secret_token=config.webhook_secret,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=config.webhook_max_connections
+    )
@@ -0,0 +1,67 @@
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+from app.core.config import settings
+import time
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Простой in-memory кэш с ограничением по времени жизни и размеру.
+
+    Записи хранятся в порядке последнего обращения: при превышении
+    maxsize вытесняется самая давно использованная запись (LRU).
+    ttl=None отключает истечение записей по времени.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Возвращает значение по ключу или default, если записи нет или она устарела."""
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            self.misses += 1
+            return default
+
+        value, expires_at = item
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Сохраняет значение, вытесняя самые старые записи при переполнении."""
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        """Удаляет запись из кэша, если она есть."""
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Полностью очищает кэш."""
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# Кэш членства пользователей: user_id -> зарегистрирован ли пользователь
+user_cache = TTLCache(
+    maxsize=settings.config.user_cache_size,
+    ttl=settings.config.user_cache_ttl
+)
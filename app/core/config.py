@@ -1,11 +1,93 @@
-from dataclasses import dataclass
-from environs import Env
+from dataclasses import dataclass, field
+from environs import Env, validate
+from typing import Optional
 
 @dataclass
 class Config:
     bot_token: str
     api_token: str
     DATABASE_URL: str
+    telegram_api_url: Optional[str] = None
+    api_keys: list = field(default_factory=list)
+    api_token_rate_limit: int = 0
+    auth_cache_size: int = 10_000
+    auth_cache_ttl: int = 60
+    user_cache_size: int = 100_000
+    user_cache_ttl: int = 300
+    log_queue_size: int = 10_000
+    log_batch_size: int = 500
+    log_flush_interval: float = 1.0
+    log_drop_policy: str = "drop_new"
+    log_put_timeout: float = 0.05
+    job_workers: int = 4
+    job_poll_interval: float = 1.0
+    job_lock_timeout: int = 300
+    schedule_release_rate: float = 200.0
+    schedule_release_batch: int = 100
+    schedule_max_sleep: float = 30.0
+    broadcast_concurrency: int = 20
+    tg_global_rate: float = 30.0
+    tg_chat_rate: float = 1.0
+    tg_chat_burst: float = 1.0
+    delivery_max_attempts: int = 5
+    delivery_sync_attempts: int = 3
+    delivery_backoff_base: float = 1.0
+    delivery_backoff_max: float = 300.0
+    file_id_cache_size: int = 10_000
+    template_cache_size: int = 1000
+    template_cache_ttl: int = 60
+    idempotency_ttl: int = 86400
+    idempotency_cache_size: int = 10_000
+    idempotency_lock_timeout: int = 300
+    http_pool_limit: int = 100
+    http_pool_per_host: int = 20
+    http_dns_ttl: int = 300
+    http_timeout: float = 60.0
+    http_connect_timeout: float = 10.0
+    media_max_bytes: int = 50 * 1024 * 1024
+    media_spool_threshold: int = 5 * 1024 * 1024
+    media_chunk_size: int = 64 * 1024
+    media_tmp_dir: Optional[str] = None
+    media_cache_dir: Optional[str] = None
+    media_cache_max_bytes: int = 1024 * 1024 * 1024
+    media_cache_default_ttl: int = 3600
+    run_mode: str = "all"
+    api_host: str = "0.0.0.0"
+    api_port: int = 8000
+    api_workers: int = 1
+    bot_update_mode: str = "polling"
+    webhook_url: Optional[str] = None
+    webhook_path: str = "/telegram/webhook"
+    webhook_secret: Optional[str] = None
+    webhook_concurrency: int = 50
+    webhook_max_pending: int = 1000
+    webhook_max_connections: int = 40
+    forward_concurrency: int = 10
+    forward_timeout: float = 10.0
+    forward_acquire_timeout: float = 1.0
+    forward_breaker_threshold: int = 5
+    forward_breaker_reset: float = 30.0
+    forward_batch_window: float = 0.05
+    forward_batch_max: int = 100
+    retention_interval: int = 3600
+    retention_batch_size: int = 1000
+    retention_batch_pause: float = 0.1
+    retention_archive_dir: Optional[str] = None
+    retention_vacuum: bool = False
+    logs_ttl_days: int = 30
+    notifications_ttl_days: int = 180
+    jobs_ttl_days: int = 30
+    minute_rollups_ttl_days: int = 7
+    dead_letters_ttl_days: int = 30
+    db_sqlite_journal_mode: str = "WAL"
+    db_sqlite_synchronous: str = "NORMAL"
+    db_busy_timeout: int = 5000
+    db_mmap_size: int = 256 * 1024 * 1024
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout: float = 30.0
+    db_pool_recycle: int = 1800
+    db_statement_cache_size: int = 500
 
 @dataclass
 class Settings:
@@ -19,7 +101,88 @@ def get_settings(path: str = None):
         config=Config(
             bot_token=env.str("TOKEN_BOT"),
             api_token=env.str("API_TOKEN"),
-            DATABASE_URL=env.str("DATABASE_URL")
+            DATABASE_URL=env.str("DATABASE_URL"),
+            telegram_api_url=env.str("TELEGRAM_API_URL", None),
+            api_keys=env.json("API_KEYS", []),
+            api_token_rate_limit=env.int("API_TOKEN_RATE_LIMIT", 0),
+            auth_cache_size=env.int("AUTH_CACHE_SIZE", 10_000),
+            auth_cache_ttl=env.int("AUTH_CACHE_TTL", 60),
+            user_cache_size=env.int("USER_CACHE_SIZE", 100_000),
+            user_cache_ttl=env.int("USER_CACHE_TTL", 300),
+            log_queue_size=env.int("LOG_QUEUE_SIZE", 10_000),
+            log_batch_size=env.int("LOG_BATCH_SIZE", 500),
+            log_flush_interval=env.float("LOG_FLUSH_INTERVAL", 1.0),
+            log_drop_policy=env.str("LOG_DROP_POLICY", "drop_new"),
+            log_put_timeout=env.float("LOG_PUT_TIMEOUT", 0.05),
+            job_workers=env.int("JOB_WORKERS", 4),
+            job_poll_interval=env.float("JOB_POLL_INTERVAL", 1.0),
+            job_lock_timeout=env.int("JOB_LOCK_TIMEOUT", 300),
+            schedule_release_rate=env.float("SCHEDULE_RELEASE_RATE", 200.0),
+            schedule_release_batch=env.int("SCHEDULE_RELEASE_BATCH", 100),
+            schedule_max_sleep=env.float("SCHEDULE_MAX_SLEEP", 30.0),
+            broadcast_concurrency=env.int("BROADCAST_CONCURRENCY", 20),
+            tg_global_rate=env.float("TG_GLOBAL_RATE", 30.0, validate=validate.Range(min=0, min_inclusive=False)),
+            tg_chat_rate=env.float("TG_CHAT_RATE", 1.0, validate=validate.Range(min=0, min_inclusive=False)),
+            tg_chat_burst=env.float("TG_CHAT_BURST", 1.0, validate=validate.Range(min=1)),
+            delivery_max_attempts=env.int("DELIVERY_MAX_ATTEMPTS", 5),
+            delivery_sync_attempts=env.int("DELIVERY_SYNC_ATTEMPTS", 3),
+            delivery_backoff_base=env.float("DELIVERY_BACKOFF_BASE", 1.0),
+            delivery_backoff_max=env.float("DELIVERY_BACKOFF_MAX", 300.0),
+            file_id_cache_size=env.int("FILE_ID_CACHE_SIZE", 10_000),
+            template_cache_size=env.int("TEMPLATE_CACHE_SIZE", 1000),
+            template_cache_ttl=env.int("TEMPLATE_CACHE_TTL", 60),
+            idempotency_ttl=env.int("IDEMPOTENCY_TTL", 86400),
+            idempotency_cache_size=env.int("IDEMPOTENCY_CACHE_SIZE", 10_000),
+            idempotency_lock_timeout=env.int("IDEMPOTENCY_LOCK_TIMEOUT", 300),
+            http_pool_limit=env.int("HTTP_POOL_LIMIT", 100),
+            http_pool_per_host=env.int("HTTP_POOL_PER_HOST", 20),
+            http_dns_ttl=env.int("HTTP_DNS_TTL", 300),
+            http_timeout=env.float("HTTP_TIMEOUT", 60.0),
+            http_connect_timeout=env.float("HTTP_CONNECT_TIMEOUT", 10.0),
+            media_max_bytes=env.int("MEDIA_MAX_BYTES", 50 * 1024 * 1024),
+            media_spool_threshold=env.int("MEDIA_SPOOL_THRESHOLD", 5 * 1024 * 1024),
+            media_chunk_size=env.int("MEDIA_CHUNK_SIZE", 64 * 1024),
+            media_tmp_dir=env.str("MEDIA_TMP_DIR", None),
+            media_cache_dir=env.str("MEDIA_CACHE_DIR", None),
+            media_cache_max_bytes=env.int("MEDIA_CACHE_MAX_BYTES", 1024 * 1024 * 1024),
+            media_cache_default_ttl=env.int("MEDIA_CACHE_DEFAULT_TTL", 3600),
+            run_mode=env.str("RUN_MODE", "all"),
+            api_host=env.str("API_HOST", "0.0.0.0"),
+            api_port=env.int("API_PORT", 8000),
+            api_workers=env.int("API_WORKERS", 1),
+            bot_update_mode=env.str("BOT_UPDATE_MODE", "polling"),
+            webhook_url=env.str("WEBHOOK_URL", None),
+            webhook_path=env.str("WEBHOOK_PATH", "/telegram/webhook"),
+            webhook_secret=env.str("WEBHOOK_SECRET", None),
+            webhook_concurrency=env.int("WEBHOOK_CONCURRENCY", 50),
+            webhook_max_pending=env.int("WEBHOOK_MAX_PENDING", 1000),
+            webhook_max_connections=env.int("WEBHOOK_MAX_CONNECTIONS", 40),
+            forward_concurrency=env.int("FORWARD_CONCURRENCY", 10),
+            forward_timeout=env.float("FORWARD_TIMEOUT", 10.0),
+            forward_acquire_timeout=env.float("FORWARD_ACQUIRE_TIMEOUT", 1.0),
+            forward_breaker_threshold=env.int("FORWARD_BREAKER_THRESHOLD", 5),
+            forward_breaker_reset=env.float("FORWARD_BREAKER_RESET", 30.0),
+            forward_batch_window=env.float("FORWARD_BATCH_WINDOW", 0.05),
+            forward_batch_max=env.int("FORWARD_BATCH_MAX", 100),
+            retention_interval=env.int("RETENTION_INTERVAL", 3600),
+            retention_batch_size=env.int("RETENTION_BATCH_SIZE", 1000),
+            retention_batch_pause=env.float("RETENTION_BATCH_PAUSE", 0.1),
+            retention_archive_dir=env.str("RETENTION_ARCHIVE_DIR", None),
+            retention_vacuum=env.bool("RETENTION_VACUUM", False),
+            logs_ttl_days=env.int("LOGS_TTL_DAYS", 30),
+            notifications_ttl_days=env.int("NOTIFICATIONS_TTL_DAYS", 180),
+            jobs_ttl_days=env.int("JOBS_TTL_DAYS", 30),
+            minute_rollups_ttl_days=env.int("MINUTE_ROLLUPS_TTL_DAYS", 7),
+            dead_letters_ttl_days=env.int("DEAD_LETTERS_TTL_DAYS", 30),
+            db_sqlite_journal_mode=env.str("DB_SQLITE_JOURNAL_MODE", "WAL"),
+            db_sqlite_synchronous=env.str("DB_SQLITE_SYNCHRONOUS", "NORMAL"),
+            db_busy_timeout=env.int("DB_BUSY_TIMEOUT", 5000),
+            db_mmap_size=env.int("DB_MMAP_SIZE", 256 * 1024 * 1024),
+            db_pool_size=env.int("DB_POOL_SIZE", 10),
+            db_max_overflow=env.int("DB_MAX_OVERFLOW", 20),
+            db_pool_timeout=env.float("DB_POOL_TIMEOUT", 30.0),
+            db_pool_recycle=env.int("DB_POOL_RECYCLE", 1800),
+            db_statement_cache_size=env.int("DB_STATEMENT_CACHE_SIZE", 500)
         )
     )
 
@@ -0,0 +1,125 @@
+from contextlib import asynccontextmanager
+from app.core.config import settings
+from typing import AsyncIterator, Optional
+import aiohttp
+import asyncio
+
+
+class HttpClient:
+    """
+    Общий HTTP-клиент с пулом соединений для всех исходящих запросов сервиса.
+
+    Один ClientSession на процесс: keep-alive соединения переиспользуются,
+    DNS-ответы кэшируются на dns_ttl секунд, а число соединений ограничено
+    как в целом (limit), так и на каждый хост (limit_per_host).
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        limit_per_host: int,
+        dns_ttl: int,
+        timeout: float,
+        connect_timeout: float
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.requests_total = 0
+        self.errors_total = 0
+        self.bytes_received = 0
+        self.in_flight = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Возвращает сессию, создавая ее при первом обращении."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                ssl=False,  # Отключаем SSL проверку, как и раньше
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_ttl,
+                use_dns_cache=True
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout, connect=self.connect_timeout)
+            )
+        return self._session
+
+    def start(self) -> None:
+        """Создает сессию заранее (вызывается в lifespan приложения)."""
+        self.session
+
+    async def close(self) -> None:
+        """Закрывает сессию и все соединения пула."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @asynccontextmanager
+    async def request(self, method: str, url: str, **kwargs) -> AsyncIterator[aiohttp.ClientResponse]:
+        """
+        Выполняет запрос через общий пул, учитывая его в статистике.
+
+        Использование:
+            async with http_client.request("GET", url) as response:
+                ...
+        """
+        self.requests_total += 1
+        self.in_flight += 1
+        try:
+            async with self.session.request(method, url, **kwargs) as response:
+                yield response
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.errors_total += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    def stats(self) -> dict:
+        """Статистика использования пула соединений."""
+        connector = self._session.connector if self._session is not None else None
+        acquired = len(getattr(connector, "_acquired", ())) if connector is not None else 0
+        idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values()) if connector is not None else 0
+        return {
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "connections_in_use": acquired,
+            "connections_idle": idle,
+            "in_flight": self.in_flight,
+            "requests_total": self.requests_total,
+            "errors_total": self.errors_total,
+            "bytes_received": self.bytes_received
+        }
+
+
+def origin_error(response: aiohttp.ClientResponse) -> Optional[aiohttp.ClientResponseError]:
+    """
+    Причина для ошибки неуспешной загрузки файла: для 5xx и 429 - ClientResponseError,
+    чтобы classify_error считала ошибку временной; для остальных кодов - None.
+
+    Использование:
+        raise ValueError(f"Ошибка загрузки: {response.status}") from origin_error(response)
+    """
+    if response.status < 500 and response.status != 429:
+        return None
+    return aiohttp.ClientResponseError(
+        response.request_info,
+        response.history,
+        status=response.status,
+        message=response.reason or "",
+        headers=response.headers
+    )
+
+
+http_client = HttpClient(
+    limit=settings.config.http_pool_limit,
+    limit_per_host=settings.config.http_pool_per_host,
+    dns_ttl=settings.config.http_dns_ttl,
+    timeout=settings.config.http_timeout,
+    connect_timeout=settings.config.http_connect_timeout
+)
@@ -1,18 +1,164 @@
 from app.db.models import LogsJson
-from app.db.database import add_to_table
+from app.db.database import add_many_to_table
+from app.core.config import settings
+from datetime import datetime
+from typing import List, Optional
+import asyncio
+
+
+class LogSink:
+    """
+    Асинхронный буферизованный приемник логов.
+
+    Записи складываются в ограниченную очередь в памяти, а фоновая задача
+    сбрасывает их в таблицу LogsJson пачками: по достижении batch_size
+    или по истечении flush_interval секунд.
+
+    Политики переполнения очереди (drop_policy):
+    - "drop_new" - новая запись отбрасывается;
+    - "drop_oldest" - вытесняется самая старая запись;
+    - "block" - ожидание свободного места не дольше put_timeout, затем запись отбрасывается.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        batch_size: int,
+        flush_interval: float,
+        drop_policy: str = "drop_new",
+        put_timeout: float = 0.05
+    ):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.drop_policy = drop_policy
+        self.put_timeout = put_timeout
+        self.dropped = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self) -> None:
+        """Запускает фоновую задачу сброса логов в текущем event loop."""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает приемник, гарантированно сбрасывая все накопленные записи."""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def put(self, entry: dict) -> bool:
+        """
+        Ставит запись в очередь, не дожидаясь записи в базу данных.
+
+        Возвращает:
+        - True, если запись принята, False, если она отброшена политикой переполнения.
+        """
+        if not self.running:
+            self.start()
+
+        try:
+            self._queue.put_nowait(entry)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if self.drop_policy == "drop_oldest":
+            try:
+                self._queue.get_nowait()
+                self.dropped += 1
+            except asyncio.QueueEmpty:
+                pass
+            try:
+                self._queue.put_nowait(entry)
+                return True
+            except asyncio.QueueFull:
+                pass
+        elif self.drop_policy == "block":
+            try:
+                await asyncio.wait_for(self._queue.put(entry), self.put_timeout)
+                return True
+            except asyncio.TimeoutError:
+                pass
+
+        self.dropped += 1
+        return False
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            entry = await self._queue.get()
+            if entry is None:
+                return
+
+            batch = [entry]
+            deadline = loop.time() + self.flush_interval
+            closing = False
+            while len(batch) < self.batch_size:
+                try:
+                    entry = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        entry = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if entry is None:
+                    closing = True
+                    break
+                batch.append(entry)
+
+            await self._write(batch)
+            if closing:
+                return
+
+    async def _write(self, batch: List[dict]) -> None:
+        try:
+            await add_many_to_table(LogsJson, batch)
+        except Exception as e:
+            # Логировать ошибку записи логов в базу некуда, поэтому только печатаем
+            print(f"Log sink flush error ({len(batch)} records lost): {str(e)}")
+
+
+log_sink = LogSink(
+    maxsize=settings.config.log_queue_size,
+    batch_size=settings.config.log_batch_size,
+    flush_interval=settings.config.log_flush_interval,
+    drop_policy=settings.config.log_drop_policy,
+    put_timeout=settings.config.log_put_timeout
+)
 
 
 async def logs_bot(TypeLog: str, Text: str) -> None:
     """
     Логирует сообщения в базу данных.
 
+    Запись ставится в очередь log_sink и сохраняется фоновой задачей пачкой,
+    поэтому вызывающий код не ждет записи в базу.
+
     Аргументы:
         TypeLog: str - Уровень логирования (например, "error", "warning", "info", "debug").
         Text: str - Сообщение для логирования.
     """
     valid_log_types = ["error", "warning", "info", "debug"]
     if TypeLog.lower() not in valid_log_types:
-        TypeLog = "warning"  
+        TypeLog = "warning"
 
-    log_entry = LogsJson(data={"level": TypeLog, "message": Text})
-    await add_to_table(LogsJson, {"data": log_entry.data})  # Оборачиваем log_entry.data в словарь
+    await log_sink.put({
+        "data": {"level": TypeLog, "message": Text},
+        "created_at": datetime.now().replace(second=0, microsecond=0)
+    })
@@ -0,0 +1,221 @@
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import time
+
+
+# Границы по умолчанию (секунды): от миллисекунд для запросов к базе до десятков секунд для загрузки медиа
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """
+    Монотонный счетчик с метками.
+
+    Значения хранятся в словаре по кортежу значений меток, без блокировок:
+    все обновления выполняются в одном event loop.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self._values.items():
+            yield f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными границами корзин.
+
+    observe() - один bisect и три сложения; кумулятивные значения корзин
+    считаются только при выдаче /metrics.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        item = self._values.get(labels)
+        if item is None:
+            # [счетчики корзин (+Inf последней), сумма, количество]
+            item = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        item[0][bisect_left(self.buckets, value)] += 1
+        item[1] += value
+        item[2] += 1
+
+    def samples(self) -> Iterable[str]:
+        for labels, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                yield f"{self.name}_bucket{format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{format_labels(self.labelnames, labels)} {count}"
+
+
+class Gauge(Counter):
+    """Значение, которое может как расти, так и уменьшаться (устанавливается через set)."""
+
+    kind = "gauge"
+
+    def set(self, value: float, *labels) -> None:
+        self._values[labels] = value
+
+
+class CallbackMetric:
+    """
+    Метрика, значения которой снимаются функцией в момент запроса /metrics
+    (глубина очередей, размеры кэшей, счетчики, которые ведут сами компоненты).
+
+    collect() возвращает список пар (кортеж значений меток, значение).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        collect: Callable[[], List[Tuple[Tuple, float]]],
+        labelnames: Iterable[str] = (),
+        kind: str = "gauge"
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self.collect():
+            yield f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+
+
+class MetricsRegistry:
+    """Реестр метрик процесса и выдача их в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Optional[Tuple[float, ...]] = None
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets or DEFAULT_BUCKETS))
+
+    def callback(
+        self,
+        name: str,
+        documentation: str,
+        collect: Callable[[], List[Tuple[Tuple, float]]],
+        labelnames: Iterable[str] = (),
+        kind: str = "gauge"
+    ) -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, collect, labelnames, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: число и длительность HTTP-запросов по шаблону маршрута
+    (/chat/jobs/{job_id}, а не конкретный URL), чтобы число рядов не росло.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, scope["method"], route)
+            HTTP_REQUESTS.inc(scope["method"], route, status)
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUESTS = registry.counter(
+    "http_requests_total", "HTTP requests handled by the API", ("method", "route", "status")
+)
+HTTP_REQUEST_DURATION = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route")
+)
+TELEGRAM_SEND_DURATION = registry.histogram(
+    "telegram_send_duration_seconds", "Telegram send latency including rate limiting", ("message_type",)
+)
+TELEGRAM_SEND_ERRORS = registry.counter(
+    "telegram_send_errors_total", "Failed Telegram sends", ("message_type", "kind")
+)
+MEDIA_DOWNLOAD_BYTES = registry.counter(
+    "media_download_bytes_total", "Bytes downloaded from media origins"
+)
+MEDIA_DOWNLOAD_DURATION = registry.histogram(
+    "media_download_duration_seconds", "Media download time"
+)
+DB_QUERY_DURATION = registry.histogram(
+    "db_query_duration_seconds", "Database statement latency", ("operation",)
+)
@@ -0,0 +1,205 @@
+from aiogram.exceptions import TelegramRetryAfter
+from app.core.config import settings
+from app.core.logging import logs_bot
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class TokenBucket:
+    """
+    Классический token bucket: rate токенов в секунду, не больше capacity.
+
+    Кроме того, поддерживает принудительную паузу (pause) на время,
+    указанное Telegram в ответе 429 (retry_after).
+
+    Емкость не меньше одного токена: иначе bucket никогда не накопил бы
+    целый токен и ожидание не заканчивалось бы. Неположительный rate - ValueError.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        if rate <= 0:
+            raise ValueError(f"Token bucket rate must be positive, got {rate}")
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Сколько секунд ждать до появления токена (без списания)."""
+        now = time.monotonic()
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self) -> None:
+        """Списывает один токен."""
+        self._refill(time.monotonic())
+        self.tokens -= 1
+
+    def reserve(self) -> float:
+        """
+        Резервирует токен заранее и возвращает, сколько секунд нужно подождать
+        до его использования. Баланс может уйти в минус - следующие вызовы
+        будут ждать соответственно дольше.
+        """
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def pause(self, seconds: float) -> None:
+        """Блокирует bucket на seconds секунд."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle(self) -> bool:
+        """True, если bucket полон и не заблокирован - его можно безопасно удалить."""
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class TelegramScheduler:
+    """
+    Общий планировщик вызовов Bot API.
+
+    Каждый вызов сначала ждет токен в bucket своего чата, затем встает
+    в глобальную очередь с приоритетами (high, normal, low), которую
+    разбирает диспетчер со скоростью глобального bucket. Ответ 429
+    (TelegramRetryAfter) означает flood wait всего бота: на retry_after
+    ставятся на паузу и чат, и глобальный bucket, а ошибка пробрасывается.
+    Повторы 429 выполняет только слой доставки (send_with_retry,
+    broadcast_content, очередь задач) с паузой не меньше retry_after.
+    """
+
+    PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+    def __init__(
+        self,
+        global_rate: float,
+        chat_rate: float,
+        chat_burst: float,
+        max_chats: int = 100_000
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_chats = max_chats
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: OrderedDict = OrderedDict()
+        self._waiters: list = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def waiting(self) -> int:
+        """Количество вызовов, ожидающих глобальный токен."""
+        return len(self._waiters)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            # Удаляем самые старые простаивающие bucket'ы, чтобы словарь не рос бесконечно
+            while len(self._chats) > self.max_chats:
+                oldest_id, oldest = next(iter(self._chats.items()))
+                if not oldest.idle():
+                    break
+                del self._chats[oldest_id]
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _acquire_global(self, priority: int) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._dispatch())
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._wakeup.set()
+        await future
+
+    async def _dispatch(self) -> None:
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            wait = self._global.wait_time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                # Вызывающая задача отменена, токен не тратим
+                continue
+            self._global.take()
+            future.set_result(None)
+
+    async def send(
+        self,
+        method: Callable[..., Awaitable[Any]],
+        *,
+        chat_id: int,
+        priority: str = "normal",
+        **kwargs
+    ) -> Any:
+        """
+        Выполняет method(chat_id=chat_id, **kwargs) с соблюдением лимитов Telegram.
+
+        Параметры:
+        - method: метод бота (bot.send_message, bot.send_photo и т.д.).
+        - chat_id: ID чата получателя.
+        - priority: приоритет отправки - high, normal или low.
+        """
+        lane = self.PRIORITIES.get(priority, self.PRIORITIES["normal"])
+        delay = self._chat_bucket(chat_id).reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self._acquire_global(lane)
+
+        try:
+            return await method(chat_id=chat_id, **kwargs)
+        except TelegramRetryAfter as e:
+            self._chat_bucket(chat_id).pause(e.retry_after)
+            self._global.pause(e.retry_after)
+            await logs_bot("warning", f"Telegram flood limit for chat {chat_id}, sending paused for {e.retry_after}s")
+            raise
+
+
+def process_global_rate(config) -> float:
+    """
+    Доля TG_GLOBAL_RATE одного процесса.
+
+    Лимит Telegram общий для бота, а корзина у каждого процесса своя. В режиме
+    all отправляет один процесс. В режимах api и bot с поллингом отправляют
+    API_WORKERS процессов API и процесс бота (ответы на /start), при вебхуке -
+    только процессы API; лимит делится между ними поровну.
+    Неположительный TG_GLOBAL_RATE - ValueError.
+    """
+    if config.tg_global_rate <= 0:
+        raise ValueError(f"TG_GLOBAL_RATE must be positive, got {config.tg_global_rate}")
+    if config.run_mode == "all":
+        return config.tg_global_rate
+    senders = max(config.api_workers, 1)
+    if config.bot_update_mode != "webhook":
+        senders += 1
+    return config.tg_global_rate / senders
+
+
+scheduler = TelegramScheduler(
+    global_rate=process_global_rate(settings.config),
+    chat_rate=settings.config.tg_chat_rate,
+    chat_burst=settings.config.tg_chat_burst
+)
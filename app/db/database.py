@@ -1,12 +1,81 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy import event, insert, update, inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
-from typing import Any, List, Optional
+from app.core.metrics import DB_QUERY_DURATION
+from typing import Any, AsyncIterator, Dict, List, Optional
+from datetime import datetime, timezone
 import os
-from app.db.models import Base
+import time
+from app.db.models import Base, User
+from app.core.cache import user_cache
+
+def get_engine_options(database_url: str) -> dict:
+    """
+    Профиль движка для текущего бэкенда.
+
+    SQLite: кэш подготовленных выражений драйвера (cached_statements),
+    остальные настройки задаются PRAGMA при подключении (см. set_sqlite_pragmas).
+    PostgreSQL и другие серверные базы: размер пула, overflow, таймаут
+    ожидания соединения, переподключение старых соединений и кэш
+    подготовленных выражений asyncpg.
+    """
+    config = settings.config
+    url = make_url(database_url)
+    options = {"echo": False}
+
+    if url.get_backend_name() == "sqlite":
+        options["connect_args"] = {"cached_statements": config.db_statement_cache_size}
+        return options
+
+    options.update(
+        pool_size=config.db_pool_size,
+        max_overflow=config.db_max_overflow,
+        pool_timeout=config.db_pool_timeout,
+        pool_recycle=config.db_pool_recycle,
+        pool_pre_ping=True
+    )
+    if url.get_driver_name() == "asyncpg":
+        options["connect_args"] = {"prepared_statement_cache_size": config.db_statement_cache_size}
+    return options
+
+engine = create_async_engine(settings.config.DATABASE_URL, **get_engine_options(settings.config.DATABASE_URL))
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        """
+        Настраивает каждое новое соединение SQLite.
+
+        WAL позволяет читать во время записи, synchronous=NORMAL в WAL-режиме
+        безопасен и убирает fsync на каждый коммит, busy_timeout заставляет
+        ждать освобождения блокировки вместо ошибки "database is locked",
+        mmap_size ускоряет чтение через отображение файла в память.
+        """
+        config = settings.config
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={config.db_sqlite_journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={config.db_sqlite_synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(config.db_busy_timeout)}")
+        cursor.execute(f"PRAGMA mmap_size={int(config.db_mmap_size)}")
+        cursor.close()
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started_at = time.perf_counter()
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def observe_query_time(conn, cursor, statement, parameters, context, executemany):
+    """Длительность запроса по типу операции (SELECT, INSERT, UPDATE, ...)."""
+    started_at = getattr(context, "_query_started_at", None)
+    if started_at is not None:
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        DB_QUERY_DURATION.observe(time.perf_counter() - started_at, operation)
 
-engine = create_async_engine(settings.config.DATABASE_URL, echo=False)
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 async def init_db():
@@ -14,62 +83,166 @@ async def init_db():
     Инициализирует базу данных, создавая необходимые директории и таблицы.
     
     Проверяет наличие директории для базы данных и создает её, если она отсутствует.
-    Затем выполняет создание всех таблиц, определенных в модели базы данных.
+    Затем выполняет создание всех таблиц, определенных в модели базы данных,
+    и добавляет в существующие таблицы новые колонки и индексы (upgrade_schema).
     
     Возвращает:
         None: Функция не возвращает значения.
     """
-    db_dir = os.path.dirname(settings.config.DATABASE_URL.replace('sqlite:///', ''))
+    url = make_url(settings.config.DATABASE_URL)
+    db_dir = os.path.dirname(url.database or '') if url.get_backend_name() == 'sqlite' else ''
     if db_dir and not os.path.exists(db_dir) and 'sandbox/db' not in db_dir:
         os.makedirs(db_dir)
 
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
+
+# Колонки, добавленные в уже существующие таблицы: create_all их не создает
+UPGRADE_COLUMNS = [
+    ("notifications", "status"),
+    ("users", "unreachable_at"),
+    ("notification_jobs", "next_attempt_at"),
+]
 
+def upgrade_schema(conn) -> None:
+    """
+    Идемпотентное обновление существующей базы без миграций.
+
+    Добавляет колонки из UPGRADE_COLUMNS (ALTER TABLE ... ADD COLUMN с типом
+    и значением по умолчанию из модели), если их еще нет, и создает
+    отсутствующие индексы всех таблиц (CREATE INDEX с проверкой существования).
+    """
+    inspector = inspect(conn)
+    for table_name, column_name in UPGRADE_COLUMNS:
+        existing = {column["name"] for column in inspector.get_columns(table_name)}
+        if column_name in existing:
+            continue
+
+        column = Base.metadata.tables[table_name].columns[column_name]
+        ddl = f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column.type.compile(dialect=conn.dialect)}"
+        if column.server_default is not None:
+            ddl += f" DEFAULT '{column.server_default.arg}'"
+            if not column.nullable:
+                ddl += " NOT NULL"
+        conn.execute(text(ddl))
+        print(f"Database upgraded: added column {table_name}.{column_name}")
+
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def get_conflict_columns(table_class: object, keys) -> List[str]:
+    """
+    Возвращает уникальные колонки таблицы, присутствующие в данных.
+    По ним строится ON CONFLICT для upsert.
+    """
+    return [
+        column.name
+        for column in table_class.__table__.columns
+        if column.unique and column.name in keys
+    ]
+
+def build_insert(table_class: object, keys) -> Any:
+    """
+    Строит INSERT для текущего диалекта.
+    
+    Если в данных есть уникальные колонки, на SQLite и PostgreSQL
+    добавляется ON CONFLICT DO UPDATE, обновляющий остальные переданные колонки.
+    """
+    conflict_columns = get_conflict_columns(table_class, keys)
+    dialect = engine.dialect.name
+    if not conflict_columns or dialect not in ("sqlite", "postgresql"):
+        return insert(table_class)
+
+    dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    stmt = dialect_insert(table_class)
+    update_columns = {
+        key: stmt.excluded[key] for key in keys if key not in conflict_columns
+    } or {conflict_columns[0]: stmt.excluded[conflict_columns[0]]}  # чтобы RETURNING вернул строку
+    return stmt.on_conflict_do_update(index_elements=conflict_columns, set_=update_columns)
 
 async def add_to_table(table_class: object, data: dict) -> Any:
     """
     Общая функция для добавления данных в любую таблицу с проверкой  
     
+    Выполняется одним запросом: INSERT ... RETURNING, а для таблиц с уникальными
+    колонками (например, users.user_id) - INSERT ... ON CONFLICT DO UPDATE ... RETURNING.
+    
     Аргументы:
         table_class: Base - Класс модели SQLAlchemy
         data: dict - Данные для вставки
         
     Возвращает:
-        Созданную или существующую запись или False, если не удалось вставить данные
+        Созданную или обновленную запись или False, если не удалось вставить данные
     """
     
     async with async_session() as session:
-        if 'user_id' in data:
-            # Проверяем, существует ли запись с этим chat_id
-            existing = await session.execute(
-                select(table_class).where(
-                    table_class.user_id == data['user_id']
-                )
-            )
-
-            existing_record: Optional[object] = existing.scalar_one_or_none()
-            
-            if existing_record:
-                # Обновляем существующую запись
-                for key, value in data.items():
-                    setattr(existing_record, key, value)
-                await session.commit()
-                return existing_record
-        
-        # Проверяем, можно ли создать новую запись
         try:
-            new_record: object = table_class(**data)
-            session.add(new_record)
+            stmt = build_insert(table_class, data.keys()).values(**data).returning(table_class)
+            record = (await session.scalars(
+                stmt, execution_options={"populate_existing": True}
+            )).one()
             await session.commit()
-            await session.refresh(new_record)
-            return new_record
+            return record
         except Exception as e:
             # Если не удалось вставить данные, возвращаем False
             #await logs_bot("error", f"Database insertion error: {str(e)}")
             print(f"Database insertion error: {str(e)}")
             return False
 
+async def add_many_to_table(table_class: object, rows: List[dict]) -> int:
+    """
+    Пакетная вставка строк в таблицу одним INSERT-запросом (executemany).
+    
+    Для таблиц с уникальными колонками выполняется пакетный upsert
+    (ON CONFLICT DO UPDATE). Все строки должны содержать одинаковый набор ключей.
+    
+    Аргументы:
+        table_class: Base - Класс модели SQLAlchemy
+        rows: List[dict] - Список словарей с данными для вставки
+        
+    Возвращает:
+        int: Количество вставленных или обновленных строк
+    """
+    if not rows:
+        return 0
+
+    async with async_session() as session:
+        await session.execute(build_insert(table_class, rows[0].keys()), rows)
+        await session.commit()
+    return len(rows)
+
+async def increment_counters(table_class: object, rows: List[dict], key_columns: List[str], counter_column: str) -> int:
+    """
+    Пакетно увеличивает счетчики одним запросом
+    INSERT ... ON CONFLICT (key_columns) DO UPDATE SET counter = counter + excluded.counter.
+    
+    Аргументы:
+        table_class: Base - Класс модели SQLAlchemy с уникальным индексом по key_columns
+        rows: List[dict] - Строки с ключевыми колонками и приращением counter_column
+        key_columns: List[str] - Колонки уникального индекса
+        counter_column: str - Колонка счетчика
+        
+    Возвращает:
+        int: Количество обработанных строк
+    """
+    if not rows:
+        return 0
+
+    dialect_insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+    stmt = dialect_insert(table_class)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={counter_column: getattr(table_class, counter_column) + stmt.excluded[counter_column]}
+    )
+
+    async with async_session() as session:
+        await session.execute(stmt, rows)
+        await session.commit()
+    return len(rows)
+
 async def get_table_data(table_class: object) -> List[dict]:
     """
     Функция для получения данных из указанной таблицы в формате JSON.
@@ -85,6 +258,173 @@ async def get_table_data(table_class: object) -> List[dict]:
         records: List[object] = result.scalars().all()
         return [record.__dict__ for record in records]
 
+async def get_table_page(columns: List[Any], cursor_column: Any, after: Optional[Any] = None, limit: int = 100) -> List[dict]:
+    """
+    Возвращает одну страницу строк с keyset-пагинацией (WHERE cursor > after ORDER BY cursor LIMIT n).
+    
+    Выбираются только указанные колонки, без создания ORM-объектов.
+    
+    Аргументы:
+        columns: List - Колонки для выборки (например, [User.id, User.user_id])
+        cursor_column: Column - Уникальная упорядоченная колонка курсора (обычно первичный ключ)
+        after: Any - Значение курсора последней строки предыдущей страницы
+        limit: int - Размер страницы
+        
+    Возвращает:
+        Список словарей с данными строк
+    """
+    query = select(*columns).order_by(cursor_column).limit(limit)
+    if after is not None:
+        query = query.where(cursor_column > after)
+
+    async with async_session() as session:
+        result = await session.execute(query)
+        return [dict(row) for row in result.mappings()]
+
+async def stream_table_rows(columns: List[Any], cursor_column: Any, after: Optional[Any] = None, batch_size: int = 1000) -> AsyncIterator[dict]:
+    """
+    Потоково отдает строки таблицы через серверный курсор, не загружая всю таблицу в память.
+    
+    Аргументы:
+        columns: List - Колонки для выборки
+        cursor_column: Column - Колонка сортировки
+        after: Any - Начать со строк, у которых cursor_column > after
+        batch_size: int - Сколько строк забирать из курсора за раз
+    """
+    query = select(*columns).order_by(cursor_column).execution_options(yield_per=batch_size)
+    if after is not None:
+        query = query.where(cursor_column > after)
+
+    async with async_session() as session:
+        result = await session.stream(query)
+        async for row in result.mappings():
+            yield dict(row)
+
+async def user_exists(user_id: int) -> bool:
+    """
+    Проверяет, зарегистрирован ли пользователь с указанным user_id.
+    
+    Сначала смотрит в кэш членства пользователей, при промахе выполняет
+    точечный запрос по уникальному индексу users.user_id и кэширует результат.
+    
+    Аргументы:
+        user_id: int - Telegram ID пользователя
+        
+    Возвращает:
+        bool: True если пользователь найден
+    """
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    async with async_session() as session:
+        found = await session.scalar(
+            select(User.id).where(User.user_id == user_id).limit(1)
+        )
+
+    exists = found is not None
+    user_cache.set(user_id, exists)
+    return exists
+
+async def warm_user_cache() -> int:
+    """
+    Прогревает кэш членства пользователей при старте сервиса.
+    
+    Загружает только колонку user_id самых новых пользователей,
+    не больше размера кэша.
+    
+    Возвращает:
+        int: Количество загруженных пользователей
+    """
+    loaded = 0
+    async with async_session() as session:
+        result = await session.stream_scalars(
+            select(User.user_id).order_by(User.id.desc()).limit(user_cache.maxsize)
+        )
+        async for user_id in result:
+            user_cache.set(user_id, True)
+            loaded += 1
+    return loaded
+
+async def get_user_ids(
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    include_unreachable: bool = False
+) -> List[int]:
+    """
+    Возвращает список user_id пользователей без загрузки ORM-объектов.
+    
+    Аргументы:
+        created_after: datetime - Только пользователи, зарегистрированные не раньше этой даты
+        created_before: datetime - Только пользователи, зарегистрированные раньше этой даты
+        include_unreachable: bool - Включать пользователей, помеченных недоступными
+        
+    Возвращает:
+        Список user_id
+    """
+    query = select(User.user_id).order_by(User.id)
+    if not include_unreachable:
+        query = query.where(User.unreachable_at.is_(None))
+    if created_after is not None:
+        query = query.where(User.created_at >= created_after)
+    if created_before is not None:
+        query = query.where(User.created_at < created_before)
+
+    async with async_session() as session:
+        return list((await session.scalars(query)).all())
+
+async def get_unreachable_user_ids(user_ids: List[int], chunk_size: int = 500) -> set:
+    """
+    Возвращает те из user_ids, что помечены недоступными (бот заблокирован, чат не найден).
+    
+    Запрос выполняется частями по chunk_size, чтобы не упираться в лимит параметров.
+    """
+    unreachable = set()
+    async with async_session() as session:
+        for start in range(0, len(user_ids), chunk_size):
+            unreachable.update((await session.scalars(
+                select(User.user_id).where(
+                    User.user_id.in_(user_ids[start:start + chunk_size]),
+                    User.unreachable_at.is_not(None)
+                )
+            )).all())
+    return unreachable
+
+async def get_user_names(user_ids: List[int], chunk_size: int = 500) -> Dict[int, dict]:
+    """
+    Возвращает имена пользователей для персонализации шаблонов.
+    
+    Запрос выполняется частями по chunk_size; пользователей, которых нет в базе, в результате нет.
+
+    Возвращает:
+        {user_id: {"first_name": ..., "last_name": ...}}
+    """
+    names = {}
+    async with async_session() as session:
+        for start in range(0, len(user_ids), chunk_size):
+            result = await session.execute(
+                select(User.user_id, User.first_name, User.last_name)
+                .where(User.user_id.in_(user_ids[start:start + chunk_size]))
+            )
+            for user_id, first_name, last_name in result:
+                names[user_id] = {"first_name": first_name, "last_name": last_name}
+    return names
+
+async def mark_users_unreachable(user_ids: List[int]) -> None:
+    """
+    Помечает пользователей недоступными, чтобы рассылки их пропускали.
+    Пометка снимается, когда пользователь снова отправляет боту /start.
+    """
+    if not user_ids:
+        return
+    async with async_session() as session:
+        await session.execute(
+            update(User)
+            .where(User.user_id.in_(user_ids), User.unreachable_at.is_(None))
+            .values(unreachable_at=datetime.now(timezone.utc))
+        )
+        await session.commit()
+
 async def delete_table(table_class: object, user_id: str) -> bool:
     """
     Удаляет чат из базы данных по его идентификатору.
@@ -108,6 +448,8 @@ async def delete_table(table_class: object, user_id: str) -> bool:
             # Удаляем чат
             await session.delete(chat)
             await session.commit()
+            if table_class is User:
+                user_cache.invalidate(user_id)
             return True  # Успешно удалено
 
         except Exception as e:
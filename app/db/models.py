@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime,TIMESTAMP,JSON
+from sqlalchemy import Column, Integer, String, DateTime,TIMESTAMP,JSON, Index
 from sqlalchemy.sql import func
 from datetime import datetime
 
@@ -13,6 +13,7 @@ class User(Base):
     user_id = Column(Integer, unique=True, nullable=False)
     first_name = Column(String, nullable=True)
     last_name = Column(String, nullable=True)
+    unreachable_at = Column(DateTime(timezone=True), nullable=True)  # бот заблокирован / чат не найден
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 
@@ -22,8 +23,33 @@ class Notification(Base):
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, nullable=False)
     type_content = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="delivered", server_default="delivered")  # delivered/failed
     created_at = Column(DateTime(timezone=True), server_default=func.now()) 
 
+    __table_args__ = (
+        Index("ix_notifications_user_id_id", "user_id", "id"),
+        Index("ix_notifications_created_at", "created_at"),
+    )
+
+
+class NotificationRollup(Base):
+    __tablename__ = "notification_rollups"
+
+    id = Column(Integer, primary_key=True)
+    granularity = Column(String, nullable=False)  # minute/hour
+    bucket_start = Column(DateTime(timezone=True), nullable=False)
+    type_content = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index(
+            "ux_notification_rollups_bucket",
+            "granularity", "bucket_start", "type_content", "status",
+            unique=True
+        ),
+    )
+
 
 class LogsJson(Base):
     __tablename__ = "logs_json"
@@ -31,4 +57,79 @@ class LogsJson(Base):
     id = Column(Integer, primary_key=True)
     data = Column(JSON)
     created_at = Column(TIMESTAMP, default=lambda: datetime.now().replace(second=0, microsecond=0), nullable=False)
-    
\ No newline at end of file
+
+
+class NotificationJob(Base):
+    __tablename__ = "notification_jobs"
+
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(Integer, nullable=False)
+    broadcast_id = Column(String, nullable=True, index=True)
+    payload = Column(JSON, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # scheduled/pending/processing/delivered/failed/cancelled
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+    locked_at = Column(DateTime(timezone=True), nullable=True)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True)  # время отложенной отправки или повтора после временной ошибки
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_notification_jobs_status_id", "status", "id"),
+        Index("ix_notification_jobs_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+
+
+class DeadLetter(Base):
+    __tablename__ = "dead_letters"
+
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, nullable=True)
+    chat_id = Column(Integer, nullable=False)
+    broadcast_id = Column(String, nullable=True)
+    payload = Column(JSON, nullable=False)
+    reason = Column(String, nullable=False)  # permanent/unreachable/exhausted
+    error = Column(String, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    replayed_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_dead_letters_replayed_at_id", "replayed_at", "id"),
+    )
+
+
+class MediaFile(Base):
+    __tablename__ = "media_files"
+
+    id = Column(Integer, primary_key=True)
+    cache_key = Column(String, unique=True, nullable=False)  # "<media_type>:<url>"
+    media_type = Column(String, nullable=False)
+    url = Column(String, nullable=False)
+    file_id = Column(String, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class MessageTemplate(Base):
+    __tablename__ = "message_templates"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+    body = Column(String, nullable=False)  # текст с переменными {first_name}, разметка HTML
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class IdempotencyRecord(Base):
+    __tablename__ = "idempotency_keys"
+
+    id = Column(Integer, primary_key=True)
+    key = Column(String, unique=True, nullable=False)  # "<api key>:<путь>:<Idempotency-Key>"
+    request_hash = Column(String, nullable=False)
+    status_code = Column(Integer, nullable=True)  # NULL - запрос еще выполняется
+    response = Column(JSON, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_idempotency_keys_created_at", "created_at"),
+    )
@@ -0,0 +1,167 @@
+from fastapi import APIRouter, Query
+from sqlalchemy import func
+from sqlalchemy.future import select
+from app.db.database import async_session, add_many_to_table, increment_counters
+from app.db.models import Notification, NotificationRollup
+from collections import Counter
+from datetime import datetime, timezone
+from typing import List, Optional
+
+
+router = APIRouter()
+
+GRANULARITIES = {
+    "minute": lambda moment: moment.replace(second=0, microsecond=0),
+    "hour": lambda moment: moment.replace(minute=0, second=0, microsecond=0)
+}
+
+
+async def record_notifications(rows: List[dict]) -> None:
+    """
+    Сохраняет уведомления и инкрементально обновляет поминутные и почасовые счетчики.
+
+    Каждая строка: {"user_id": ..., "type_content": ..., "status": "delivered" | "failed"}.
+    Уведомления пишутся одним пакетным INSERT, а счетчики агрегируются в памяти
+    и применяются одним upsert-запросом, поэтому дашборды не сканируют сырую таблицу.
+    """
+    if not rows:
+        return
+
+    await add_many_to_table(Notification, rows)
+
+    now = datetime.now(timezone.utc)
+    counts = Counter((row["type_content"], row["status"]) for row in rows)
+    await increment_counters(
+        NotificationRollup,
+        [
+            {
+                "granularity": granularity,
+                "bucket_start": floor(now),
+                "type_content": type_content,
+                "status": status,
+                "count": count
+            }
+            for granularity, floor in GRANULARITIES.items()
+            for (type_content, status), count in counts.items()
+        ],
+        key_columns=["granularity", "bucket_start", "type_content", "status"],
+        counter_column="count"
+    )
+
+
+async def get_rollup_rows(
+    granularity: str,
+    since: Optional[datetime],
+    until: Optional[datetime],
+    type_content: Optional[str]
+) -> List[NotificationRollup]:
+    query = select(NotificationRollup).where(NotificationRollup.granularity == granularity)
+    if since is not None:
+        query = query.where(NotificationRollup.bucket_start >= GRANULARITIES[granularity](since))
+    if until is not None:
+        query = query.where(NotificationRollup.bucket_start < until)
+    if type_content is not None:
+        query = query.where(NotificationRollup.type_content == type_content)
+
+    async with async_session() as session:
+        return list((await session.scalars(query.order_by(NotificationRollup.bucket_start))).all())
+
+
+@router.get("/users/{user_id}/notifications")
+async def get_user_history(
+    user_id: int,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[int] = None
+):
+    """
+    История уведомлений пользователя, от новых к старым.
+
+    Использует индекс (user_id, id): cursor - id последнего уведомления
+    предыдущей страницы, next_cursor = null на последней странице.
+    """
+    query = (
+        select(Notification.id, Notification.type_content, Notification.status, Notification.created_at)
+        .where(Notification.user_id == user_id)
+        .order_by(Notification.id.desc())
+        .limit(limit)
+    )
+    if cursor is not None:
+        query = query.where(Notification.id < cursor)
+
+    async with async_session() as session:
+        rows = (await session.execute(query)).all()
+
+    return {
+        "user_id": user_id,
+        "notifications": [
+            {
+                "id": row.id,
+                "type_content": row.type_content,
+                "status": row.status,
+                "created_at": row.created_at.isoformat() if row.created_at else None
+            }
+            for row in rows
+        ],
+        "next_cursor": rows[-1].id if len(rows) == limit else None
+    }
+
+
+@router.get("/notifications/counts")
+async def get_notification_counts(
+    granularity: str = Query("hour", pattern="^(minute|hour)$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    type_content: Optional[str] = None
+):
+    """
+    Количество уведомлений по type_content во временных окнах (minute или hour).
+
+    Данные берутся из таблицы счетчиков notification_rollups.
+    """
+    buckets = {}
+    for row in await get_rollup_rows(granularity, since, until, type_content):
+        bucket = buckets.setdefault(row.bucket_start.isoformat(), {})
+        bucket[row.type_content] = bucket.get(row.type_content, 0) + row.count
+
+    return {
+        "granularity": granularity,
+        "buckets": [{"bucket_start": start, "counts": counts} for start, counts in buckets.items()]
+    }
+
+
+@router.get("/notifications/delivery")
+async def get_delivery_rates(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    type_content: Optional[str] = None
+):
+    """
+    Доля успешно доставленных уведомлений за период в разрезе type_content.
+
+    Считается по почасовым счетчикам notification_rollups.
+    """
+    query = (
+        select(NotificationRollup.type_content, NotificationRollup.status, func.sum(NotificationRollup.count))
+        .where(NotificationRollup.granularity == "hour")
+        .group_by(NotificationRollup.type_content, NotificationRollup.status)
+    )
+    if since is not None:
+        query = query.where(NotificationRollup.bucket_start >= GRANULARITIES["hour"](since))
+    if until is not None:
+        query = query.where(NotificationRollup.bucket_start < until)
+    if type_content is not None:
+        query = query.where(NotificationRollup.type_content == type_content)
+
+    async with async_session() as session:
+        rows = (await session.execute(query)).all()
+
+    stats = {}
+    for row_type, status, count in rows:
+        stats.setdefault(row_type, {"delivered": 0, "failed": 0})[status] = count
+
+    for item in stats.values():
+        total = item["delivered"] + item["failed"]
+        item["total"] = total
+        item["delivery_rate"] = round(item["delivered"] / total, 4) if total else None
+
+    return {"since": since, "until": until, "types": stats}
@@ -1,14 +1,34 @@
-from fastapi import APIRouter
-from app.db.database import get_table_data, add_to_table
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from app.db.database import (
+    user_exists,
+    get_user_ids,
+    get_unreachable_user_ids,
+    add_many_to_table,
+    get_table_page,
+    stream_table_rows
+)
+from app.core.cache import user_cache
+from app.core.config import settings
 from app.core.logging import logs_bot
-from app.Bot.handlers.keyboards.telegram_sender import (
-    send_message,
-    send_photo,
-    send_video,
-    send_animation,
-    send_document
+from app.services.delivery import get_message_params, send_with_retry, log_notification, broadcast_content
+from app.services.delivery_policy import get_dead_letters
+from app.services.jobs import (
+    enqueue_job,
+    enqueue_jobs,
+    get_job,
+    get_broadcast_stats,
+    replay_dead_letters,
+    cancel_scheduled_jobs
 )
-from app.db.models import User, Notification
+from app.services.templates import template_store, render_for_recipients, personalize
+from app.services.idempotency import idempotent
+from app.db.models import User
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import json
+import uuid
 
 
 router = APIRouter()
@@ -18,136 +38,133 @@ async def validate_and_log_request(http_message: dict):
     Валидация и логирование входящего запроса.
     
     Проверяет наличие обязательных полей и существование пользователя в базе данных.
-    Логирует информацию о полученном запросе.
+    Логирует информацию о полученном запросе. Наличие content проверяет get_message_params
+    (для текстовых сообщений с шаблоном он не нужен).
     """
     await logs_bot("info", f"Received request with data: {http_message}")
     
     # Проверяем наличие обязательных полей
-    required_fields = ["chat_id", "type", "content"]
+    required_fields = ["chat_id", "type"]
     for field in required_fields:
         if field not in http_message:
             raise ValueError(f"Missing required field: {field}")
             
-    users = await get_table_data(User)
-    user_exists = any(user["user_id"] == int(http_message["chat_id"]) for user in users)
-    
-    if not user_exists:
+    if not await user_exists(int(http_message["chat_id"])):
         await logs_bot("warning", f"User not found: {http_message['chat_id']}")
 
-def get_message_params(http_message: dict) -> dict:
+def get_send_at(http_message: dict) -> Optional[datetime]:
     """
-    Подготовка параметров сообщения.
-    
-    Проверяет корректность типа сообщения и формирует словарь с параметрами,
-    включая chat_id, content и caption.
-    """
-    valid_types = ["text", "photo", "video", "animation", "document"]
-    message_type = http_message.get("type")
-    if message_type not in valid_types:
-        raise ValueError(f"Invalid message type: {message_type}. Must be one of {valid_types}")
-        
-    return {
-        "message_type": message_type,
-        "chat_id": int(http_message["chat_id"]),
-        "content": http_message.get("content"),
-        "caption": http_message.get("caption", "")
-    }
+    Время отложенной отправки из запроса.
 
-# Общий обработчик для всех типов сообщений
-async def send_content(chat_id: int, params: dict):
+    send_at - ISO 8601; время без смещения считается в часовом поясе timezone
+    (например, "Europe/Moscow", по умолчанию UTC). delay - задержка в секундах.
+    Время в прошлом или нулевая задержка означают отправку сразу (None).
+
+    Возвращает:
+    - время в UTC или None.
     """
-    Отправляет контент пользователю в зависимости от типа сообщения.
-    
-    Определяет функцию-обработчик для каждого типа сообщения (text, photo, video, animation, document)
-    и вызывает соответствующую функцию отправки с необходимыми аргументами.
-    """
-    handlers = {
-        "text": {
-            "func": send_message,
-            "args": {"chat_id": chat_id, "text": params["content"]}
-        },
-        "photo": {
-            "func": send_photo,
-            "args": {
-                "photo": params["content"],
-                "caption": params.get("caption"),
-                "chat_id": chat_id
-            }
-        },
-        "video": {
-            "func": send_video,
-            "args": {
-                "video": params["content"],
-                "caption": params.get("caption"),
-                "chat_id": chat_id
-            }
-        },
-        "animation": {
-            "func": send_animation,
-            "args": {
-                "animation": params["content"],
-                "caption": params.get("caption", ""),
-                "chat_id": chat_id
-            }
-        },
-        "document": {
-            "func": send_document,
-            "args": {
-                "document": params["content"],
-                "caption": params.get("caption"),
-                "chat_id": chat_id
-            }
-        }
-    }
+    send_at = http_message.get("send_at")
+    delay = http_message.get("delay")
+    if send_at and delay is not None:
+        raise ValueError("Use either send_at or delay, not both")
 
-    message_type = params["message_type"]
-    if message_type not in handlers:
-        await logs_bot("warning", f"Unsupported message type: {message_type}")
-        raise ValueError(f"Unsupported message type: {message_type}")
+    now = datetime.now(timezone.utc)
+    if delay is not None:
+        delay = float(delay)
+        if delay < 0:
+            raise ValueError("delay must be non-negative")
+        return now + timedelta(seconds=delay) if delay > 0 else None
 
-    try:
-        handler = handlers[message_type]
-        await handler["func"](
-            **handler["args"]
-        )
-    except Exception as e:
-        await logs_bot("error", f"Error sending {message_type}: {str(e)}")
-        raise
+    if not send_at:
+        return None
+    moment = datetime.fromisoformat(send_at)
+    if moment.tzinfo is None:
+        try:
+            moment = moment.replace(tzinfo=ZoneInfo(http_message.get("timezone") or "UTC"))
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Unknown timezone: {http_message.get('timezone')}")
+    moment = moment.astimezone(timezone.utc)
+    return moment if moment > now else None
 
-async def log_notification(params: dict):
-    """
-    Сохраняет информацию об отправленном уведомлении в базу данных.
-    
-    Формирует запись уведомления с user_id и типом контента и добавляет её в таблицу Notification.
-    """
-    notification_entry = {
-        "user_id": params["chat_id"],
-        "type_content": params["message_type"],
+USER_COLUMNS = [User.id, User.user_id, User.first_name, User.last_name, User.created_at]
+
+def serialize_user(row: dict) -> dict:
+    return {
+        "user_id": row["user_id"],
+        "first_name": row["first_name"],
+        "last_name": row["last_name"],
+        "created_at": row["created_at"].isoformat() if row["created_at"] else None
     }
-    await add_to_table(Notification, notification_entry)
 
 @router.get("/users")
-async def get_users():
+async def get_users(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[int] = None,
+    output_format: str = Query("json", alias="format", pattern="^(json|ndjson)$")
+):
     """
-    Получает список всех пользователей из базы данных.
+    Получает список пользователей из базы данных.
     
-    Возвращает список пользователей с их user_id, first_name, last_name и created_at.
+    Возвращает пользователей с их user_id, first_name, last_name и created_at.
+    
+    - format=json: страница из limit пользователей и next_cursor для следующего запроса
+      (null, если это последняя страница);
+    - format=ndjson: потоковая выгрузка всех пользователей (начиная после cursor)
+      по одному JSON-объекту на строку.
     """
-    users = await get_table_data(User)
+    if output_format == "ndjson":
+        async def export():
+            async for row in stream_table_rows(USER_COLUMNS, User.id, after=cursor):
+                yield json.dumps(serialize_user(row), ensure_ascii=False) + "\n"
+
+        return StreamingResponse(export(), media_type="application/x-ndjson")
+
+    rows = await get_table_page(USER_COLUMNS, User.id, after=cursor, limit=limit)
     return {
+        "users": [serialize_user(row) for row in rows],
+        "next_cursor": rows[-1]["id"] if len(rows) == limit else None
+    }
+
+@router.post("/users/import")
+async def import_users(http_message: dict):
+    """
+    Пакетно регистрирует или обновляет пользователей одним upsert-запросом.
+
+    Формат запроса для /users/import:
+    {
         "users": [
+            {"user_id": ID пользователя, "first_name": "имя", "last_name": "фамилия"}
+        ]
+    }
+    """
+    try:
+        users = [
             {
-                "user_id": user["user_id"],
-                "first_name": user["first_name"],
-                "last_name": user["last_name"],
-                "created_at": user["created_at"].isoformat()
+                "user_id": int(user["user_id"]),
+                "first_name": user.get("first_name"),
+                "last_name": user.get("last_name")
             }
-            for user in users
+            for user in http_message.get("users") or []
         ]
-    }
+        imported = await add_many_to_table(User, users)
+        for user in users:
+            user_cache.invalidate(user["user_id"])
+
+        await logs_bot("info", f"Imported {imported} users")
+        return {"status": "success", "imported": imported}
+
+    except Exception as e:
+        error_msg = f"Error in users import endpoint: {str(e)}"
+        await logs_bot("error", error_msg)
+        return {"status": "error", "message": error_msg}
 
 @router.post("/message_answer")
-async def send_message_endpoint(http_message: dict):
+async def send_message_endpoint(
+    request: Request,
+    http_message: dict,
+    queue: bool = False,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
     """
     Эндпоинт для отправки различных типов сообщений пользователям.
     
@@ -157,20 +174,76 @@ async def send_message_endpoint(http_message: dict):
     3. Отправка контента пользователю.
     4. Логирование уведомления.
 
+    Временные ошибки (сеть, 5xx, 429) повторяются до delivery_sync_attempts раз
+    с экспоненциальной паузой; окончательно неудавшаяся отправка попадает
+    в dead_letters (GET /chat/dead_letters).
+
+    При queue=true сообщение сохраняется в очередь notification_jobs,
+    эндпоинт сразу отвечает 202 с job_id, а отправку выполняют воркеры.
+    Статус задачи можно получить через GET /chat/jobs/{job_id}.
+
     Формат запроса для /message_answer:
     {
         "chat_id": "ID пользователя",
-        "type": "(text/photo/video/animation/document)", 
-        "content": "содержимое сообщения",
-        "caption": "подпись (опционально)"
+        "type": "(text/photo/video/animation/document/media_group)", 
+        "content": "содержимое сообщения (для media_group - список URL или {type, url, caption})",
+        "caption": "подпись (опционально)",
+        "priority": "(high/normal/low, опционально)",
+        "template": "имя шаблона из /chat/templates (опционально, вместо текста)",
+        "variables": {"переменная": "значение"} (опционально, для template),
+        "send_at": "ISO 8601 время отправки (опционально)",
+        "timezone": "часовой пояс для send_at без смещения, например Europe/Moscow (опционально)",
+        "delay": задержка отправки в секундах (опционально, вместо send_at)
     }
+
+    С send_at или delay сообщение сохраняется в очередь со статусом scheduled,
+    эндпоинт отвечает 202 с job_id; до отправки задачу можно отменить
+    через POST /chat/jobs/{job_id}/cancel.
+
+    С заголовком Idempotency-Key повтор запроса (например, после таймаута)
+    получает сохраненный ответ вместо повторной отправки, а одновременные
+    запросы с одним ключом выполняют одну отправку.
     """
+    return await idempotent(
+        request,
+        idempotency_key,
+        {"message": http_message, "queue": queue},
+        lambda: answer_message(http_message, queue)
+    )
+
+async def answer_message(http_message: dict, queue: bool):
+    """Обработка /message_answer: отправка, постановка в очередь или планирование сообщения."""
     try:
         await validate_and_log_request(http_message)
         
         message_params = get_message_params(http_message)
+        send_at = get_send_at(http_message)
+        chat_id = message_params["chat_id"]
+        message_params = personalize(message_params, chat_id, await render_for_recipients(message_params, [chat_id]))
+
+        if send_at:
+            job_id = await enqueue_job(message_params, send_at)
+            return JSONResponse(
+                status_code=202,
+                content={"status": "scheduled", "job_id": job_id, "send_at": send_at.isoformat()}
+            )
+
+        if queue:
+            job_id = await enqueue_job(message_params)
+            return JSONResponse(
+                status_code=202,
+                content={"status": "queued", "job_id": job_id}
+            )
         
-        await send_content(message_params["chat_id"], message_params)
+        try:
+            await send_with_retry(
+                message_params["chat_id"],
+                message_params,
+                settings.config.delivery_sync_attempts
+            )
+        except Exception:
+            await log_notification(message_params, status="failed")
+            raise
         await log_notification(message_params)
     
         await logs_bot("info", "Message sent successfully")
@@ -182,6 +255,289 @@ async def send_message_endpoint(http_message: dict):
         return {"status": "error", "message": error_msg}
 
 
+async def resolve_recipients(http_message: dict) -> tuple:
+    """
+    Определяет список получателей рассылки.
+    
+    Либо берет явный список chat_ids (дубликаты отбрасываются с сохранением порядка),
+    либо при all_users=true выбирает всех пользователей с учетом фильтра
+    filter.created_after / filter.created_before (ISO 8601).
+    Пользователи, помеченные недоступными (бот заблокирован, чат не найден), пропускаются.
+
+    Возвращает:
+    - (список получателей, количество пропущенных недоступных пользователей).
+    """
+    if http_message.get("all_users"):
+        filters = http_message.get("filter") or {}
+        created_after = filters.get("created_after")
+        created_before = filters.get("created_before")
+        chat_ids = await get_user_ids(
+            created_after=datetime.fromisoformat(created_after) if created_after else None,
+            created_before=datetime.fromisoformat(created_before) if created_before else None
+        )
+        return chat_ids, 0
+
+    chat_ids = http_message.get("chat_ids")
+    if not chat_ids:
+        raise ValueError("Either non-empty chat_ids or all_users=true is required")
+    chat_ids = list(dict.fromkeys(int(chat_id) for chat_id in chat_ids))
+
+    unreachable = await get_unreachable_user_ids(chat_ids)
+    return [chat_id for chat_id in chat_ids if chat_id not in unreachable], len(unreachable)
+
+@router.post("/broadcast")
+async def broadcast_endpoint(http_message: dict, queue: bool = False):
+    """
+    Эндпоинт для рассылки одного сообщения многим пользователям.
+
+    Формат запроса для /broadcast:
+    {
+        "chat_ids": [ID пользователей] или "all_users": true,
+        "filter": {"created_after": "ISO дата", "created_before": "ISO дата"} (опционально, для all_users),
+        "type": "(text/photo/video/animation/document/media_group)",
+        "content": "содержимое сообщения",
+        "caption": "подпись (опционально)",
+        "priority": "(high/normal/low, опционально)",
+        "template": "имя шаблона из /chat/templates (опционально, вместо текста)",
+        "variables": {"переменная": "значение"} (опционально, общие для всех получателей),
+        "recipient_variables": {"chat_id": {"переменная": "значение"}} (опционально),
+        "send_at": "ISO 8601 время отправки" или "delay": секунды (опционально),
+        "timezone": "часовой пояс для send_at без смещения (опционально)",
+        "spread": окно в секундах, на которое распределяются отправки (опционально),
+        "concurrency": число одновременных отправок (опционально)
+    }
+
+    С send_at, delay или spread задачи создаются в статусе scheduled, эндпоинт отвечает 202;
+    времена отправки равномерно распределяются на spread секунд начиная с send_at
+    (или с текущего момента), отменить рассылку - POST /chat/broadcast/{broadcast_id}/cancel.
+
+    Шаблон рендерится для всех получателей до начала отправок: имена
+    пользователей загружаются пакетными запросами, в задачи очереди
+    попадает уже готовый текст.
+
+    Без queue отправки выполняются сразу с ограниченным параллелизмом,
+    а ответ содержит результат по каждому получателю.
+    Недоступные пользователи (skipped) пропускаются без обращения к Telegram.
+    При queue=true создаются задачи в очереди notification_jobs,
+    эндпоинт отвечает 202 с broadcast_id; прогресс - GET /chat/broadcast/{broadcast_id}.
+    """
+    try:
+        await logs_bot("info", f"Received broadcast request: type={http_message.get('type')}")
+        if "type" not in http_message:
+            raise ValueError("Missing required field: type")
+
+        message_params = get_message_params(http_message)
+        send_at = get_send_at(http_message)
+        spread = float(http_message.get("spread") or 0)
+        if spread < 0:
+            raise ValueError("spread must be non-negative")
+        if spread and not send_at:
+            send_at = datetime.now(timezone.utc)
+
+        chat_ids, skipped = await resolve_recipients(http_message)
+        contents = await render_for_recipients(message_params, chat_ids)
+
+        if send_at:
+            broadcast_id = uuid.uuid4().hex
+            queued = await enqueue_jobs(chat_ids, message_params, broadcast_id, contents, send_at, spread)
+            return JSONResponse(
+                status_code=202,
+                content={
+                    "status": "scheduled",
+                    "broadcast_id": broadcast_id,
+                    "queued": queued,
+                    "skipped": skipped,
+                    "send_at": send_at.isoformat()
+                }
+            )
+
+        if queue:
+            broadcast_id = uuid.uuid4().hex
+            queued = await enqueue_jobs(chat_ids, message_params, broadcast_id, contents)
+            return JSONResponse(
+                status_code=202,
+                content={"status": "queued", "broadcast_id": broadcast_id, "queued": queued, "skipped": skipped}
+            )
+
+        concurrency = int(http_message.get("concurrency") or settings.config.broadcast_concurrency)
+        results = await broadcast_content(chat_ids, message_params, max(concurrency, 1), contents)
+        sent = sum(1 for result in results if result["status"] == "success")
+
+        await logs_bot("info", f"Broadcast finished: {sent}/{len(results)} sent")
+        return {
+            "status": "success",
+            "sent": sent,
+            "failed": len(results) - sent,
+            "skipped": skipped,
+            "results": results
+        }
+
+    except Exception as e:
+        error_msg = f"Error in broadcast endpoint: {str(e)}"
+        await logs_bot("error", error_msg)
+        return {"status": "error", "message": error_msg}
+
+@router.post("/templates")
+async def save_template(http_message: dict):
+    """
+    Регистрирует или обновляет шаблон сообщения.
+
+    Формат запроса для /templates:
+    {
+        "name": "имя шаблона",
+        "body": "Привет, <b>{first_name}</b>! Ваш код: {code}"
+    }
+
+    Текст - разметка HTML; переменные {first_name} и {last_name} берутся из данных
+    пользователя, остальные передаются в variables при отправке. Значения переменных
+    экранируются, {{ и }} - литеральные скобки. Шаблон разбирается один раз при сохранении.
+    """
+    try:
+        template = await template_store.save(http_message.get("name"), http_message.get("body"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "success", "name": http_message["name"], "variables": sorted(template.fields)}
+
+@router.get("/templates")
+async def list_templates():
+    """Список зарегистрированных шаблонов."""
+    templates = await template_store.list_all()
+    return {
+        "templates": [
+            {
+                "name": template["name"],
+                "body": template["body"],
+                "updated_at": template["updated_at"].isoformat() if template["updated_at"] else None
+            }
+            for template in templates
+        ]
+    }
+
+@router.delete("/templates/{name}")
+async def delete_template(name: str):
+    """Удаляет шаблон."""
+    if not await template_store.delete(name):
+        raise HTTPException(status_code=404, detail="Template not found")
+    return {"status": "success"}
+
+@router.get("/broadcast/{broadcast_id}")
+async def get_broadcast_status(broadcast_id: str):
+    """
+    Возвращает прогресс рассылки, поставленной в очередь:
+    количество задач в каждом статусе (scheduled, pending, processing, delivered, failed, cancelled).
+    """
+    stats = await get_broadcast_stats(broadcast_id)
+    if not stats:
+        raise HTTPException(status_code=404, detail="Broadcast not found")
+
+    return {"broadcast_id": broadcast_id, "total": sum(stats.values()), "statuses": stats}
+
+@router.post("/broadcast/{broadcast_id}/cancel")
+async def cancel_broadcast(broadcast_id: str):
+    """Отменяет еще не отправленные отложенные задачи рассылки."""
+    cancelled = await cancel_scheduled_jobs(broadcast_id=broadcast_id)
+    return {"broadcast_id": broadcast_id, "cancelled": cancelled}
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: int):
+    """
+    Возвращает статус задачи отправки из очереди notification_jobs.
+    
+    Статусы: scheduled, pending, processing, delivered, failed, cancelled.
+    """
+    job = await get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return {
+        "job_id": job.id,
+        "chat_id": job.chat_id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "error": job.error,
+        "next_attempt_at": job.next_attempt_at.isoformat() if job.next_attempt_at else None,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None
+    }
+
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: int):
+    """Отменяет отложенную задачу, если она еще не отправлена."""
+    if not await cancel_scheduled_jobs(job_id=job_id):
+        raise HTTPException(status_code=404, detail="Scheduled job not found")
+    return {"job_id": job_id, "status": "cancelled"}
+
+
+@router.get("/dead_letters")
+async def list_dead_letters(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[int] = None,
+    replayed: Optional[bool] = None
+):
+    """
+    Окончательно неудавшиеся отправки (dead-letter).
+
+    reason: permanent - ошибка, которую бессмысленно повторять,
+    unreachable - пользователь заблокировал бота или чат не найден,
+    exhausted - исчерпаны попытки при временных ошибках.
+    replayed=false - только еще не переотправленные записи.
+    """
+    letters = await get_dead_letters(limit, cursor, replayed)
+    return {
+        "dead_letters": [
+            {
+                "id": letter.id,
+                "job_id": letter.job_id,
+                "chat_id": letter.chat_id,
+                "broadcast_id": letter.broadcast_id,
+                "payload": letter.payload,
+                "reason": letter.reason,
+                "error": letter.error,
+                "attempts": letter.attempts,
+                "replayed_at": letter.replayed_at.isoformat() if letter.replayed_at else None,
+                "created_at": letter.created_at.isoformat() if letter.created_at else None
+            }
+            for letter in letters
+        ],
+        "next_cursor": letters[-1].id if len(letters) == limit else None
+    }
+
+@router.post("/dead_letters/replay")
+async def replay_dead_letters_endpoint(http_message: dict):
+    """
+    Переотправляет записи dead_letters через очередь notification_jobs.
+
+    Формат запроса для /dead_letters/replay:
+    {
+        "ids": [id записей] или "all": true
+    }
+
+    Каждая запись переотправляется не больше одного раза.
+    """
+    try:
+        if http_message.get("all"):
+            replayed = 0
+            while True:
+                batch = await replay_dead_letters()
+                replayed += batch
+                if not batch:
+                    break
+        else:
+            ids = [int(letter_id) for letter_id in http_message.get("ids") or []]
+            if not ids:
+                raise ValueError("Either non-empty ids or all=true is required")
+            replayed = await replay_dead_letters(ids, limit=len(ids))
+
+        await logs_bot("info", f"Replayed {replayed} dead letters")
+        return JSONResponse(status_code=202, content={"status": "queued", "replayed": replayed})
+
+    except Exception as e:
+        error_msg = f"Error in dead letters replay endpoint: {str(e)}"
+        await logs_bot("error", error_msg)
+        return {"status": "error", "message": error_msg}
+
+
 @router.get("/ping")
 async def ping():
     """
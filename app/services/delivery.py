@@ -0,0 +1,261 @@
+from app.services.analytics import record_notifications
+from app.services.delivery_policy import classify_error, backoff_delay, dead_letter_entry, record_failures
+from app.core.config import settings
+from app.core.logging import logs_bot
+from app.core.metrics import TELEGRAM_SEND_DURATION, TELEGRAM_SEND_ERRORS
+from app.Bot.handlers.keyboards.telegram_sender import (
+    send_message,
+    send_photo,
+    send_video,
+    send_animation,
+    send_document,
+    send_media_group
+)
+from app.services.templates import personalize
+from typing import Dict, List, Optional
+import asyncio
+import time
+
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".webm", ".mkv", ".avi")
+
+def get_media_group_items(content) -> List[dict]:
+    """
+    Приводит содержимое альбома к списку {"type", "url", "caption"}.
+
+    Элемент - объект {"type": "photo" | "video", "url": ..., "caption": ...}
+    или просто URL: тип тогда определяется по расширению (.mp4, .mov и т.п. - видео).
+    """
+    if not isinstance(content, list) or not content:
+        raise ValueError("media_group content must be a non-empty list of media items")
+
+    items = []
+    for item in content:
+        if isinstance(item, str):
+            path = item.split("?", 1)[0].lower()
+            item = {"type": "video" if path.endswith(VIDEO_EXTENSIONS) else "photo", "url": item}
+        if not isinstance(item, dict) or not item.get("url"):
+            raise ValueError(f"Invalid media_group item: {item}")
+        if item.get("type") not in ("photo", "video"):
+            raise ValueError(f"Invalid media_group item type: {item.get('type')}. Must be one of ['photo', 'video']")
+        items.append({"type": item["type"], "url": item["url"], "caption": item.get("caption")})
+    return items
+
+def get_message_params(http_message: dict) -> dict:
+    """
+    Подготовка параметров сообщения.
+    
+    Проверяет корректность типа сообщения и приоритета и формирует словарь с параметрами,
+    включая chat_id, content, caption и priority. Для рассылок chat_id может отсутствовать.
+    Для media_group content приводится к списку элементов альбома.
+    template - имя шаблона из /chat/templates вместо текста (content для text,
+    caption для медиа) с переменными variables и recipient_variables.
+    """
+    valid_types = ["text", "photo", "video", "animation", "document", "media_group"]
+    message_type = http_message.get("type")
+    if message_type not in valid_types:
+        raise ValueError(f"Invalid message type: {message_type}. Must be one of {valid_types}")
+
+    valid_priorities = ["high", "normal", "low"]
+    priority = http_message.get("priority", "normal")
+    if priority not in valid_priorities:
+        raise ValueError(f"Invalid priority: {priority}. Must be one of {valid_priorities}")
+        
+    content = http_message.get("content")
+    if message_type == "media_group":
+        content = get_media_group_items(content)
+
+    params = {
+        "message_type": message_type,
+        "chat_id": int(http_message["chat_id"]) if http_message.get("chat_id") is not None else None,
+        "content": content,
+        "caption": http_message.get("caption", ""),
+        "priority": priority
+    }
+    if http_message.get("template"):
+        params.update({
+            "template": http_message["template"],
+            "variables": http_message.get("variables") or {},
+            "recipient_variables": http_message.get("recipient_variables") or {}
+        })
+    if content is None and not (http_message.get("template") and message_type == "text"):
+        raise ValueError("Missing required field: content")
+    return params
+
+# Общий обработчик для всех типов сообщений
+async def send_content(chat_id: int, params: dict):
+    """
+    Отправляет контент пользователю в зависимости от типа сообщения.
+    
+    Определяет функцию-обработчик для каждого типа сообщения (text, photo, video, animation, document,
+    media_group) и вызывает соответствующую функцию отправки с необходимыми аргументами.
+    """
+    handlers = {
+        "text": {
+            "func": send_message,
+            "args": {"chat_id": chat_id, "text": params["content"]}
+        },
+        "photo": {
+            "func": send_photo,
+            "args": {
+                "photo": params["content"],
+                "caption": params.get("caption"),
+                "chat_id": chat_id
+            }
+        },
+        "video": {
+            "func": send_video,
+            "args": {
+                "video": params["content"],
+                "caption": params.get("caption"),
+                "chat_id": chat_id
+            }
+        },
+        "animation": {
+            "func": send_animation,
+            "args": {
+                "animation": params["content"],
+                "caption": params.get("caption", ""),
+                "chat_id": chat_id
+            }
+        },
+        "document": {
+            "func": send_document,
+            "args": {
+                "document": params["content"],
+                "caption": params.get("caption"),
+                "chat_id": chat_id
+            }
+        },
+        "media_group": {
+            "func": send_media_group,
+            "args": {
+                "items": params["content"],
+                "caption": params.get("caption"),
+                "chat_id": chat_id
+            }
+        }
+    }
+
+    message_type = params["message_type"]
+    if message_type not in handlers:
+        await logs_bot("warning", f"Unsupported message type: {message_type}")
+        raise ValueError(f"Unsupported message type: {message_type}")
+
+    started_at = time.perf_counter()
+    try:
+        handler = handlers[message_type]
+        await handler["func"](
+            **handler["args"],
+            priority=params.get("priority", "normal")
+        )
+    except Exception as e:
+        error_class = classify_error(e)
+        kind = "unreachable" if error_class.unreachable else "transient" if error_class.transient else "permanent"
+        TELEGRAM_SEND_ERRORS.inc(message_type, kind)
+        await logs_bot("error", f"Error sending {message_type}: {str(e)}")
+        raise
+    finally:
+        TELEGRAM_SEND_DURATION.observe(time.perf_counter() - started_at, message_type)
+
+async def log_notification(params: dict, status: str = "delivered"):
+    """
+    Сохраняет информацию об уведомлении в базу данных.
+    
+    Формирует запись уведомления с user_id, типом контента и статусом доставки (delivered/failed)
+    и добавляет её в таблицу Notification вместе с обновлением счетчиков аналитики.
+    """
+    notification_entry = {
+        "user_id": params["chat_id"],
+        "type_content": params["message_type"],
+        "status": status
+    }
+    await record_notifications([notification_entry])
+
+async def send_with_retry(chat_id: int, params: dict, max_attempts: int) -> None:
+    """
+    Отправляет контент, повторяя временные ошибки (сеть, 5xx, 429) с экспоненциальной
+    паузой и джиттером. Постоянные ошибки (бот заблокирован, чат не найден) не повторяются.
+
+    Если отправить так и не удалось, запись попадает в dead_letters,
+    а последняя ошибка пробрасывается дальше.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            await send_content(chat_id, params)
+            return
+        except Exception as e:
+            error_class = classify_error(e)
+            if not error_class.transient or attempt >= max_attempts:
+                await record_failures([dead_letter_entry(params, e, error_class, attempt)])
+                raise
+            await asyncio.sleep(backoff_delay(attempt, error_class.retry_after))
+
+async def broadcast_content(
+    chat_ids: List[int],
+    params: dict,
+    concurrency: int,
+    contents: Optional[Dict[int, str]] = None
+) -> List[dict]:
+    """
+    Рассылает один и тот же контент списку получателей.
+    
+    contents - тексты шаблона по получателям (render_for_recipients),
+    подготовленные до начала отправок.
+    
+    Отправки выполняются конкурентно, но не более concurrency одновременно.
+    Получатели с временными ошибками повторяются следующими раундами
+    (до delivery_sync_attempts попыток) после общей паузы с джиттером,
+    поэтому повтор одного получателя не задерживает отправки остальным.
+    Результаты записываются в таблицу Notification одним пакетным INSERT,
+    окончательные ошибки - в dead_letters.
+    
+    Возвращает список результатов по каждому получателю:
+    {"chat_id": ..., "status": "success" | "error", "error": ...}
+    """
+    results: List[dict] = [None] * len(chat_ids)
+    failures: List[dict] = []
+    max_attempts = max(settings.config.delivery_sync_attempts, 1)
+    pending = list(enumerate(chat_ids))
+    attempt = 0
+
+    while pending:
+        attempt += 1
+        recipients = iter(pending)
+        retry = []
+        retry_after = 0.0
+
+        async def worker():
+            nonlocal retry_after
+            for index, chat_id in recipients:
+                recipient_params = personalize(params, chat_id, contents)
+                try:
+                    await send_content(chat_id, recipient_params)
+                    results[index] = {"chat_id": chat_id, "status": "success"}
+                except Exception as e:
+                    error_class = classify_error(e)
+                    if error_class.transient and attempt < max_attempts:
+                        retry.append((index, chat_id))
+                        retry_after = max(retry_after, error_class.retry_after)
+                        continue
+                    results[index] = {"chat_id": chat_id, "status": "error", "error": str(e)}
+                    failures.append(dead_letter_entry(recipient_params, e, error_class, attempt))
+
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, len(pending)))))
+
+        pending = sorted(retry)
+        if pending:
+            await asyncio.sleep(backoff_delay(attempt, retry_after))
+
+    await record_notifications([
+        {
+            "user_id": result["chat_id"],
+            "type_content": params["message_type"],
+            "status": "delivered" if result["status"] == "success" else "failed"
+        }
+        for result in results
+    ])
+    await record_failures(failures)
+    return results
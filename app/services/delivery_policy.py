@@ -0,0 +1,130 @@
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramEntityTooLarge,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError
+)
+from sqlalchemy.future import select
+from app.db.database import async_session, add_many_to_table, mark_users_unreachable
+from app.db.models import DeadLetter
+from app.core.config import settings
+from dataclasses import dataclass
+from typing import List, Optional
+import aiohttp
+import asyncio
+import random
+
+
+# Фрагменты описаний TelegramBadRequest, означающие, что чата для бота больше нет
+UNREACHABLE_ERRORS = ("chat not found", "user not found", "peer_id_invalid", "user is deactivated")
+
+
+@dataclass
+class ErrorClass:
+    """
+    Результат классификации ошибки отправки.
+
+    transient - ошибку имеет смысл повторить (сеть, 5xx, 429),
+    unreachable - пользователь недоступен навсегда (бот заблокирован, чат не найден),
+    retry_after - минимальная пауза перед повтором, которую запросил Telegram.
+    """
+    transient: bool
+    unreachable: bool = False
+    retry_after: float = 0.0
+
+
+def classify_error(error: BaseException) -> ErrorClass:
+    """
+    Определяет, временная ли ошибка отправки.
+
+    Просматривает цепочку причин (raise ... from e), поскольку ошибки
+    отправки медиа оборачиваются в ValueError: ответ 5xx или 429 источника
+    файла приходит как ValueError с причиной aiohttp.ClientResponseError
+    (см. origin_error) и считается временным. ValueError без такой причины -
+    постоянная ошибка.
+    """
+    current = error
+    while current is not None:
+        if isinstance(current, TelegramRetryAfter):
+            return ErrorClass(transient=True, retry_after=current.retry_after)
+        if isinstance(current, TelegramEntityTooLarge):
+            return ErrorClass(transient=False)
+        if isinstance(current, (TelegramNetworkError, TelegramServerError, aiohttp.ClientError, asyncio.TimeoutError)):
+            return ErrorClass(transient=True)
+        if isinstance(current, TelegramForbiddenError):
+            return ErrorClass(transient=False, unreachable=True)
+        if isinstance(current, TelegramBadRequest):
+            message = current.message.lower()
+            return ErrorClass(transient=False, unreachable=any(text in message for text in UNREACHABLE_ERRORS))
+        current = current.__cause__
+
+    # Ошибки валидации и данных повторять бессмысленно, прочие - повторяем ограниченно
+    return ErrorClass(transient=not isinstance(error, (ValueError, TypeError, KeyError)))
+
+
+def backoff_delay(attempt: int, retry_after: float = 0.0) -> float:
+    """
+    Пауза перед повтором номер attempt (с 1): экспоненциальная с полным джиттером
+    (случайное значение от 0 до base * 2^(attempt-1), не больше backoff_max),
+    но не меньше retry_after.
+    """
+    config = settings.config
+    ceiling = min(config.delivery_backoff_max, config.delivery_backoff_base * 2 ** (attempt - 1))
+    return max(random.uniform(0, ceiling), retry_after)
+
+
+def dead_letter_entry(
+    params: dict,
+    error: BaseException,
+    error_class: ErrorClass,
+    attempts: int,
+    job_id: Optional[int] = None,
+    broadcast_id: Optional[str] = None
+) -> dict:
+    """Формирует строку dead_letters для неудачной отправки."""
+    if error_class.unreachable:
+        reason = "unreachable"
+    elif error_class.transient:
+        reason = "exhausted"
+    else:
+        reason = "permanent"
+
+    return {
+        "job_id": job_id,
+        "chat_id": params["chat_id"],
+        "broadcast_id": broadcast_id,
+        "payload": params,
+        "reason": reason,
+        "error": str(error),
+        "attempts": attempts
+    }
+
+
+async def record_failures(entries: List[dict]) -> None:
+    """
+    Сохраняет окончательно неудавшиеся отправки в dead_letters одним пакетным INSERT
+    и помечает недоступных пользователей, чтобы следующие рассылки их пропускали.
+    """
+    if not entries:
+        return
+    await add_many_to_table(DeadLetter, entries)
+    await mark_users_unreachable(sorted({
+        entry["chat_id"] for entry in entries if entry["reason"] == "unreachable"
+    }))
+
+
+async def get_dead_letters(limit: int, cursor: Optional[int] = None, replayed: Optional[bool] = None) -> List[DeadLetter]:
+    """Страница dead_letters по возрастанию id (keyset-пагинация по cursor)."""
+    query = select(DeadLetter).order_by(DeadLetter.id).limit(limit)
+    if cursor is not None:
+        query = query.where(DeadLetter.id > cursor)
+    if replayed is True:
+        query = query.where(DeadLetter.replayed_at.is_not(None))
+    elif replayed is False:
+        query = query.where(DeadLetter.replayed_at.is_(None))
+
+    async with async_session() as session:
+        return list((await session.scalars(query)).all())
+
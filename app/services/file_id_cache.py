@@ -0,0 +1,106 @@
+from sqlalchemy.future import select
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message
+from app.db.database import async_session, add_to_table
+from app.db.models import MediaFile
+from app.core.cache import TTLCache
+from app.core.config import settings
+from typing import Optional
+import asyncio
+import weakref
+
+
+def extract_file_id(message: Message, media_type: str) -> Optional[str]:
+    """
+    Достает file_id загруженного файла из ответа Telegram.
+
+    Для фото берется самый большой размер, для остальных типов -
+    соответствующее поле сообщения (с запасным вариантом document).
+    """
+    if media_type == 'photo':
+        return message.photo[-1].file_id if message.photo else None
+
+    media = getattr(message, media_type, None) or message.document
+    return media.file_id if media else None
+
+
+# Фрагменты описаний TelegramBadRequest, означающие, что закэшированный file_id больше не годится
+FILE_ID_ERRORS = ("file_id", "wrong file identifier", "failed to get http url content")
+
+
+def is_file_id_error(error: TelegramBadRequest) -> bool:
+    """Отклонен ли запрос из-за file_id (а не из-за подписи, разметки и т.п.)."""
+    message = error.message.lower()
+    return any(text in message for text in FILE_ID_ERRORS)
+
+
+class FileIdCache:
+    """
+    Кэш соответствия URL медиа -> Telegram file_id.
+
+    Перед таблицей media_files стоит LRU в памяти. Для каждого ключа
+    выдается отдельный asyncio.Lock, чтобы при рассылке одного файла
+    многим получателям загрузка выполнялась только один раз.
+    """
+
+    def __init__(self, maxsize: int):
+        self._memory = TTLCache(maxsize=maxsize)
+        self.hits = 0
+        self.misses = 0
+        self._locks: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+
+    @staticmethod
+    def key(media_type: str, url: str) -> str:
+        return f"{media_type}:{url}"
+
+    async def get(self, media_type: str, url: str) -> Optional[str]:
+        """Возвращает file_id из памяти или из базы данных, либо None."""
+        key = self.key(media_type, url)
+        file_id = self._memory.get(key)
+        if file_id is not None:
+            self.hits += 1
+            return file_id
+
+        async with async_session() as session:
+            file_id = await session.scalar(
+                select(MediaFile.file_id).where(MediaFile.cache_key == key)
+            )
+        if file_id is not None:
+            self._memory.set(key, file_id)
+            self.hits += 1
+        else:
+            self.misses += 1
+        return file_id
+
+    async def set(self, media_type: str, url: str, file_id: str) -> None:
+        """Сохраняет file_id в памяти и в базе данных."""
+        key = self.key(media_type, url)
+        self._memory.set(key, file_id)
+        await add_to_table(MediaFile, {
+            "cache_key": key,
+            "media_type": media_type,
+            "url": url,
+            "file_id": file_id
+        })
+
+    async def invalidate(self, media_type: str, url: str) -> None:
+        """Удаляет file_id, который Telegram перестал принимать."""
+        key = self.key(media_type, url)
+        self._memory.invalidate(key)
+        async with async_session() as session:
+            record = await session.scalar(select(MediaFile).where(MediaFile.cache_key == key))
+            if record is not None:
+                await session.delete(record)
+                await session.commit()
+
+    def lock(self, media_type: str, url: str) -> asyncio.Lock:
+        """Возвращает общий lock для загрузки указанного файла."""
+        key = self.key(media_type, url)
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+
+file_id_cache = FileIdCache(maxsize=settings.config.file_id_cache_size)
@@ -0,0 +1,276 @@
+from collections import OrderedDict
+from app.core.config import settings
+from app.core.http import http_client
+from app.core.logging import logs_bot
+from typing import Dict, List, Optional, Set, Tuple
+import aiohttp
+import asyncio
+import time
+
+
+class ForwardError(Exception):
+    """Ошибка пересылки: status_code и detail отдаются клиенту как HTTPException."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class CircuitBreaker:
+    """
+    Размыкатель цепи для одного целевого сервиса.
+
+    После failure_threshold ошибок подряд цепь размыкается (open) и запросы
+    сразу отклоняются. Через reset_timeout секунд пропускается один пробный
+    запрос (half_open): успех замыкает цепь, ошибка снова размыкает ее.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        """True, если запрос можно выполнить сейчас."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "open" or self._trial:
+            return False
+        self._trial = True
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """Снимает пробный запрос, завершившийся без результата (например, отмененный)."""
+        self._trial = False
+
+
+class TargetState:
+    """Состояние одного целевого URL: лимит параллельных запросов, размыкатель и текущая пачка."""
+
+    def __init__(self, concurrency: int, breaker: CircuitBreaker):
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.breaker = breaker
+        self.in_flight = 0
+        self.sent = 0
+        self.failed = 0
+        self.rejected = 0
+        self.batch: List[Tuple[dict, asyncio.Future]] = []
+        self.flush_timer: Optional[asyncio.TimerHandle] = None
+
+    def idle(self) -> bool:
+        return self.in_flight == 0 and not self.batch and self.breaker.state == "closed"
+
+    def stats(self) -> dict:
+        return {
+            "state": self.breaker.state,
+            "in_flight": self.in_flight,
+            "concurrency": self.concurrency,
+            "pending_batch": len(self.batch),
+            "sent": self.sent,
+            "failed": self.failed,
+            "rejected": self.rejected
+        }
+
+
+class Forwarder:
+    """
+    Пересылка уведомлений в другие сервисы (/sending_service).
+
+    Для каждого целевого URL действует свой лимит одновременных запросов:
+    если слот не освободился за acquire_timeout секунд, запрос сразу
+    отклоняется с 503, и обработчики не копятся за медленным сервисом.
+    Каждый запрос ограничен timeout секунд, а размыкатель цепи отклоняет
+    запросы к сервису, который подряд отвечает ошибками.
+
+    При batch=True уведомления к одному URL, пришедшие в течение batch_window
+    секунд (но не больше batch_max), отправляются одним POST
+    {"notifications": [...]}.
+    """
+
+    def __init__(
+        self,
+        concurrency: int,
+        timeout: float,
+        acquire_timeout: float,
+        failure_threshold: int,
+        reset_timeout: float,
+        batch_window: float,
+        batch_max: int,
+        max_targets: int = 1000
+    ):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.acquire_timeout = acquire_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.batch_window = batch_window
+        self.batch_max = batch_max
+        self.max_targets = max_targets
+        self._targets: OrderedDict = OrderedDict()
+        self._flushes: Set[asyncio.Task] = set()
+
+    def _target(self, url: str) -> TargetState:
+        state = self._targets.get(url)
+        if state is None:
+            state = self._targets[url] = TargetState(
+                self.concurrency,
+                CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            )
+            # Удаляем самые старые простаивающие цели, чтобы словарь не рос бесконечно
+            while len(self._targets) > self.max_targets:
+                oldest_url, oldest = next(iter(self._targets.items()))
+                if not oldest.idle():
+                    break
+                del self._targets[oldest_url]
+        else:
+            self._targets.move_to_end(url)
+        return state
+
+    def stats(self) -> Dict[str, dict]:
+        return {url: state.stats() for url, state in self._targets.items()}
+
+    async def forward(self, url: str, message: dict, batch: bool = False) -> dict:
+        """
+        Пересылает message на url.
+
+        Возвращает {"status_code": ..., "batched": размер пачки}.
+        При ошибке выбрасывает ForwardError.
+        """
+        state = self._target(url)
+        if not batch:
+            status = await self._post(url, state, message)
+            return {"status_code": status, "batched": 1}
+
+        future = asyncio.get_running_loop().create_future()
+        state.batch.append((message, future))
+        if len(state.batch) >= self.batch_max:
+            self._flush(url, state)
+        elif state.flush_timer is None:
+            state.flush_timer = asyncio.get_running_loop().call_later(
+                self.batch_window, self._flush, url, state
+            )
+        return await future
+
+    def _flush(self, url: str, state: TargetState) -> None:
+        """Забирает текущую пачку цели и отправляет ее в отдельной задаче."""
+        if state.flush_timer is not None:
+            state.flush_timer.cancel()
+            state.flush_timer = None
+        batch, state.batch = state.batch, []
+        if not batch:
+            return
+
+        task = asyncio.create_task(self._send_batch(url, state, batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _send_batch(self, url: str, state: TargetState, batch: List[Tuple[dict, asyncio.Future]]) -> None:
+        try:
+            status = await self._post(url, state, {"notifications": [message for message, _ in batch]})
+            outcome = {"status_code": status, "batched": len(batch)}
+            error = None
+        except ForwardError as e:
+            error = e
+        except Exception as e:
+            error = ForwardError(500, f"Error sending notification: {str(e)}")
+
+        for _, future in batch:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(ForwardError(error.status_code, error.detail))
+            else:
+                future.set_result(outcome)
+
+    async def _post(self, url: str, state: TargetState, payload: dict) -> int:
+        trial = state.breaker.state == "half_open"
+        if not state.breaker.allow():
+            state.rejected += 1
+            raise ForwardError(503, f"Target service is unavailable (circuit open): {url}")
+
+        try:
+            try:
+                await asyncio.wait_for(state.semaphore.acquire(), self.acquire_timeout)
+            except asyncio.TimeoutError:
+                state.rejected += 1
+                raise ForwardError(503, f"Too many concurrent requests to target service: {url}")
+
+            state.in_flight += 1
+            try:
+                async with http_client.request(
+                    "POST",
+                    url,
+                    json=payload,
+                    timeout=aiohttp.ClientTimeout(total=self.timeout)
+                ) as response:
+                    if 200 <= response.status < 300:
+                        state.breaker.record_success()
+                        state.sent += 1
+                        return response.status
+
+                    text = await response.text()
+                    # 4xx - ошибка запроса, а не сервиса: сервис отвечает, цепь не размыкаем
+                    if response.status >= 500:
+                        state.breaker.record_failure()
+                    else:
+                        state.breaker.record_success()
+                    state.failed += 1
+                    raise ForwardError(response.status, f"Failed to send notification: {text}")
+
+            except asyncio.TimeoutError:
+                state.breaker.record_failure()
+                state.failed += 1
+                raise ForwardError(504, f"Target service timed out after {self.timeout}s")
+            except aiohttp.ClientError as e:
+                state.breaker.record_failure()
+                state.failed += 1
+                await logs_bot("error", f"Forwarding to {url} failed: {str(e)}")
+                raise ForwardError(502, f"Error sending notification: {str(e)}")
+            finally:
+                state.in_flight -= 1
+                state.semaphore.release()
+        finally:
+            if trial:
+                state.breaker.release()
+
+    async def close(self) -> None:
+        """Отправляет накопленные пачки и дожидается их завершения (вызывается при остановке)."""
+        for url, state in list(self._targets.items()):
+            self._flush(url, state)
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+
+forwarder = Forwarder(
+    concurrency=settings.config.forward_concurrency,
+    timeout=settings.config.forward_timeout,
+    acquire_timeout=settings.config.forward_acquire_timeout,
+    failure_threshold=settings.config.forward_breaker_threshold,
+    reset_timeout=settings.config.forward_breaker_reset,
+    batch_window=settings.config.forward_batch_window,
+    batch_max=settings.config.forward_batch_max
+)
@@ -0,0 +1,222 @@
+from sqlalchemy import delete, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.future import select
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+from app.db.database import async_session
+from app.db.models import IdempotencyRecord
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.logging import logs_bot
+from app.core.metrics import registry
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import hashlib
+import json
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    request_hash: str
+    status_code: int
+    body: Any
+
+
+def request_fingerprint(data: Any) -> str:
+    """sha256 канонического JSON запроса: повтор с тем же ключом должен совпадать с оригиналом."""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False, default=str).encode()).hexdigest()
+
+
+def to_response(result) -> StoredResponse:
+    """Приводит результат эндпоинта (dict или JSONResponse) к коду ответа и телу."""
+    if isinstance(result, JSONResponse):
+        return StoredResponse("", result.status_code, json.loads(result.body))
+    return StoredResponse("", 200, result)
+
+
+def is_cacheable(response: StoredResponse) -> bool:
+    """Сохраняются только выполненные запросы: после ошибки повтор должен отправить заново."""
+    body = response.body
+    return 200 <= response.status_code < 300 and not (isinstance(body, dict) and body.get("status") == "error")
+
+
+class IdempotencyStore:
+    """
+    Обработка заголовка Idempotency-Key.
+
+    Ответ на выполненный запрос хранится в таблице idempotency_keys и в
+    TTL-кэше в памяти; повтор с тем же ключом получает сохраненный ответ
+    (с заголовком Idempotent-Replayed: true) без повторной отправки.
+    Одновременные запросы с одним ключом в процессе ждут один и тот же
+    вызов; между процессами ключ занимается строкой со status_code = NULL,
+    и пока она не завершена, другие процессы отвечают 409.
+    Повтор с тем же ключом, но другим телом запроса - 422.
+    Ответы с ошибкой не сохраняются, чтобы повтор мог отправить сообщение заново.
+    """
+
+    def __init__(self, ttl: float, cache_size: int, lock_timeout: float):
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self._memory = TTLCache(maxsize=cache_size, ttl=ttl)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.replayed = 0
+        self.coalesced = 0
+        self.conflicts = 0
+
+    async def _claim(self, key: str, request_hash: str) -> Optional[IdempotencyRecord]:
+        """
+        Занимает ключ вставкой строки; если ключ уже занят - возвращает существующую строку.
+        Устаревшие строки (старше ttl или зависшие дольше lock_timeout) перезанимаются.
+        """
+        now = datetime.now(timezone.utc)
+        async with async_session() as session:
+            try:
+                await session.execute(insert(IdempotencyRecord).values(key=key, request_hash=request_hash, created_at=now))
+                await session.commit()
+                return None
+            except IntegrityError:
+                await session.rollback()
+
+            record = await session.scalar(select(IdempotencyRecord).where(IdempotencyRecord.key == key))
+            if record is None:
+                return await self._claim(key, request_hash)
+
+            created_at = record.created_at
+            if created_at is not None and created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            expired = created_at is None or created_at < now - timedelta(seconds=self.ttl)
+            stale = record.status_code is None and created_at < now - timedelta(seconds=self.lock_timeout)
+            if not (expired or stale):
+                return record
+
+            result = await session.execute(
+                update(IdempotencyRecord)
+                .where(IdempotencyRecord.id == record.id, IdempotencyRecord.created_at == record.created_at)
+                .values(request_hash=request_hash, status_code=None, response=None, created_at=now)
+            )
+            await session.commit()
+            return None if result.rowcount else record
+
+    async def _finish(self, key: str, response: Optional[StoredResponse]) -> None:
+        async with async_session() as session:
+            if response is None:
+                await session.execute(delete(IdempotencyRecord).where(IdempotencyRecord.key == key))
+            else:
+                await session.execute(
+                    update(IdempotencyRecord)
+                    .where(IdempotencyRecord.key == key)
+                    .values(status_code=response.status_code, response=response.body)
+                )
+            await session.commit()
+
+    def _replay(self, stored: StoredResponse, request_hash: str) -> JSONResponse:
+        if stored.request_hash != request_hash:
+            self.conflicts += 1
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+        self.replayed += 1
+        return JSONResponse(status_code=stored.status_code, content=stored.body, headers={"Idempotent-Replayed": "true"})
+
+    async def run(self, key: str, request_data: Any, handler: Callable[[], Awaitable[Any]]):
+        """
+        Выполняет handler не больше одного раза на ключ.
+
+        Параметры:
+        - key: ключ с областью действия (API-ключ и эндпоинт).
+        - request_data: данные запроса для проверки, что повтор совпадает с оригиналом.
+        - handler: вызов эндпоинта, возвращает dict или JSONResponse.
+        """
+        request_hash = request_fingerprint(request_data)
+
+        stored = self._memory.get(key)
+        if stored is not None:
+            return self._replay(stored, request_hash)
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            stored = await asyncio.shield(inflight)
+            if stored.request_hash != request_hash:
+                self.conflicts += 1
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+            return JSONResponse(status_code=stored.status_code, content=stored.body, headers={"Idempotent-Replayed": "true"})
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            record = await self._claim(key, request_hash)
+            if record is not None:
+                if record.status_code is None:
+                    self.conflicts += 1
+                    raise HTTPException(
+                        status_code=409,
+                        detail="A request with this Idempotency-Key is in progress",
+                        headers={"Retry-After": "1"}
+                    )
+                stored = StoredResponse(record.request_hash, record.status_code, record.response)
+                self._memory.set(key, stored)
+                result = self._replay(stored, request_hash)
+                future.set_result(StoredResponse(request_hash, result.status_code, stored.body))
+                return result
+
+            try:
+                response = to_response(await handler())
+            except BaseException:
+                await self._finish(key, None)
+                raise
+
+            stored = StoredResponse(request_hash, response.status_code, response.body)
+            cacheable = is_cacheable(stored)
+            if cacheable:
+                self._memory.set(key, stored)
+            try:
+                await self._finish(key, stored if cacheable else None)
+            except Exception as e:
+                # Запрос уже выполнен: ответ остается в памяти процесса, а незавершенная
+                # строка в других процессах перезанимается через lock_timeout
+                await logs_bot("error", f"Failed to store idempotent response for {key}: {str(e)}")
+            future.set_result(stored)
+            return JSONResponse(status_code=stored.status_code, content=stored.body)
+
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+                # Исключение передано ожидающим; если их нет, не оставляем его «необработанным»
+                future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            self._inflight.pop(key, None)
+
+
+idempotency_store = IdempotencyStore(
+    ttl=settings.config.idempotency_ttl,
+    cache_size=settings.config.idempotency_cache_size,
+    lock_timeout=settings.config.idempotency_lock_timeout
+)
+
+registry.callback(
+    "idempotent_requests_total",
+    "Requests answered from the idempotency store",
+    lambda: [
+        (("replayed",), idempotency_store.replayed),
+        (("coalesced",), idempotency_store.coalesced),
+        (("conflict",), idempotency_store.conflicts)
+    ],
+    ("result",),
+    kind="counter"
+)
+
+
+async def idempotent(request: Request, idempotency_key: Optional[str], request_data: Any, handler: Callable[[], Awaitable[Any]]):
+    """
+    Выполняет эндпоинт с учетом заголовка Idempotency-Key (без заголовка - как обычно).
+    Ключ действует в пределах API-ключа и пути запроса.
+    """
+    if not idempotency_key:
+        return await handler()
+    api_key = getattr(request.state, "api_key", None)
+    scope = api_key.name if api_key is not None else "-"
+    return await idempotency_store.run(f"{scope}:{request.url.path}:{idempotency_key}", request_data, handler)
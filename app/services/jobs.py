@@ -0,0 +1,613 @@
+from sqlalchemy import and_, update, insert, func, or_
+from sqlalchemy.future import select
+from app.db.database import async_session, add_to_table
+from app.db.models import DeadLetter, NotificationJob
+from app.core.config import settings
+from app.core.logging import logs_bot
+from app.services.delivery import send_content, log_notification
+from app.services.delivery_policy import classify_error, backoff_delay, dead_letter_entry, record_failures
+from app.services.templates import personalize
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set
+import asyncio
+import heapq
+import time
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+async def enqueue_job(params: dict, send_at: Optional[datetime] = None) -> int:
+    """
+    Сохраняет задачу отправки в таблицу notification_jobs.
+
+    Параметры:
+    - params: параметры сообщения из get_message_params.
+    - send_at: время отложенной отправки (aware datetime); задача создается
+      в статусе scheduled и попадает в очередь, когда это время наступит.
+
+    Возвращает:
+    - id созданной задачи.
+    """
+    job = await add_to_table(NotificationJob, {
+        "chat_id": params["chat_id"],
+        "payload": params,
+        "status": "scheduled" if send_at else "pending",
+        "next_attempt_at": send_at
+    })
+    if not job:
+        raise ValueError("Failed to enqueue notification job")
+
+    if send_at:
+        job_scheduler.schedule(send_at)
+    else:
+        job_pool.notify()
+    return job.id
+
+
+async def enqueue_jobs(
+    chat_ids: List[int],
+    params: dict,
+    broadcast_id: str,
+    contents: Optional[Dict[int, str]] = None,
+    send_at: Optional[datetime] = None,
+    spread: float = 0
+) -> int:
+    """
+    Пакетно сохраняет задачи рассылки одного сообщения списку получателей.
+
+    Параметры:
+    - chat_ids: список получателей.
+    - params: общие параметры сообщения из get_message_params.
+    - broadcast_id: идентификатор рассылки, которым помечаются все задачи.
+    - contents: тексты шаблона по получателям; в задачу попадает уже готовый текст.
+    - send_at: время отложенной отправки (aware datetime).
+    - spread: окно в секундах, на которое равномерно распределяются
+      времена отправки задач начиная с send_at.
+
+    Возвращает:
+    - количество созданных задач.
+    """
+    if not chat_ids:
+        return 0
+
+    step = timedelta(seconds=spread / len(chat_ids)) if send_at and spread > 0 else timedelta(0)
+    async with async_session() as session:
+        await session.execute(insert(NotificationJob), [
+            {
+                "chat_id": chat_id,
+                "broadcast_id": broadcast_id,
+                "payload": personalize(params, chat_id, contents),
+                "status": "scheduled" if send_at else "pending",
+                "next_attempt_at": send_at + step * index if send_at else None
+            }
+            for index, chat_id in enumerate(chat_ids)
+        ])
+        await session.commit()
+
+    if send_at:
+        job_scheduler.schedule(send_at)
+    else:
+        job_pool.notify()
+    return len(chat_ids)
+
+
+async def get_broadcast_stats(broadcast_id: str) -> Dict[str, int]:
+    """Возвращает количество задач рассылки в разрезе статусов."""
+    async with async_session() as session:
+        result = await session.execute(
+            select(NotificationJob.status, func.count())
+            .where(NotificationJob.broadcast_id == broadcast_id)
+            .group_by(NotificationJob.status)
+        )
+        return {status: count for status, count in result.all()}
+
+
+async def get_queue_depth() -> Dict[str, int]:
+    """Количество задач в статусах scheduled, pending и processing (по индексу (status, id))."""
+    async with async_session() as session:
+        result = await session.execute(
+            select(NotificationJob.status, func.count())
+            .where(NotificationJob.status.in_(["scheduled", "pending", "processing"]))
+            .group_by(NotificationJob.status)
+        )
+        return {"scheduled": 0, "pending": 0, "processing": 0, **{status: count for status, count in result.all()}}
+
+
+async def get_job(job_id: int) -> Optional[NotificationJob]:
+    """Возвращает задачу по id или None, если она не найдена."""
+    async with async_session() as session:
+        return await session.get(NotificationJob, job_id)
+
+
+async def claim_jobs(limit: int) -> List[NotificationJob]:
+    """
+    Атомарно захватывает до limit задач в статусе pending,
+    время повтора которых (next_attempt_at) уже наступило.
+
+    Захват выполняется условным UPDATE ... WHERE status = 'pending',
+    поэтому одна задача не достанется двум воркерам, даже если
+    они работают в разных процессах.
+    """
+    async with async_session() as session:
+        ids = (await session.scalars(
+            select(NotificationJob.id)
+            .where(
+                NotificationJob.status == "pending",
+                or_(NotificationJob.next_attempt_at.is_(None), NotificationJob.next_attempt_at <= utcnow())
+            )
+            .order_by(NotificationJob.id)
+            .limit(limit)
+        )).all()
+        if not ids:
+            return []
+
+        result = await session.scalars(
+            update(NotificationJob)
+            .where(NotificationJob.id.in_(ids), NotificationJob.status == "pending")
+            .values(
+                status="processing",
+                attempts=NotificationJob.attempts + 1,
+                locked_at=utcnow()
+            )
+            .returning(NotificationJob)
+        )
+        jobs = sorted(result.all(), key=lambda job: job.id)
+        await session.commit()
+        return jobs
+
+
+async def release_scheduled_jobs(limit: int) -> int:
+    """
+    Переводит до limit отложенных задач, время которых наступило, в pending
+    (самые ранние первыми, по индексу (status, next_attempt_at)).
+
+    Возвращает:
+    - количество переведенных задач.
+    """
+    async with async_session() as session:
+        due = (
+            select(NotificationJob.id)
+            .where(NotificationJob.status == "scheduled", NotificationJob.next_attempt_at <= utcnow())
+            .order_by(NotificationJob.next_attempt_at, NotificationJob.id)
+            .limit(limit)
+        )
+        result = await session.execute(
+            update(NotificationJob)
+            .where(NotificationJob.id.in_(due.scalar_subquery()), NotificationJob.status == "scheduled")
+            .values(status="pending")
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+        return result.rowcount
+
+
+async def next_scheduled_time() -> Optional[datetime]:
+    """Ближайшее время отправки среди отложенных задач (MIN по индексу) или None."""
+    async with async_session() as session:
+        next_time = await session.scalar(
+            select(func.min(NotificationJob.next_attempt_at)).where(NotificationJob.status == "scheduled")
+        )
+    if next_time is not None and next_time.tzinfo is None:
+        # SQLite возвращает время без часового пояса, хранится UTC
+        next_time = next_time.replace(tzinfo=timezone.utc)
+    return next_time
+
+
+async def cancel_scheduled_jobs(job_id: Optional[int] = None, broadcast_id: Optional[str] = None) -> int:
+    """
+    Отменяет еще не отправленные отложенные задачи (одну задачу или всю рассылку).
+
+    Возвращает:
+    - количество отмененных задач.
+    """
+    condition = NotificationJob.id == job_id if job_id is not None else NotificationJob.broadcast_id == broadcast_id
+    async with async_session() as session:
+        result = await session.execute(
+            update(NotificationJob)
+            .where(condition, NotificationJob.status == "scheduled")
+            .values(status="cancelled")
+        )
+        await session.commit()
+        return result.rowcount
+
+
+def claimed_by(job: NotificationJob):
+    """
+    Условие, что задача все еще захвачена этим воркером: status = 'processing' и тот же
+    номер попытки. Если захват истек (requeue_stale_jobs) и задачу взял другой воркер,
+    attempts у нее уже больше, и старый воркер не изменит ее статус.
+    """
+    return and_(
+        NotificationJob.id == job.id,
+        NotificationJob.status == "processing",
+        NotificationJob.attempts == job.attempts
+    )
+
+
+async def finish_job(job: NotificationJob, status: str, error: Optional[str] = None) -> bool:
+    """
+    Переводит захваченную задачу в конечный статус delivered или failed.
+
+    Возвращает:
+    - False, если задача уже не захвачена этим воркером (строка не изменена).
+    """
+    async with async_session() as session:
+        result = await session.execute(
+            update(NotificationJob)
+            .where(claimed_by(job))
+            .values(status=status, error=error, locked_at=None)
+        )
+        await session.commit()
+        return result.rowcount > 0
+
+
+async def retry_job(job: NotificationJob, error: str, delay: float) -> bool:
+    """
+    Возвращает захваченную задачу в очередь с повтором не раньше чем через delay секунд.
+
+    Возвращает:
+    - False, если задача уже не захвачена этим воркером (строка не изменена).
+    """
+    async with async_session() as session:
+        result = await session.execute(
+            update(NotificationJob)
+            .where(claimed_by(job))
+            .values(
+                status="pending",
+                error=error,
+                locked_at=None,
+                next_attempt_at=utcnow() + timedelta(seconds=delay)
+            )
+        )
+        await session.commit()
+        return result.rowcount > 0
+
+
+async def replay_dead_letters(ids: Optional[List[int]] = None, limit: int = 1000) -> int:
+    """
+    Переотправляет записи dead_letters: создает для них новые задачи в очереди
+    и помечает записи replayed_at в той же транзакции.
+
+    Параметры:
+    - ids: id записей; None - все еще не переотправленные записи.
+    - limit: сколько записей обработать за вызов.
+
+    Возвращает:
+    - количество созданных задач.
+    """
+    batch_ids = (
+        select(DeadLetter.id)
+        .where(DeadLetter.replayed_at.is_(None))
+        .order_by(DeadLetter.id)
+        .limit(limit)
+    )
+    if ids is not None:
+        batch_ids = batch_ids.where(DeadLetter.id.in_(ids))
+
+    async with async_session() as session:
+        # Условный UPDATE ... RETURNING: конкурентные вызовы не переотправят запись дважды
+        result = await session.execute(
+            update(DeadLetter)
+            .where(DeadLetter.id.in_(batch_ids.scalar_subquery()), DeadLetter.replayed_at.is_(None))
+            .values(replayed_at=utcnow())
+            .returning(DeadLetter.chat_id, DeadLetter.broadcast_id, DeadLetter.payload)
+        )
+        letters = result.all()
+        if not letters:
+            return 0
+
+        await session.execute(insert(NotificationJob), [
+            {
+                "chat_id": letter.chat_id,
+                "broadcast_id": letter.broadcast_id,
+                "payload": letter.payload,
+                "status": "pending"
+            }
+            for letter in letters
+        ])
+        await session.commit()
+
+    job_pool.notify()
+    return len(letters)
+
+
+async def release_jobs(job_ids: List[int]) -> None:
+    """Возвращает захваченные, но не обработанные задачи в статус pending."""
+    if not job_ids:
+        return
+    async with async_session() as session:
+        await session.execute(
+            update(NotificationJob)
+            .where(NotificationJob.id.in_(job_ids), NotificationJob.status == "processing")
+            .values(status="pending", locked_at=None)
+        )
+        await session.commit()
+
+
+async def requeue_stale_jobs(lock_timeout: int) -> int:
+    """
+    Возвращает в очередь задачи, зависшие в статусе processing дольше lock_timeout секунд
+    (например, после падения процесса-воркера).
+    """
+    async with async_session() as session:
+        result = await session.execute(
+            update(NotificationJob)
+            .where(
+                NotificationJob.status == "processing",
+                NotificationJob.locked_at < utcnow() - timedelta(seconds=lock_timeout)
+            )
+            .values(status="pending", locked_at=None)
+        )
+        await session.commit()
+        return result.rowcount
+
+
+class JobWorkerPool:
+    """
+    Пул asyncio-воркеров, обрабатывающих очередь notification_jobs.
+
+    Диспетчер захватывает задачи пачками по числу свободных мест в локальной
+    очереди, воркеры отправляют их через send_content и помечают
+    delivered или failed. Временные ошибки не занимают воркер на время паузы:
+    задача возвращается в pending с next_attempt_at по экспоненциальной
+    паузе с джиттером, пока не исчерпано max_attempts попыток. Окончательно
+    неудавшиеся задачи попадают в dead_letters. Новые задачи будят диспетчер через notify(),
+    а при отсутствии сигналов таблица опрашивается раз в poll_interval секунд.
+    """
+
+    def __init__(self, workers: int, poll_interval: float, lock_timeout: int, max_attempts: int):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lock_timeout = lock_timeout
+        self.max_attempts = max_attempts
+        self._queue: Optional[asyncio.Queue] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return self._dispatcher is not None and not self._dispatcher.done()
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def notify(self) -> None:
+        """Будит диспетчер после постановки новой задачи."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        if self.running or self.workers <= 0:
+            return
+        self._queue = asyncio.Queue(maxsize=self.workers)
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def stop(self) -> None:
+        """Останавливает диспетчер, дожидается текущих отправок и возвращает невзятые задачи в очередь."""
+        if not self.running:
+            return
+
+        self._dispatcher.cancel()
+        try:
+            await self._dispatcher
+        except asyncio.CancelledError:
+            pass
+        self._dispatcher = None
+
+        pending = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait().id)
+        await release_jobs(pending)
+
+        for _ in self._tasks:
+            await self._queue.put(None)
+        await asyncio.gather(*self._tasks)
+        self._tasks = []
+
+    async def _dispatch(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_requeue = loop.time()
+
+        while True:
+            try:
+                if loop.time() >= next_requeue:
+                    await requeue_stale_jobs(self.lock_timeout)
+                    next_requeue = loop.time() + self.lock_timeout
+
+                room = max(self._queue.maxsize - self._queue.qsize(), 1)
+                self._wakeup.clear()
+                jobs = await claim_jobs(room)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await logs_bot("error", f"Job dispatcher error: {str(e)}")
+                jobs = []
+
+            if not jobs:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            for index, job in enumerate(jobs):
+                try:
+                    await self._queue.put(job)
+                except asyncio.CancelledError:
+                    await release_jobs([job.id for job in jobs[index:]])
+                    raise
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            if job is None:
+                return
+            try:
+                await self._process(job)
+            except Exception as e:
+                await logs_bot("error", f"Job worker error on job {job.id}: {str(e)}")
+
+    async def _process(self, job: NotificationJob) -> None:
+        params = job.payload
+        try:
+            await send_content(job.chat_id, params)
+        except Exception as e:
+            error_class = classify_error(e)
+            if error_class.transient and job.attempts < self.max_attempts:
+                delay = backoff_delay(job.attempts, error_class.retry_after)
+                await logs_bot("warning", f"Job {job.id} attempt {job.attempts} failed, retry in {delay:.1f}s: {str(e)}")
+                if not await retry_job(job, str(e), delay):
+                    await self._lost_claim(job)
+                return
+
+            await logs_bot("error", f"Job {job.id} failed: {str(e)}")
+            if not await finish_job(job, "failed", str(e)):
+                await self._lost_claim(job)
+                return
+            await self._record(job, "failed")
+            await record_failures([
+                dead_letter_entry(params, e, error_class, job.attempts, job_id=job.id, broadcast_id=job.broadcast_id)
+            ])
+            return
+
+        # Статус задачи фиксируется сразу после отправки: если запись истории
+        # ниже упадет, задача не вернется в очередь и сообщение не уйдет повторно
+        if not await finish_job(job, "delivered"):
+            await self._lost_claim(job)
+            return
+        await self._record(job, "delivered")
+
+    async def _lost_claim(self, job: NotificationJob) -> None:
+        await logs_bot(
+            "warning",
+            f"Job {job.id} attempt {job.attempts} is no longer claimed by this worker "
+            f"(lock expired after {self.lock_timeout}s), status not updated"
+        )
+
+    async def _record(self, job: NotificationJob, status: str) -> None:
+        """Запись в историю уведомлений; ошибка только логируется."""
+        try:
+            await log_notification(job.payload, status=status)
+        except Exception as e:
+            await logs_bot("error", f"Failed to record notification for job {job.id}: {str(e)}")
+
+
+class JobScheduler:
+    """
+    Выпуск отложенных задач (status=scheduled) в очередь в нужное время.
+
+    Ближайшие времена отправки хранятся в куче: планировщик спит до вершины
+    кучи, а не опрашивает таблицу. Новые отложенные задачи этого процесса
+    добавляются в кучу через schedule(); после каждого выпуска и не реже
+    раза в max_sleep секунд ближайшее время перечитывается из базы
+    (MIN по индексу), так что задачи других процессов и задачи после
+    перезапуска тоже не теряются.
+
+    Наступившие задачи переводятся в pending пачками по release_batch,
+    не быстрее release_rate задач в секунду, поэтому большая рассылка
+    «на 09:00» попадает к воркерам постепенно, а не одним всплеском.
+    """
+
+    def __init__(self, release_rate: float, release_batch: int, max_sleep: float):
+        self.release_rate = release_rate
+        self.release_batch = release_batch
+        self.max_sleep = max_sleep
+        self.released = 0
+        self._heap: List[float] = []
+        self._known: Set[float] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def schedule(self, send_at: datetime) -> None:
+        """Добавляет время отправки в кучу и будит планировщик, если оно раньше текущего ожидания."""
+        when = send_at.timestamp()
+        if when in self._known:
+            return
+        self._known.add(when)
+        heapq.heappush(self._heap, when)
+        if self._wakeup is not None and self._heap[0] == when:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if not self.running:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _refresh(self) -> None:
+        next_time = await next_scheduled_time()
+        if next_time is not None:
+            self.schedule(next_time)
+
+    async def _release_due(self) -> None:
+        while True:
+            released = await release_scheduled_jobs(self.release_batch)
+            if released:
+                self.released += released
+                job_pool.notify()
+            if released < self.release_batch:
+                return
+            await asyncio.sleep(self.release_batch / self.release_rate)
+
+    async def _run(self) -> None:
+        refresh_at = 0.0
+        while True:
+            try:
+                now = time.time()
+                if now >= refresh_at:
+                    await self._refresh()
+                    refresh_at = now + self.max_sleep
+
+                if self._heap and self._heap[0] <= now:
+                    while self._heap and self._heap[0] <= now:
+                        self._known.discard(heapq.heappop(self._heap))
+                    await self._release_due()
+                    refresh_at = 0.0
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await logs_bot("error", f"Job scheduler error: {str(e)}")
+                refresh_at = 0.0
+                await asyncio.sleep(min(self.max_sleep, 5.0))
+                continue
+
+            timeout = min(self._heap[0] - time.time() if self._heap else self.max_sleep, refresh_at - time.time())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+
+
+job_pool = JobWorkerPool(
+    workers=settings.config.job_workers,
+    poll_interval=settings.config.job_poll_interval,
+    lock_timeout=settings.config.job_lock_timeout,
+    max_attempts=settings.config.delivery_max_attempts
+)
+
+job_scheduler = JobScheduler(
+    release_rate=settings.config.schedule_release_rate,
+    release_batch=settings.config.schedule_release_batch,
+    max_sleep=settings.config.schedule_max_sleep
+)
@@ -0,0 +1,381 @@
+from contextlib import asynccontextmanager
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field, asdict
+from email.utils import parsedate_to_datetime
+from app.core.config import settings
+from app.core.http import http_client, origin_error
+from app.core.logging import logs_bot
+from app.core.metrics import MEDIA_DOWNLOAD_BYTES, MEDIA_DOWNLOAD_DURATION
+from typing import AsyncIterator, Dict, Optional, Set
+import aiofiles
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+import weakref
+
+
+@dataclass
+class UrlEntry:
+    url: str
+    sha256: str
+    content_type: str
+    expires_at: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+@dataclass
+class BlobEntry:
+    sha256: str
+    size: int
+    urls: Set[str] = field(default_factory=set)
+
+
+@dataclass
+class CachedMedia:
+    """Файл из кэша: путь на диске, content-type и размер."""
+    path: str
+    content_type: str
+    size: int
+    from_cache: bool
+
+
+def get_freshness(headers, default_ttl: int) -> Optional[float]:
+    """
+    Вычисляет, сколько секунд ответ можно считать свежим.
+
+    Учитывает Cache-Control (no-store, no-cache, max-age) и Expires.
+    Возвращает None, если ответ кэшировать нельзя.
+    """
+    directives = {}
+    for part in headers.get("Cache-Control", "").lower().split(","):
+        name, _, value = part.strip().partition("=")
+        if name:
+            directives[name] = value.strip('"')
+
+    if "no-store" in directives or "private" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0
+    if "max-age" in directives:
+        try:
+            return max(int(directives["max-age"]), 0)
+        except ValueError:
+            return 0
+
+    expires = headers.get("Expires")
+    if expires:
+        try:
+            return max(parsedate_to_datetime(expires).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return 0
+
+    return default_ttl
+
+
+class MediaStore:
+    """
+    Контентно-адресуемый кэш медиа-файлов на локальном диске.
+
+    Файлы хранятся в <root>/blobs под именем sha256 содержимого, поэтому
+    одинаковые байты с разных URL хранятся один раз. Для каждого URL
+    запоминаются ETag/Last-Modified и срок свежести из HTTP-заголовков:
+    свежие записи отдаются с диска без обращения к источнику, устаревшие
+    перепроверяются условным GET (If-None-Match / If-Modified-Since).
+    При превышении max_bytes файлы вытесняются в порядке LRU.
+    Индекс сохраняется в <каталог>/index.json и загружается при старте.
+
+    Индекс и LRU хранятся в памяти процесса, поэтому каждый процесс
+    (например, воркеры при API_WORKERS > 1) работает в своем подкаталоге
+    <root>/<n>: при старте процесс занимает первый свободный каталог
+    блокировкой fcntl.flock на файл .lock и держит ее до завершения.
+    Перезапущенный процесс подхватывает освободившийся каталог вместе с кэшем,
+    а max_bytes действует для каждого каталога отдельно.
+    """
+
+    def __init__(self, root: Optional[str], max_bytes: int, default_ttl: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self._urls: Dict[str, UrlEntry] = {}
+        self._blobs: OrderedDict = OrderedDict()
+        self._pinned: Counter = Counter()
+        self._locks: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+        self._loaded = False
+        self.path: Optional[str] = None
+        self._slot_lock = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.root)
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.path, "blobs", sha256)
+
+    def _index_path(self) -> str:
+        return os.path.join(self.path, "index.json")
+
+    def _claim_dir(self) -> str:
+        """Занимает первый свободный подкаталог <root>/<n> блокировкой на время жизни процесса."""
+        slot = 0
+        while True:
+            path = os.path.join(self.root, str(slot))
+            os.makedirs(path, exist_ok=True)
+            lock_file = open(os.path.join(path, ".lock"), "w")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                slot += 1
+                continue
+            self._slot_lock = lock_file
+            return path
+
+    def load(self) -> None:
+        """Загружает индекс с диска, пропуская файлы, которых больше нет."""
+        if not self.enabled or self._loaded:
+            return
+        self.path = self._claim_dir()
+        os.makedirs(os.path.join(self.path, "blobs"), exist_ok=True)
+        os.makedirs(os.path.join(self.path, "tmp"), exist_ok=True)
+        self._loaded = True
+
+        if not os.path.exists(self._index_path()):
+            return
+        try:
+            with open(self._index_path()) as index_file:
+                data = json.load(index_file)
+        except (OSError, ValueError) as e:
+            print(f"Media cache index is unreadable, starting empty: {e}")
+            return
+
+        for blob in data.get("blobs", []):
+            if os.path.exists(self._blob_path(blob["sha256"])):
+                self._blobs[blob["sha256"]] = BlobEntry(blob["sha256"], blob["size"])
+                self.total_bytes += blob["size"]
+        for item in data.get("urls", []):
+            entry = UrlEntry(**item)
+            if entry.sha256 in self._blobs:
+                self._urls[entry.url] = entry
+                self._blobs[entry.sha256].urls.add(entry.url)
+
+    async def save(self) -> None:
+        """Атомарно сохраняет индекс на диск."""
+        if not self.enabled:
+            return
+        data = {
+            # Порядок blobs сохраняет LRU-очередь между перезапусками
+            "blobs": [{"sha256": blob.sha256, "size": blob.size} for blob in self._blobs.values()],
+            "urls": [asdict(entry) for entry in self._urls.values()]
+        }
+        tmp_path = self._index_path() + ".tmp"
+        async with aiofiles.open(tmp_path, "w") as index_file:
+            await index_file.write(json.dumps(data))
+        os.replace(tmp_path, self._index_path())
+
+    def stats(self) -> dict:
+        return {
+            "total_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "blobs": len(self._blobs),
+            "urls": len(self._urls),
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations
+        }
+
+    def _lock(self, url: str) -> asyncio.Lock:
+        lock = self._locks.get(url)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[url] = lock
+        return lock
+
+    def _pin(self, sha256: str) -> None:
+        self._pinned[sha256] += 1
+
+    def _unpin(self, sha256: str) -> None:
+        self._pinned[sha256] -= 1
+        if self._pinned[sha256] > 0:
+            return
+        del self._pinned[sha256]
+
+        blob = self._blobs.get(sha256)
+        if blob is not None and not blob.urls:
+            # Некэшируемый ответ (no-store): файл нужен был только на время отправки
+            self._blobs.pop(sha256)
+            self.total_bytes -= blob.size
+            try:
+                os.remove(self._blob_path(sha256))
+            except FileNotFoundError:
+                pass
+
+    def _forget_url(self, url: str) -> None:
+        entry = self._urls.pop(url, None)
+        if entry is not None and entry.sha256 in self._blobs:
+            self._blobs[entry.sha256].urls.discard(url)
+
+    def _drop_blob(self, sha256: str) -> None:
+        """Удаляет файл и все ссылающиеся на него URL из индекса (но не с диска)."""
+        blob = self._blobs.pop(sha256, None)
+        if blob is None:
+            return
+        for url in blob.urls:
+            self._urls.pop(url, None)
+        self.total_bytes -= blob.size
+
+    def _evict(self) -> None:
+        for sha256 in list(self._blobs):
+            if self.total_bytes <= self.max_bytes:
+                return
+            if sha256 in self._pinned:
+                continue
+            self._drop_blob(sha256)
+            try:
+                os.remove(self._blob_path(sha256))
+            except FileNotFoundError:
+                pass
+
+    async def _download(self, response, headers_ttl: Optional[float], url: str) -> UrlEntry:
+        """
+        Скачивает тело ответа во временный файл, считая sha256, и переносит его в blobs.
+        Полученный файл возвращается уже закрепленным (pinned).
+        """
+        max_bytes = settings.config.media_max_bytes
+        content_length = response.content_length
+        if content_length is not None and content_length > max_bytes:
+            raise ValueError(f"Файл слишком большой: {content_length} байт (максимум {max_bytes})")
+
+        started_at = time.perf_counter()
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.path, "tmp"))
+        os.close(fd)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async with aiofiles.open(tmp_path, "wb") as tmp_file:
+                async for chunk in response.content.iter_chunked(settings.config.media_chunk_size):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise ValueError(f"Файл слишком большой: больше {max_bytes} байт")
+                    digest.update(chunk)
+                    await tmp_file.write(chunk)
+
+            http_client.bytes_received += size
+            MEDIA_DOWNLOAD_BYTES.inc(amount=size)
+            MEDIA_DOWNLOAD_DURATION.observe(time.perf_counter() - started_at)
+            sha256 = digest.hexdigest()
+            if sha256 in self._blobs:
+                # Такие же байты уже есть под другим URL
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, self._blob_path(sha256))
+                self._blobs[sha256] = BlobEntry(sha256, size)
+                self.total_bytes += size
+            self._pin(sha256)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self._forget_url(url)
+        entry = UrlEntry(
+            url=url,
+            sha256=sha256,
+            content_type=response.headers.get("Content-Type", "application/octet-stream"),
+            expires_at=time.time() + (headers_ttl or 0),
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified")
+        )
+        if headers_ttl is not None:
+            self._urls[url] = entry
+            self._blobs[sha256].urls.add(url)
+        return entry
+
+    @asynccontextmanager
+    async def open(self, url: str) -> AsyncIterator[CachedMedia]:
+        """
+        Возвращает файл по URL с локального диска, при необходимости скачивая
+        или перепроверяя его у источника. Пока контекст открыт,
+        файл защищен от вытеснения.
+        """
+        self.load()
+
+        async with self._lock(url):
+            entry = self._urls.get(url)
+            if entry is not None and not os.path.exists(self._blob_path(entry.sha256)):
+                # Файл удален с диска в обход кэша - это промах, скачиваем заново
+                self._drop_blob(entry.sha256)
+                entry = None
+            from_cache = False
+            changed = True
+            if entry is not None:
+                # Защищаем старую версию от вытеснения на время перепроверки
+                self._pin(entry.sha256)
+            previous = entry
+
+            try:
+                if entry is not None and entry.expires_at > time.time():
+                    from_cache = True
+                    changed = False
+                    self._pin(entry.sha256)
+                else:
+                    headers = {}
+                    if entry is not None:
+                        if entry.etag:
+                            headers["If-None-Match"] = entry.etag
+                        if entry.last_modified:
+                            headers["If-Modified-Since"] = entry.last_modified
+
+                    async with http_client.request("GET", url, headers=headers) as response:
+                        ttl = get_freshness(response.headers, self.default_ttl)
+                        if response.status == 304 and entry is not None:
+                            self.revalidations += 1
+                            entry.expires_at = time.time() + (ttl or 0)
+                            from_cache = True
+                            self._pin(entry.sha256)
+                        elif response.status == 200:
+                            entry = await self._download(response, ttl, url)
+                        else:
+                            error_text = await response.text()
+                            await logs_bot("error", f"Ошибка скачивания: {response.status}, Ответ: {error_text}")
+                            raise ValueError(f"Ошибка загрузки: {response.status}") from origin_error(response)
+            finally:
+                if previous is not None:
+                    self._unpin(previous.sha256)
+
+            if from_cache:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+            blob = self._blobs[entry.sha256]
+            self._blobs.move_to_end(entry.sha256)
+            self._evict()
+            if changed:
+                await self.save()
+
+        try:
+            yield CachedMedia(
+                path=self._blob_path(entry.sha256),
+                content_type=entry.content_type,
+                size=blob.size,
+                from_cache=from_cache
+            )
+        finally:
+            self._unpin(entry.sha256)
+            self._evict()
+
+
+media_store = MediaStore(
+    root=settings.config.media_cache_dir,
+    max_bytes=settings.config.media_cache_max_bytes,
+    default_ttl=settings.config.media_cache_default_ttl
+)
@@ -1,48 +1,64 @@
-from fastapi import FastAPI, Request, HTTPException, Depends
-from fastapi.security import APIKeyHeader
+from fastapi import FastAPI, Header, HTTPException, Depends, Request
+from fastapi.responses import PlainTextResponse
 from contextlib import asynccontextmanager
-import aiohttp
 from app.services.chat import router as chat_router
+from app.services.analytics import router as analytics_router
+from app.Bot.middleware.auth import verify_token, require_scope, api_keys
+from app.Bot.webhook import router as webhook_router, webhook_processor
+from app.core.http import http_client
+from app.db.database import init_db, warm_user_cache
+from app.core.logging import log_sink
+from app.core.cache import user_cache
+from app.core.metrics import registry, MetricsMiddleware
+from app.core.rate_limiter import scheduler
+from app.services.jobs import job_pool, job_scheduler, get_queue_depth
+from app.services.file_id_cache import file_id_cache
+from app.services.media_store import media_store
+from app.services.retention import retention_service
+from app.services.forwarder import forwarder, ForwardError
+from app.services.idempotency import idempotent
+from typing import Optional
 
 
-session = None
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global session
-    session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False))
+    http_client.start()
+    await init_db()
+    await warm_user_cache()
+    media_store.load()
+    log_sink.start()
+    job_pool.start()
+    job_scheduler.start()
+    retention_service.start()
     yield
-    await session.close()
+    await webhook_processor.stop()
+    await retention_service.stop()
+    await job_scheduler.stop()
+    await job_pool.stop()
+    await forwarder.close()
+    await http_client.close()
+    await log_sink.stop()
 
 app = FastAPI(lifespan=lifespan)
-api_key_header = APIKeyHeader(name="Authorization", auto_error=False)
+app.add_middleware(MetricsMiddleware)
 
-
-async def verify_api_key(api_key: str = Depends(api_key_header), request: Request = None):
-    """
-    Проверяет наличие API ключа в заголовках запроса.
-    
-    Если API ключ отсутствует, выбрасывает исключение HTTPException с кодом 401.
-    
-    Параметры:
-    - api_key: строка, полученная из заголовка Authorization.
-    - request: объект запроса FastAPI (необязательный).
-    
-    Возвращает:
-    - api_key: строка, если ключ присутствует.
-    """
-    if not api_key:
-        raise HTTPException(
-            status_code=401,
-            detail="API key is missing"
-        )
-    return api_key
+# Проверка API-ключа (права и лимиты ключа) для всех эндпоинтов, кроме вебхука Telegram
+authenticated = [Depends(verify_token)]
 
 # router
-app.include_router(chat_router, prefix="/chat", tags=["chat"], dependencies=[Depends(verify_api_key)])
+app.include_router(chat_router, prefix="/chat", tags=["chat"], dependencies=authenticated)
+app.include_router(analytics_router, prefix="/analytics", tags=["analytics"], dependencies=authenticated)
+app.include_router(webhook_router)
 
 
-@app.post("/sending_service") # без тестов 
-async def send_notification(message: dict,target_service_url: str,api_key: str = Depends(api_key_header)):
+@app.post("/sending_service", dependencies=authenticated) # без тестов 
+async def send_notification(
+    request: Request,
+    message: dict,
+    target_service_url: str,
+    batch: bool = False,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
     """
     Эндпоинт для отправки уведомлений на другой сервис
     {
@@ -56,58 +72,95 @@ async def send_notification(message: dict,target_service_url: str,api_key: str =
 
     message - сообщение для отправки
     target_service_url - URL целевого сервиса
-    api_key - API ключ для проверки
+    batch - объединять уведомления к одному сервису в один POST {"notifications": [...]}
     data - данные для отправки
     data/type - тип сообщения
     data/priority - приоритет сообщения
+
+    Запросы к каждому сервису ограничены по числу одновременных и по времени;
+    при перегрузке или недоступности сервиса ответ 503 возвращается сразу.
+
+    С заголовком Idempotency-Key повтор запроса получает сохраненный ответ
+    без повторной пересылки.
     """
 
-    if not api_key:
-        raise HTTPException(
-            status_code=401,
-            detail="API key is missing"
-        )
-    
-    try:
-        async with session.post(
-            target_service_url,
-            json=message
-        ) as response:
-            if response.status == 200:
-                return {"status": "success", "message": "Notification sent successfully"}
-            else:
-                raise HTTPException(
-                    status_code=response.status,
-                    detail=f"Failed to send notification: {await response.text()}"
-                )
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error sending notification: {str(e)}"
-        )
+    async def forward():
+        try:
+            result = await forwarder.forward(target_service_url, message, batch=batch)
+        except ForwardError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error sending notification: {str(e)}"
+            )
 
-@app.get("/ping")
-async def ping(api_key: str = Depends(api_key_header)):
+        return {"status": "success", "message": "Notification sent successfully", "batched": result["batched"]}
+
+    return await idempotent(
+        request,
+        idempotency_key,
+        {"message": message, "target_service_url": target_service_url, "batch": batch},
+        forward
+    )
+
+@app.get("/ping", dependencies=authenticated)
+async def ping():
     """Эндпоинт для проверки работоспособности сервиса"""
     
-    if not api_key:
-        raise HTTPException(
-            status_code=401,
-            detail="API key is missing"
-        )
-    
     try:
         return {"status": "success", "message": "PONG!"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
-async def run_fastapi():
-    import uvicorn
-    uvicorn.run(
-        "app.services.notification_service:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,           # Включаем автоматическую перезагрузку
-        log_level="info"       # Уровень логирования
-    )
+@app.get("/stats", dependencies=[Depends(require_scope("admin"))])
+async def stats():
+    """Статистика общего пула HTTP-соединений, дискового кэша медиа, пересылки в другие сервисы и API-ключей"""
+    return {
+        "http_pool": http_client.stats(),
+        "media_cache": media_store.stats(),
+        "forwarder": forwarder.stats(),
+        "api_keys": api_keys.stats()
+    }
 
+
+# Метрики, которые снимаются с компонентов в момент запроса /metrics
+registry.callback(
+    "queue_depth",
+    "In-process queue depth",
+    lambda: [
+        (("log_sink",), log_sink.qsize()),
+        (("job_workers",), job_pool.qsize()),
+        (("telegram_scheduler",), scheduler.waiting())
+    ],
+    ("queue",)
+)
+JOB_QUEUE_DEPTH = registry.gauge("notification_jobs", "Durable job queue depth by status", ("status",))
+registry.callback(
+    "cache_requests_total",
+    "Cache lookups by result",
+    lambda: [
+        (("user", "hit"), user_cache.hits),
+        (("user", "miss"), user_cache.misses),
+        (("file_id", "hit"), file_id_cache.hits),
+        (("file_id", "miss"), file_id_cache.misses),
+        (("media", "hit"), media_store.hits),
+        (("media", "miss"), media_store.misses)
+    ],
+    ("cache", "result"),
+    kind="counter"
+)
+registry.callback("log_records_dropped_total", "Log records dropped by the log sink", lambda: [((), log_sink.dropped)], kind="counter")
+registry.callback("http_client_in_flight", "Outgoing HTTP requests in flight", lambda: [((), http_client.in_flight)])
+
+@app.get("/metrics", dependencies=[Depends(require_scope("admin"))])
+async def metrics():
+    """
+    Метрики процесса в текстовом формате Prometheus.
+
+    Счетчики хранятся в памяти процесса: при API_WORKERS > 1 каждый
+    воркер отдает свои значения.
+    """
+    for status, count in (await get_queue_depth()).items():
+        JOB_QUEUE_DEPTH.set(count, status)
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,195 @@
+from sqlalchemy import delete, text
+from sqlalchemy.future import select
+from app.db.database import engine, async_session
+from app.db.models import DeadLetter, IdempotencyRecord, LogsJson, Notification, NotificationJob, NotificationRollup
+from app.core.config import settings
+from app.core.logging import logs_bot
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, List, Optional
+import asyncio
+import gzip
+import json
+import os
+
+
+@dataclass
+class RetentionPolicy:
+    """
+    Правило хранения таблицы: строки старше ttl_days по time_column удаляются.
+
+    local_time - колонка хранит локальное время без часового пояса (logs_json),
+    filters - дополнительные условия (например, только завершенные задачи).
+    """
+    table_class: Any
+    ttl_days: int
+    time_column: str = "created_at"
+    local_time: bool = False
+    filters: List[Any] = field(default_factory=list)
+
+    def cutoff(self) -> datetime:
+        now = datetime.now() if self.local_time else datetime.now(timezone.utc)
+        return now - timedelta(days=self.ttl_days)
+
+
+def compress_rows(rows: List[dict]) -> bytes:
+    """Сжимает строки в один gzip-член JSONL."""
+    lines = "".join(json.dumps(row, ensure_ascii=False, default=str) + "\n" for row in rows)
+    return gzip.compress(lines.encode("utf-8"))
+
+
+def write_archive(archive_dir: str, table_name: str, member: bytes) -> None:
+    """
+    Дописывает gzip-член (compress_rows) в сегмент <archive_dir>/<table>/<YYYY-MM-DD>.jsonl.gz.
+    Файл из нескольких gzip-членов остается валидным gzip.
+    """
+    table_dir = os.path.join(archive_dir, table_name)
+    os.makedirs(table_dir, exist_ok=True)
+    path = os.path.join(table_dir, f"{datetime.now(timezone.utc):%Y-%m-%d}.jsonl.gz")
+    with open(path, "ab") as archive:
+        archive.write(member)
+
+
+class RetentionService:
+    """
+    Фоновая очистка растущих таблиц.
+
+    Раз в interval секунд удаляет устаревшие строки небольшими пачками
+    (DELETE ... WHERE id IN (SELECT ... LIMIT batch_size) RETURNING ...) с паузой
+    между пачками, чтобы не блокировать надолго запись. Удаленные строки
+    при заданном archive_dir сохраняются в сжатые JSONL-сегменты.
+    После очистки выполняется обслуживание базы: ANALYZE / PRAGMA optimize
+    и, если включено, VACUUM.
+    """
+
+    def __init__(
+        self,
+        policies: List[RetentionPolicy],
+        interval: int,
+        batch_size: int,
+        batch_pause: float,
+        archive_dir: Optional[str] = None,
+        vacuum: bool = False
+    ):
+        self.policies = [policy for policy in policies if policy.ttl_days > 0]
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.archive_dir = archive_dir
+        self.vacuum = vacuum
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await logs_bot("error", f"Retention error: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> dict:
+        """Выполняет один проход очистки по всем таблицам и обслуживание базы."""
+        deleted = {}
+        for policy in self.policies:
+            deleted[policy.table_class.__tablename__] = await self.purge(policy)
+
+        await self.maintain()
+        if any(deleted.values()):
+            await logs_bot("info", f"Retention removed rows: {deleted}")
+        return deleted
+
+    async def purge(self, policy: RetentionPolicy) -> int:
+        """Удаляет устаревшие строки таблицы пачками, возвращает их количество."""
+        table_class = policy.table_class
+        columns = list(table_class.__table__.columns)
+        cutoff = policy.cutoff()
+        total = 0
+
+        while True:
+            batch_ids = (
+                select(table_class.id)
+                .where(getattr(table_class, policy.time_column) < cutoff, *policy.filters)
+                .order_by(table_class.id)
+                .limit(self.batch_size)
+                .scalar_subquery()
+            )
+            async with async_session() as session:
+                result = await session.execute(
+                    delete(table_class)
+                    .where(table_class.id.in_(batch_ids))
+                    .returning(*columns)
+                )
+                rows = [dict(row) for row in result.mappings()]
+                # Архив сжимается до фиксации, а дописывается только после нее: если
+                # COMMIT не пройдет, строки останутся в таблице и не попадут в архив дважды
+                member = None
+                if rows and self.archive_dir:
+                    member = await asyncio.to_thread(compress_rows, rows)
+                await session.commit()
+
+            if member is not None:
+                await asyncio.to_thread(write_archive, self.archive_dir, table_class.__tablename__, member)
+
+            total += len(rows)
+            if len(rows) < self.batch_size:
+                return total
+            await asyncio.sleep(self.batch_pause)
+
+    async def maintain(self) -> None:
+        """Обновляет статистику планировщика запросов и, при необходимости, сжимает базу."""
+        if engine.dialect.name == "sqlite":
+            statements = ["PRAGMA optimize"] + (["VACUUM"] if self.vacuum else [])
+        elif engine.dialect.name == "postgresql":
+            verb = "VACUUM (ANALYZE)" if self.vacuum else "ANALYZE"
+            statements = [f"{verb} {policy.table_class.__tablename__}" for policy in self.policies]
+        else:
+            return
+
+        # VACUUM нельзя выполнять внутри транзакции
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            for statement in statements:
+                await conn.execute(text(statement))
+
+
+retention_service = RetentionService(
+    policies=[
+        RetentionPolicy(LogsJson, settings.config.logs_ttl_days, local_time=True),
+        RetentionPolicy(Notification, settings.config.notifications_ttl_days),
+        RetentionPolicy(
+            NotificationJob,
+            settings.config.jobs_ttl_days,
+            time_column="updated_at",
+            filters=[NotificationJob.status.in_(["delivered", "failed", "cancelled"])]
+        ),
+        RetentionPolicy(
+            NotificationRollup,
+            settings.config.minute_rollups_ttl_days,
+            time_column="bucket_start",
+            filters=[NotificationRollup.granularity == "minute"]
+        ),
+        RetentionPolicy(DeadLetter, settings.config.dead_letters_ttl_days),
+        RetentionPolicy(IdempotencyRecord, settings.config.idempotency_ttl / 86400),
+    ],
+    interval=settings.config.retention_interval,
+    batch_size=settings.config.retention_batch_size,
+    batch_pause=settings.config.retention_batch_pause,
+    archive_dir=settings.config.retention_archive_dir,
+    vacuum=settings.config.retention_vacuum
+)
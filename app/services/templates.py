@@ -0,0 +1,201 @@
+from sqlalchemy import delete
+from sqlalchemy.future import select
+from app.db.database import async_session, add_to_table, get_user_names
+from app.db.models import MessageTemplate
+from app.core.cache import TTLCache
+from app.core.config import settings
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from string import Formatter
+from typing import Dict, FrozenSet, List, Optional, Tuple
+import html
+
+
+# Поля пользователя, доступные в шаблонах без передачи переменных
+USER_FIELDS = ("first_name", "last_name")
+
+
+@dataclass(frozen=True)
+class CompiledTemplate:
+    """
+    Шаблон, разобранный один раз при регистрации.
+
+    parts - пары (литерал, имя переменной или None); render только склеивает
+    литералы с экранированными значениями, без разбора текста шаблона.
+    Литералы - разметка автора шаблона (ParseMode.HTML), значения переменных
+    всегда экранируются.
+    """
+    parts: Tuple[Tuple[str, Optional[str]], ...]
+
+    @property
+    def fields(self) -> FrozenSet[str]:
+        return frozenset(field for _, field in self.parts if field is not None)
+
+    def bind(self, values: Dict[str, object]) -> "CompiledTemplate":
+        """
+        Подставляет известные значения заранее и возвращает шаблон с оставшимися полями.
+        Общие для рассылки переменные экранируются и подставляются один раз, а не для каждого получателя.
+        """
+        parts = []
+        literal = ""
+        for text, field in self.parts:
+            literal += text
+            if field is None:
+                continue
+            if field in values:
+                literal += escape_value(values[field])
+                continue
+            parts.append((literal, field))
+            literal = ""
+        parts.append((literal, None))
+        return CompiledTemplate(tuple(parts))
+
+    def render(self, values: Dict[str, object]) -> str:
+        """Подставляет значения (отсутствующие - пустой строкой)."""
+        return "".join(
+            text if field is None else text + escape_value(values.get(field))
+            for text, field in self.parts
+        )
+
+
+def escape_value(value) -> str:
+    return html.escape(str(value)) if value is not None else ""
+
+
+def compile_template(body: str) -> CompiledTemplate:
+    """
+    Разбирает шаблон с переменными вида {first_name}; {{ и }} - литеральные скобки.
+
+    Допускаются только простые имена: без атрибутов, индексов, преобразований
+    и спецификаций формата. Ошибка разбора - ValueError.
+    """
+    if not isinstance(body, str) or not body:
+        raise ValueError("Template body must be a non-empty string")
+
+    parts = []
+    for literal, field, format_spec, conversion in Formatter().parse(body):
+        if field is not None and (not field.isidentifier() or format_spec or conversion):
+            raise ValueError(f"Invalid template variable: {{{field}}}. Only plain names like {{first_name}} are allowed")
+        parts.append((literal, field))
+    return CompiledTemplate(tuple(parts))
+
+
+class TemplateStore:
+    """
+    Шаблоны сообщений в таблице message_templates с кэшем скомпилированных шаблонов.
+
+    Шаблон разбирается один раз при регистрации или первом чтении из базы;
+    в других процессах изменения становятся видны через cache_ttl секунд.
+    """
+
+    def __init__(self, cache_size: int, cache_ttl: float):
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+
+    async def save(self, name: str, body: str) -> CompiledTemplate:
+        """
+        Проверяет, сохраняет (upsert по name) и кэширует шаблон.
+        Ошибка шаблона - ValueError, ошибка записи в базу - RuntimeError (кэш не меняется).
+        """
+        if not name:
+            raise ValueError("Template name is required")
+        template = compile_template(body)
+        saved = await add_to_table(MessageTemplate, {"name": name, "body": body, "updated_at": datetime.now(timezone.utc)})
+        if not saved:
+            raise RuntimeError(f"Failed to save template: {name}")
+        self._cache.set(name, template)
+        return template
+
+    async def get(self, name: str) -> CompiledTemplate:
+        """Возвращает скомпилированный шаблон; неизвестное имя - ValueError."""
+        template = self._cache.get(name)
+        if template is not None:
+            return template
+
+        async with async_session() as session:
+            body = await session.scalar(select(MessageTemplate.body).where(MessageTemplate.name == name))
+        if body is None:
+            raise ValueError(f"Template not found: {name}")
+
+        template = compile_template(body)
+        self._cache.set(name, template)
+        return template
+
+    async def list_all(self) -> List[dict]:
+        async with async_session() as session:
+            result = await session.execute(
+                select(MessageTemplate.name, MessageTemplate.body, MessageTemplate.updated_at)
+                .order_by(MessageTemplate.name)
+            )
+            return [dict(row._mapping) for row in result]
+
+    async def delete(self, name: str) -> bool:
+        self._cache.invalidate(name)
+        async with async_session() as session:
+            result = await session.execute(delete(MessageTemplate).where(MessageTemplate.name == name))
+            await session.commit()
+            return result.rowcount > 0
+
+
+template_store = TemplateStore(
+    cache_size=settings.config.template_cache_size,
+    cache_ttl=settings.config.template_cache_ttl
+)
+
+
+def template_target(params: dict) -> str:
+    """Поле, в которое подставляется текст шаблона: content для text, caption для медиа."""
+    return "content" if params["message_type"] == "text" else "caption"
+
+
+async def render_for_recipients(params: dict, chat_ids: List[int]) -> Optional[Dict[int, str]]:
+    """
+    Рендерит шаблон params["template"] для списка получателей.
+
+    Значения: поля пользователя (first_name, last_name), поверх них - общие
+    variables, поверх них - recipient_variables[chat_id]. Общие переменные
+    подставляются в шаблон один раз, имена пользователей загружаются
+    пакетными запросами и только если шаблон их использует.
+
+    Возвращает:
+    - {chat_id: текст} или None, если шаблон не задан.
+    """
+    name = params.get("template")
+    if not name:
+        return None
+
+    template = await template_store.get(name)
+    variables = params.get("variables") or {}
+    recipient_variables = {
+        int(chat_id): values for chat_id, values in (params.get("recipient_variables") or {}).items()
+    }
+    recipient_keys = {key for values in recipient_variables.values() for key in values}
+
+    template = template.bind({key: value for key, value in variables.items() if key not in recipient_keys})
+    missing = template.fields - set(USER_FIELDS) - recipient_keys
+    if missing:
+        raise ValueError(f"Missing template variables: {sorted(missing)}")
+
+    if not template.fields:
+        text = template.render({})
+        return {chat_id: text for chat_id in chat_ids}
+
+    users = await get_user_names(chat_ids) if template.fields & set(USER_FIELDS) else {}
+    rendered = {}
+    for chat_id in chat_ids:
+        values = users.get(chat_id, {})
+        if recipient_keys:
+            values = {**values, **variables, **recipient_variables.get(chat_id, {})}
+        rendered[chat_id] = template.render(values)
+    return rendered
+
+
+def personalize(params: dict, chat_id: int, contents: Optional[Dict[int, str]]) -> dict:
+    """
+    Параметры сообщения конкретного получателя с подставленным текстом шаблона.
+    Переменные шаблона в результат не попадают: задачам и dead_letters нужен только готовый текст.
+    """
+    if contents is None:
+        return {**params, "chat_id": chat_id}
+    recipient_params = {key: value for key, value in params.items() if key not in ("variables", "recipient_variables")}
+    recipient_params.update({"chat_id": chat_id, template_target(params): contents[chat_id]})
+    return recipient_params
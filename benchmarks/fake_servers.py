@@ -0,0 +1,196 @@
+"""
+Локальные заменители внешних сервисов для нагрузочных тестов.
+
+- FakeBotAPI имитирует Telegram Bot API (/bot<token>/<method>) с настраиваемой
+  задержкой, долей ответов 429 (retry_after) и долей ошибок 500;
+- FakeMediaOrigin отдает сгенерированные файлы заданного размера по /media/<name>.
+"""
+from aiohttp import web
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+import asyncio
+import hashlib
+import itertools
+import json
+import random
+import time
+
+
+@dataclass
+class FakeBotAPIConfig:
+    latency: float = 0.05
+    jitter: float = 0.0
+    rate_429: float = 0.0
+    retry_after: int = 1
+    error_rate: float = 0.0
+    seed: int = 42
+
+
+@dataclass
+class FakeBotAPIStats:
+    calls: Dict[str, int] = field(default_factory=dict)
+    responses_429: int = 0
+    responses_500: int = 0
+    upload_bytes: int = 0
+
+
+class FakeBotAPI:
+    """Имитация Telegram Bot API, достаточная для методов отправки сервиса."""
+
+    MEDIA_METHODS = {
+        "sendPhoto": "photo",
+        "sendVideo": "video",
+        "sendAnimation": "animation",
+        "sendDocument": "document"
+    }
+
+    def __init__(self, config: FakeBotAPIConfig):
+        self.config = config
+        self.stats = FakeBotAPIStats()
+        self._random = random.Random(config.seed)
+        self._message_ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.url = f"http://{host}:{site._server.sockets[0].getsockname()[1]}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.stats.calls[method] = self.stats.calls.get(method, 0) + 1
+        form = await request.post()
+
+        latency = self.config.latency + self._random.uniform(0, self.config.jitter)
+        if latency > 0:
+            await asyncio.sleep(latency)
+
+        roll = self._random.random()
+        if roll < self.config.rate_429:
+            self.stats.responses_429 += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.config.retry_after}",
+                "parameters": {"retry_after": self.config.retry_after}
+            }, status=429)
+        if roll < self.config.rate_429 + self.config.error_rate:
+            self.stats.responses_500 += 1
+            return web.json_response(
+                {"ok": False, "error_code": 500, "description": "Internal Server Error"},
+                status=500
+            )
+
+        chat_id = int(form.get("chat_id", 0))
+        if method == "sendMediaGroup":
+            return web.json_response({"ok": True, "result": [
+                self._media_message(chat_id, item["type"], self._attachment(form, item["media"]))
+                for item in json.loads(form["media"])
+            ]})
+
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}
+        }
+        if method == "sendMessage":
+            message["text"] = form.get("text", "")
+        elif method in self.MEDIA_METHODS:
+            media_type = self.MEDIA_METHODS[method]
+            file_id = self._file_id(form.get(media_type))
+            media = {"file_id": file_id, "file_unique_id": file_id[:16]}
+            if media_type == "photo":
+                message["photo"] = [{**media, "width": 1280, "height": 720}]
+            elif media_type in ("video", "animation"):
+                message[media_type] = {**media, "width": 1920, "height": 1080, "duration": 10}
+            else:
+                message["document"] = media
+
+        return web.json_response({"ok": True, "result": message})
+
+    def _media_message(self, chat_id: int, media_type: str, value) -> dict:
+        file_id = self._file_id(value)
+        media = {"file_id": file_id, "file_unique_id": file_id[:16]}
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}
+        }
+        if media_type == "photo":
+            message["photo"] = [{**media, "width": 1280, "height": 720}]
+        else:
+            message[media_type] = {**media, "width": 1920, "height": 1080, "duration": 10}
+        return message
+
+    @staticmethod
+    def _attachment(form, media: str):
+        """Файл из multipart для attach://<name> или сам file_id."""
+        if media.startswith("attach://"):
+            return form.get(media[len("attach://"):])
+        return media
+
+    def _file_id(self, value) -> str:
+        """file_id для загруженного файла или тот же file_id при повторной отправке."""
+        if isinstance(value, str):
+            return value
+        data = value.file.read() if value is not None else b""
+        self.stats.upload_bytes += len(data)
+        return "fake-" + hashlib.sha1(data).hexdigest()
+
+
+class FakeMediaOrigin:
+    """Источник медиа: /media/<name>?size=N отдает N байт с типом по расширению имени."""
+
+    CONTENT_TYPES = {".jpg": "image/jpeg", ".mp4": "video/mp4", ".gif": "image/gif"}
+
+    def __init__(self, default_size: int, latency: float = 0.0):
+        self.default_size = default_size
+        self.latency = latency
+        self.requests = 0
+        self.bytes_sent = 0
+        self._bodies: Dict[int, bytes] = {}
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_get("/media/{name}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.url = f"http://{host}:{site._server.sockets[0].getsockname()[1]}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+        size = int(request.query.get("size", self.default_size))
+        body = self._bodies.get(size)
+        if body is None:
+            body = self._bodies[size] = random.Random(size).randbytes(size)
+        self.bytes_sent += size
+
+        name = request.match_info["name"]
+        ext = name[name.rfind("."):] if "." in name else ""
+        return web.Response(
+            body=body,
+            content_type=self.CONTENT_TYPES.get(ext, "application/octet-stream"),
+            headers={"Cache-Control": "max-age=3600", "ETag": f'"{size}"'}
+        )
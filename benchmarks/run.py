@@ -0,0 +1,346 @@
+"""
+Нагрузочный тест сервиса с локальными заменителями Telegram и источника медиа.
+
+Для каждого сценария (text, photo, video, media_group, broadcast) запускается отдельный процесс
+API (uvicorn) с чистой базой SQLite, направленный на FakeBotAPI через TELEGRAM_API_URL.
+Запросы подаются с заданной конкурентностью; в отчет попадают пропускная способность,
+задержки p50/p90/p99 и пиковое потребление памяти (VmHWM) процесса сервиса.
+Результаты сохраняются в benchmarks/results/<время>-<commit>.json.
+
+Запуск из корня репозитория:
+    python -m benchmarks.run --scenarios text,photo --requests 2000 --concurrency 50
+    python -m benchmarks.run --rate-429 0.05 --error-rate 0.01
+    python -m benchmarks.run --compare benchmarks/results/<предыдущий>.json
+"""
+from benchmarks.fake_servers import FakeBotAPI, FakeBotAPIConfig, FakeMediaOrigin
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+import aiohttp
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_TOKEN = "bench"
+HEADERS = {"Authorization": API_TOKEN}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git_revision() -> Dict[str, object]:
+    def git(*args) -> str:
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    return {"commit": git("rev-parse", "HEAD") or "unknown", "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    """Пиковый RSS процесса (VmHWM из /proc), None, если /proc недоступен."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+    return None
+
+
+class Service:
+    """Процесс API сервиса с отдельной базой и настройками для теста."""
+
+    def __init__(self, args, bot_api_url: str, workdir: str):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.env = {
+            **os.environ,
+            "TOKEN_BOT": "123456:bench",
+            "API_TOKEN": API_TOKEN,
+            "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.sqlite')}",
+            "TELEGRAM_API_URL": bot_api_url,
+            "TG_GLOBAL_RATE": str(args.tg_global_rate),
+            "TG_CHAT_RATE": str(args.tg_chat_rate),
+            "TG_CHAT_BURST": str(max(args.tg_chat_rate, 1.0)),
+            "DELIVERY_BACKOFF_BASE": "0.05",
+            "PYTHONPATH": ROOT
+        }
+        if args.media_cache:
+            self.env["MEDIA_CACHE_DIR"] = os.path.join(workdir, "media")
+        self.process: Optional[subprocess.Popen] = None
+
+    async def start(self, timeout: float = 120.0) -> None:
+        self.process = subprocess.Popen(
+            [
+                sys.executable, "-m", "uvicorn", "app.services.notification_service:app",
+                "--host", "127.0.0.1", "--port", str(self.port), "--log-level", "warning"
+            ],
+            cwd=ROOT,
+            env=self.env
+        )
+        deadline = time.monotonic() + timeout
+        async with aiohttp.ClientSession() as session:
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    raise RuntimeError(f"Service exited with code {self.process.returncode}")
+                try:
+                    async with session.get(f"{self.url}/chat/ping", headers=HEADERS) as response:
+                        if response.status == 200:
+                            return
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise RuntimeError("Service did not start in time")
+
+    def stop(self) -> Optional[float]:
+        """Останавливает процесс и возвращает его пиковый RSS в МБ."""
+        if self.process is None:
+            return None
+        rss = peak_rss_mb(self.process.pid)
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        return rss
+
+
+async def drive(
+    session: aiohttp.ClientSession,
+    url: str,
+    payload: Callable[[int], dict],
+    total: int,
+    concurrency: int
+) -> dict:
+    """Отправляет total запросов не более concurrency одновременно, собирая задержки."""
+    latencies: List[float] = []
+    errors = 0
+    indexes = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for index in indexes:
+            started_at = time.perf_counter()
+            try:
+                async with session.post(url, json=payload(index), headers=HEADERS) as response:
+                    body = await response.json(content_type=None)
+                    ok = response.status < 300 and body.get("status") != "error"
+            except (aiohttp.ClientError, ValueError):
+                ok = False
+            latencies.append(time.perf_counter() - started_at)
+            errors += not ok
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(min(concurrency, total), 1))))
+    elapsed = time.perf_counter() - started_at
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 2),
+            "p90": round(percentile(latencies, 0.90) * 1000, 2),
+            "p99": round(percentile(latencies, 0.99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+            "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0
+        }
+    }
+
+
+def build_scenarios(args, media_url: str) -> Dict[str, dict]:
+    """Сценарии: эндпоинт, тело запроса по номеру и число сообщений на запрос."""
+    def chat_id(index: int) -> int:
+        return 1_000_000 + index % args.users
+
+    def media(kind: str, ext: str, size: int) -> Callable[[int], dict]:
+        return lambda index: {
+            "chat_id": chat_id(index),
+            "type": kind,
+            "content": f"{media_url}/media/{kind}-{index % args.media_distinct}{ext}?size={size}",
+            "caption": "bench"
+        }
+
+    broadcast_ids = [1_000_000 + index for index in range(args.broadcast_size)]
+    return {
+        "text": {
+            "path": "/chat/message_answer",
+            "payload": lambda index: {"chat_id": chat_id(index), "type": "text", "content": f"bench {index}"},
+            "messages": 1
+        },
+        "photo": {"path": "/chat/message_answer", "payload": media("photo", ".jpg", args.photo_size), "messages": 1},
+        "video": {"path": "/chat/message_answer", "payload": media("video", ".mp4", args.video_size), "messages": 1},
+        "media_group": {
+            "path": "/chat/message_answer",
+            "payload": lambda index: {
+                "chat_id": chat_id(index),
+                "type": "media_group",
+                "content": [
+                    f"{media_url}/media/album-{index % args.media_distinct}-{item}.jpg?size={args.photo_size}"
+                    for item in range(args.album_size)
+                ],
+                "caption": "bench"
+            },
+            "messages": 1
+        },
+        "broadcast": {
+            "path": "/chat/broadcast",
+            "payload": lambda index: {"chat_ids": broadcast_ids, "type": "text", "content": f"bench {index}"},
+            "messages": args.broadcast_size,
+            "requests": args.broadcast_requests
+        }
+    }
+
+
+async def run_scenario(name: str, scenario: dict, args, bot_api: FakeBotAPI, origin: FakeMediaOrigin) -> dict:
+    with tempfile.TemporaryDirectory(prefix=f"bench-{name}-") as workdir:
+        service = Service(args, bot_api.url, workdir)
+        await service.start()
+        try:
+            connector = aiohttp.TCPConnector(limit=args.concurrency)
+            async with aiohttp.ClientSession(connector=connector) as session:
+                users = [{"user_id": 1_000_000 + index} for index in range(max(args.users, args.broadcast_size))]
+                async with session.post(f"{service.url}/chat/users/import", json={"users": users}, headers=HEADERS):
+                    pass
+
+                url = f"{service.url}{scenario['path']}"
+                total = scenario.get("requests") or args.requests
+                if args.warmup:
+                    await drive(session, url, scenario["payload"], min(args.warmup, total), args.concurrency)
+
+                calls_before = sum(bot_api.stats.calls.values())
+                throttled_before = bot_api.stats.responses_429
+                failed_before = bot_api.stats.responses_500
+                origin_before = origin.requests
+
+                result = await drive(session, url, scenario["payload"], total, args.concurrency)
+        finally:
+            rss = service.stop()
+
+    result["messages"] = total * scenario["messages"]
+    result["messages_per_s"] = round(result["messages"] / result["elapsed_s"], 1) if result["elapsed_s"] else 0.0
+    result["peak_rss_mb"] = rss
+    result["bot_api"] = {
+        "calls": sum(bot_api.stats.calls.values()) - calls_before,
+        "responses_429": bot_api.stats.responses_429 - throttled_before,
+        "responses_500": bot_api.stats.responses_500 - failed_before
+    }
+    result["media_origin_requests"] = origin.requests - origin_before
+    return result
+
+
+def compare(current: dict, previous: dict) -> None:
+    """Печатает изменение пропускной способности и p99 относительно прошлого прогона."""
+    print(f"\nСравнение с {previous.get('commit', '?')[:10]}:")
+    for name, result in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        rps_delta = (result["throughput_rps"] / before["throughput_rps"] - 1) * 100 if before["throughput_rps"] else 0.0
+        p99_delta = (result["latency_ms"]["p99"] / before["latency_ms"]["p99"] - 1) * 100 if before["latency_ms"]["p99"] else 0.0
+        print(f"  {name:<10} throughput {rps_delta:+6.1f}%   p99 {p99_delta:+6.1f}%")
+
+
+async def main(args) -> dict:
+    bot_api = FakeBotAPI(FakeBotAPIConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_429=args.rate_429,
+        retry_after=args.retry_after,
+        error_rate=args.error_rate,
+        seed=args.seed
+    ))
+    origin = FakeMediaOrigin(default_size=args.photo_size, latency=args.media_latency)
+    await bot_api.start()
+    media_url = await origin.start()
+
+    scenarios = build_scenarios(args, media_url)
+    report = {
+        **git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": vars(args),
+        "scenarios": {}
+    }
+    try:
+        for name in args.scenarios.split(","):
+            name = name.strip()
+            if name not in scenarios:
+                raise SystemExit(f"Unknown scenario: {name}. Available: {', '.join(scenarios)}")
+            print(f"Running {name}...", flush=True)
+            result = report["scenarios"][name] = await run_scenario(name, scenarios[name], args, bot_api, origin)
+            print(
+                f"  {result['throughput_rps']} req/s, {result['messages_per_s']} msg/s, "
+                f"p50 {result['latency_ms']['p50']} ms, p99 {result['latency_ms']['p99']} ms, "
+                f"errors {result['errors']}, peak RSS {result['peak_rss_mb']} MB",
+                flush=True
+            )
+    finally:
+        await bot_api.stop()
+        await origin.stop()
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Notification service benchmark")
+    parser.add_argument("--scenarios", default="text,photo,video,media_group,broadcast")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--users", type=int, default=1000, help="distinct chat_ids for single sends")
+    parser.add_argument("--broadcast-size", type=int, default=100)
+    parser.add_argument("--broadcast-requests", type=int, default=20)
+    parser.add_argument("--photo-size", type=int, default=256 * 1024)
+    parser.add_argument("--video-size", type=int, default=4 * 1024 * 1024)
+    parser.add_argument("--album-size", type=int, default=5, help="photos per media_group request")
+    parser.add_argument("--media-distinct", type=int, default=10, help="distinct media URLs per scenario")
+    parser.add_argument("--media-cache", action="store_true", help="enable MEDIA_CACHE_DIR in the service")
+    parser.add_argument("--media-latency", type=float, default=0.0)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake Bot API latency, seconds")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--tg-global-rate", type=float, default=1_000_000.0)
+    parser.add_argument("--tg-chat-rate", type=float, default=1_000_000.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results"))
+    parser.add_argument("--compare", help="previous result JSON to compare with")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(main(args))
+
+    os.makedirs(args.output, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path = os.path.join(args.output, f"{stamp}-{report['commit'][:10]}.json")
+    with open(path, "w") as result_file:
+        json.dump(report, result_file, indent=2, ensure_ascii=False)
+    print(f"\nResults saved to {path}")
+
+    if args.compare:
+        with open(args.compare) as previous_file:
+            compare(report, json.load(previous_file))
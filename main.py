@@ -1,35 +1,122 @@
-from aiogram import Bot, Dispatcher
+from app.Bot.bot import bot, dp
+from app.Bot.webhook import set_webhook
 from app.core.config import settings
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
-from app.core.logging import logs_bot
-from app.services import notification_service as services
+from app.core.logging import logs_bot, log_sink
+from app.core.http import http_client
 from app.db.database import init_db
 import asyncio
+import uvicorn
+
+# Режимы запуска (RUN_MODE):
+# - all: API (uvicorn.Server) и поллинг бота в одном event loop;
+# - api: только API, API_WORKERS процессов uvicorn;
+# - bot: только поллинг бота.
+# При BOT_UPDATE_MODE=webhook обновления бота принимает API (эндпоинт WEBHOOK_PATH),
+# поэтому поллинг не запускается, а обработку обновлений можно разнести
+# по нескольким репликам API за балансировщиком.
+# Общее состояние между процессами хранится в базе данных (пользователи,
+# очередь задач, file_id), а кэши в памяти у каждого процесса свои
+# и ограничены по времени жизни: например, /start в процессе бота сбрасывает
+# user_cache только в этом процессе, и процессы API увидят нового пользователя
+# не позже чем через USER_CACHE_TTL секунд.
+# Лимит TG_GLOBAL_RATE делится между всеми отправляющими процессами
+# (см. process_global_rate), поэтому API_WORKERS должно совпадать
+# в окружении процессов api и bot.
+
+async def run_polling():
+    await bot.delete_webhook(drop_pending_updates=True)
+    await dp.start_polling(bot, handle_signals=False, close_bot_session=False)
+
+async def run_all():
+    """API и поллинг бота в одном event loop."""
+    server = uvicorn.Server(uvicorn.Config(
+        "app.services.notification_service:app",
+        host=settings.config.api_host,
+        port=settings.config.api_port,
+        log_level="info"
+    ))
+    api = asyncio.create_task(server.serve())
+
+    # Поллинг стартует после запуска API: uvicorn не выполняет shutdown lifespan,
+    # если остановка запрошена во время startup
+    while not server.started:
+        if api.done():
+            return await api
+        await asyncio.sleep(0.1)
+
+    polling = asyncio.create_task(run_polling())
+    # Если поллинг упадет, останавливаем и API, чтобы процесс перезапустился целиком
+    polling.add_done_callback(lambda _: setattr(server, "should_exit", True))
+
+    try:
+        await api
+    finally:
+        if not polling.done():
+            try:
+                await dp.stop_polling()
+            except RuntimeError:
+                polling.cancel()
+        result, = await asyncio.gather(polling, return_exceptions=True)
+        if isinstance(result, Exception):
+            await logs_bot("error", f"Bot polling stopped: {result}")
+
+async def run_api():
+    """API в одном event loop без поллинга (режим webhook)."""
+    server = uvicorn.Server(uvicorn.Config(
+        "app.services.notification_service:app",
+        host=settings.config.api_host,
+        port=settings.config.api_port,
+        log_level="info"
+    ))
+    await server.serve()
 
 async def main():
     try:
-        # Инициализация бота
-        bot = Bot(token=settings.config.bot_token, 
-                default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-        
-        
-        # Инициализация диспетчера
-        dp = Dispatcher()
-        
-        await bot.delete_webhook(drop_pending_updates=True)
-        await logs_bot("info", "Сервис успешно запущен")    
-        asyncio.create_task(services.run_fastapi())
         await init_db()
-        
-        # Запуск поллинга
-        await dp.start_polling(bot)
+        await logs_bot("info", f"Сервис успешно запущен (режим {settings.config.run_mode}, обновления: {settings.config.bot_update_mode})")
+
+        if settings.config.bot_update_mode == "webhook":
+            await set_webhook()
+            # В режиме bot процесс только регистрирует вебхук
+            if settings.config.run_mode != "bot":
+                await run_api()
+        elif settings.config.run_mode == "bot":
+            await run_polling()
+        else:
+            await run_all()
+
+    finally:
+        await bot.session.close()
+        await http_client.close()
+        await log_sink.stop()
 
+async def register_webhook():
+    try:
+        await set_webhook()
     finally:
         await bot.session.close()
 
+def run_api_workers():
+    """Только API: несколько процессов uvicorn, каждый со своим event loop и пулом соединений."""
+    if settings.config.bot_update_mode == "webhook":
+        asyncio.run(register_webhook())
+    uvicorn.run(
+        "app.services.notification_service:app",
+        host=settings.config.api_host,
+        port=settings.config.api_port,
+        workers=settings.config.api_workers,
+        log_level="info"
+    )
+
+async def log_fatal(error: Exception):
+    await logs_bot("error", f"Bot work off.. {error}")
+    await log_sink.stop()
+
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if settings.config.run_mode == "api":
+            run_api_workers()
+        else:
+            asyncio.run(main())
     except Exception as Error:
-        asyncio.run(logs_bot("error", f"Bot work off.. {Error}"))
+        asyncio.run(log_fatal(Error))
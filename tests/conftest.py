@@ -0,0 +1,15 @@
+import os
+import tempfile
+
+# Настройки читаются при импорте модулей app, поэтому окружение задается до них
+_db_dir = tempfile.mkdtemp(prefix="notification-tests-")
+os.environ.setdefault("TOKEN_BOT", "123456:test")
+os.environ.setdefault("API_TOKEN", "test")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_db_dir}/test.sqlite"
+
+import pytest
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
@@ -0,0 +1,98 @@
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramEntityTooLarge,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError
+)
+from aiogram.methods import SendMessage
+from app.core.http import origin_error
+from app.services.delivery_policy import classify_error
+from types import SimpleNamespace
+import aiohttp
+import asyncio
+import pytest
+
+
+METHOD = SendMessage(chat_id=1, text="x")
+
+
+def wrapped(error: BaseException, *messages: str) -> BaseException:
+    """Оборачивает ошибку в цепочку ValueError (raise ... from error), как send_media."""
+    for message in messages:
+        try:
+            raise ValueError(message) from error
+        except ValueError as e:
+            error = e
+    return error
+
+
+def origin_response(status: int) -> SimpleNamespace:
+    return SimpleNamespace(status=status, request_info=None, history=(), reason="", headers={})
+
+
+def test_retry_after_is_transient_with_pause():
+    error_class = classify_error(TelegramRetryAfter(method=METHOD, message="flood", retry_after=7))
+    assert error_class.transient
+    assert error_class.retry_after == 7
+
+
+@pytest.mark.parametrize("error", [
+    TelegramNetworkError(method=METHOD, message="timeout"),
+    TelegramServerError(method=METHOD, message="Bad Gateway"),
+    aiohttp.ClientConnectionError("connection reset"),
+    asyncio.TimeoutError()
+])
+def test_network_and_server_errors_are_transient(error):
+    assert classify_error(error).transient
+
+
+def test_forbidden_is_unreachable():
+    error_class = classify_error(TelegramForbiddenError(method=METHOD, message="Forbidden: bot was blocked by the user"))
+    assert not error_class.transient
+    assert error_class.unreachable
+
+
+@pytest.mark.parametrize("message, unreachable", [
+    ("Bad Request: chat not found", True),
+    ("Bad Request: PEER_ID_INVALID", True),
+    ("Bad Request: can't parse entities", False)
+])
+def test_bad_request_is_permanent(message, unreachable):
+    error_class = classify_error(TelegramBadRequest(method=METHOD, message=message))
+    assert not error_class.transient
+    assert error_class.unreachable is unreachable
+
+
+def test_entity_too_large_is_permanent():
+    assert not classify_error(TelegramEntityTooLarge(method=METHOD, message="Request Entity Too Large")).transient
+
+
+@pytest.mark.parametrize("error", [ValueError("bad payload"), TypeError("bad type"), KeyError("content")])
+def test_data_errors_are_permanent(error):
+    assert not classify_error(error).transient
+
+
+def test_other_errors_are_transient():
+    assert classify_error(RuntimeError("unexpected")).transient
+
+
+def test_cause_chain_is_walked():
+    error = wrapped(TelegramForbiddenError(method=METHOD, message="Forbidden"), "Ошибка при отправке photo")
+    assert classify_error(error).unreachable
+
+    error = wrapped(TelegramRetryAfter(method=METHOD, message="flood", retry_after=3), "download", "Ошибка при отправке альбома")
+    assert classify_error(error).transient
+    assert classify_error(error).retry_after == 3
+
+
+@pytest.mark.parametrize("status, transient", [(500, True), (503, True), (429, True), (404, False), (403, False)])
+def test_media_origin_status(status, transient):
+    response = origin_response(status)
+    try:
+        raise ValueError(f"Ошибка загрузки: {status}") from origin_error(response)
+    except ValueError as e:
+        error = wrapped(e, "Ошибка при отправке photo")
+
+    assert classify_error(error).transient is transient
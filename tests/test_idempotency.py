@@ -0,0 +1,118 @@
+from fastapi import HTTPException
+from sqlalchemy import delete
+from app.core.logging import log_sink
+from app.db.database import async_session, engine, init_db
+from app.db.models import IdempotencyRecord
+from app.services.idempotency import IdempotencyStore
+import asyncio
+import pytest
+
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def store():
+    await init_db()
+    async with async_session() as session:
+        await session.execute(delete(IdempotencyRecord))
+        await session.commit()
+    yield IdempotencyStore(ttl=60, cache_size=100, lock_timeout=30)
+    await log_sink.stop()
+    await engine.dispose()
+
+
+class Handler:
+    """Эндпоинт-заглушка: считает вызовы и возвращает заданный ответ."""
+
+    def __init__(self, result=None, delay: float = 0.0):
+        self.result = result if result is not None else {"status": "queued", "job_id": 1}
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self.result
+
+
+async def test_concurrent_requests_run_handler_once(store):
+    handler = Handler(delay=0.05)
+    responses = await asyncio.gather(*(store.run("k", {"chat_id": 1}, handler) for _ in range(5)))
+
+    assert handler.calls == 1
+    assert {response.body for response in responses} == {responses[0].body}
+    replayed = [response.headers.get("Idempotent-Replayed") for response in responses]
+    assert replayed.count("true") == 4
+    assert store.coalesced == 4
+
+
+async def test_retry_is_replayed(store):
+    handler = Handler()
+    first = await store.run("k", {"chat_id": 1}, handler)
+    retry = await store.run("k", {"chat_id": 1}, handler)
+
+    assert handler.calls == 1
+    assert "Idempotent-Replayed" not in first.headers
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.status_code == first.status_code
+    assert retry.body == first.body
+
+
+async def test_retry_is_replayed_from_database(store):
+    handler = Handler()
+    first = await store.run("k", {"chat_id": 1}, handler)
+
+    # Другой процесс: кэш в памяти пуст, ответ берется из таблицы idempotency_keys
+    other = IdempotencyStore(ttl=60, cache_size=100, lock_timeout=30)
+    retry = await other.run("k", {"chat_id": 1}, handler)
+
+    assert handler.calls == 1
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.body == first.body
+
+
+async def test_same_key_with_different_body_is_rejected(store):
+    handler = Handler()
+    await store.run("k", {"chat_id": 1}, handler)
+
+    with pytest.raises(HTTPException) as error:
+        await store.run("k", {"chat_id": 2}, handler)
+
+    assert error.value.status_code == 422
+    assert handler.calls == 1
+
+
+async def test_error_response_is_not_stored(store):
+    handler = Handler(result={"status": "error", "message": "failed"})
+    await store.run("k", {"chat_id": 1}, handler)
+    retry = await store.run("k", {"chat_id": 1}, handler)
+
+    assert handler.calls == 2
+    assert "Idempotent-Replayed" not in retry.headers
+
+
+async def test_handler_exception_releases_key(store):
+    async def failing():
+        raise RuntimeError("send failed")
+
+    with pytest.raises(RuntimeError):
+        await store.run("k", {"chat_id": 1}, failing)
+
+    handler = Handler()
+    await store.run("k", {"chat_id": 1}, handler)
+    assert handler.calls == 1
+
+
+async def test_finish_failure_keeps_result(store, monkeypatch):
+    async def broken_finish(key, response):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(store, "_finish", broken_finish)
+    handler = Handler()
+    first = await store.run("k", {"chat_id": 1}, handler)
+    retry = await store.run("k", {"chat_id": 1}, handler)
+
+    assert first.status_code == 200
+    assert handler.calls == 1
+    assert retry.headers["Idempotent-Replayed"] == "true"
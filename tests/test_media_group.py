@@ -0,0 +1,25 @@
+from app.Bot.handlers.keyboards.telegram_sender import MEDIA_GROUP_LIMIT, split_media_group
+import pytest
+
+
+@pytest.mark.parametrize("count, sizes", [
+    (2, [2]),
+    (10, [10]),
+    (11, [6, 5]),
+    (20, [10, 10]),
+    (21, [7, 7, 7]),
+    (23, [8, 8, 7])
+])
+def test_split_is_balanced(count, sizes):
+    assert [len(chunk) for chunk in split_media_group(list(range(count)))] == sizes
+
+
+@pytest.mark.parametrize("count", range(2, 51))
+def test_split_keeps_order_and_limits(count):
+    items = [{"type": "photo", "url": f"https://example.com/{index}.jpg"} for index in range(count)]
+    chunks = split_media_group(items)
+
+    assert [item for chunk in chunks for item in chunk] == items
+    # sendMediaGroup принимает от 2 до MEDIA_GROUP_LIMIT элементов
+    assert all(2 <= len(chunk) <= MEDIA_GROUP_LIMIT for chunk in chunks)
+    assert len(chunks) == -(-count // MEDIA_GROUP_LIMIT)
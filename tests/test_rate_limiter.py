@@ -0,0 +1,150 @@
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+from app.core import rate_limiter
+from app.core.config import settings
+from app.core.rate_limiter import TelegramScheduler, TokenBucket, process_global_rate
+from dataclasses import replace
+import asyncio
+import pytest
+
+
+class Clock:
+    """Управляемые часы вместо time.monotonic."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    return clock
+
+
+def test_bucket_refills_at_rate(clock):
+    bucket = TokenBucket(rate=2, capacity=2)
+    bucket.take()
+    bucket.take()
+    assert bucket.wait_time() == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert bucket.wait_time() == 0
+
+
+@pytest.mark.parametrize("rate, capacity", [(0.73, 0.73), (1.0, 0.5), (0.1, 0)])
+def test_bucket_below_one_token_still_releases(clock, rate, capacity):
+    bucket = TokenBucket(rate=rate, capacity=capacity)
+    assert bucket.capacity == 1.0
+    assert bucket.wait_time() == 0
+
+    bucket.take()
+    wait = bucket.wait_time()
+    assert wait == pytest.approx(1 / rate)
+    clock.now += wait
+    assert bucket.wait_time() == pytest.approx(0, abs=1e-9)
+
+
+@pytest.mark.parametrize("rate", [0, -1])
+def test_bucket_rejects_non_positive_rate(rate):
+    with pytest.raises(ValueError):
+        TokenBucket(rate=rate, capacity=1)
+
+
+def test_bucket_reserve_goes_negative(clock):
+    bucket = TokenBucket(rate=1, capacity=1)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(1)
+    assert bucket.reserve() == pytest.approx(2)
+
+
+def test_bucket_pause(clock):
+    bucket = TokenBucket(rate=10, capacity=10)
+    bucket.pause(3)
+    assert bucket.wait_time() == pytest.approx(3)
+    assert not bucket.idle()
+
+    clock.now += 3
+    assert bucket.wait_time() == 0
+    assert bucket.idle()
+
+
+@pytest.mark.parametrize("run_mode, workers, update_mode, expected", [
+    ("all", 4, "polling", 30.0),
+    ("api", 4, "polling", 6.0),
+    ("bot", 4, "polling", 6.0),
+    ("api", 4, "webhook", 7.5),
+    ("api", 40, "polling", 30 / 41),
+])
+def test_process_global_rate(run_mode, workers, update_mode, expected):
+    config = replace(
+        settings.config,
+        tg_global_rate=30.0,
+        run_mode=run_mode,
+        api_workers=workers,
+        bot_update_mode=update_mode
+    )
+    assert process_global_rate(config) == pytest.approx(expected)
+
+
+def test_process_global_rate_rejects_non_positive_rate():
+    with pytest.raises(ValueError):
+        process_global_rate(replace(settings.config, tg_global_rate=0))
+
+
+def flood(retry_after: int) -> TelegramRetryAfter:
+    return TelegramRetryAfter(
+        method=SendMessage(chat_id=1, text="x"),
+        message="Too Many Requests",
+        retry_after=retry_after
+    )
+
+
+@pytest.mark.anyio
+async def test_scheduler_sends_with_rate_below_one():
+    scheduler = TelegramScheduler(global_rate=30 / 41, chat_rate=1, chat_burst=1)
+
+    async def method(chat_id):
+        return chat_id
+
+    assert await asyncio.wait_for(scheduler.send(method, chat_id=1), timeout=1) == 1
+
+
+@pytest.mark.anyio
+async def test_scheduler_serves_higher_priority_first():
+    scheduler = TelegramScheduler(global_rate=100, chat_rate=100, chat_burst=100)
+    order = []
+
+    async def method(chat_id):
+        order.append(chat_id)
+
+    await scheduler.send(method, chat_id=0)
+    # Пока глобальный bucket на паузе, оба вызова ждут в очереди
+    scheduler._global.pause(0.1)
+    low = asyncio.create_task(scheduler.send(method, chat_id=1, priority="low"))
+    await asyncio.sleep(0)
+    high = asyncio.create_task(scheduler.send(method, chat_id=2, priority="high"))
+    await asyncio.wait_for(asyncio.gather(low, high), timeout=5)
+
+    assert order == [0, 2, 1]
+
+
+@pytest.mark.anyio
+async def test_scheduler_flood_wait_pauses_all_chats_without_retrying():
+    scheduler = TelegramScheduler(global_rate=100, chat_rate=100, chat_burst=100)
+    calls = []
+
+    async def flooded(chat_id):
+        calls.append(chat_id)
+        raise flood(retry_after=30)
+
+    with pytest.raises(TelegramRetryAfter):
+        await scheduler.send(flooded, chat_id=1)
+
+    assert calls == [1]
+    assert scheduler._chat_bucket(1).wait_time() == pytest.approx(30, abs=1)
+    # Flood wait действует на всего бота: глобальный bucket тоже на паузе
+    assert scheduler._global.wait_time() == pytest.approx(30, abs=1)
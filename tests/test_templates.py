@@ -0,0 +1,94 @@
+from sqlalchemy import delete
+from app.core.logging import log_sink
+from app.db.database import async_session, engine, init_db
+from app.db.models import MessageTemplate
+from app.services import templates
+from app.services.templates import TemplateStore, compile_template, personalize
+import pytest
+
+
+def test_render_escapes_variables_but_not_markup():
+    template = compile_template("<b>Hi, {first_name}</b>")
+    assert template.render({"first_name": "<script>&"}) == "<b>Hi, &lt;script&gt;&amp;</b>"
+
+
+def test_fields_and_missing_values():
+    template = compile_template("{first_name} {last_name}: {code}")
+    assert template.fields == {"first_name", "last_name", "code"}
+    assert template.render({"first_name": "Ann", "code": 42}) == "Ann : 42"
+
+
+def test_double_braces_are_literal():
+    template = compile_template("{{first_name}} = {first_name}")
+    assert template.fields == {"first_name"}
+    assert template.render({"first_name": "Ann"}) == "{first_name} = Ann"
+
+
+@pytest.mark.parametrize("body", [
+    "",
+    None,
+    "{user.name}",
+    "{items[0]}",
+    "{name!r}",
+    "{amount:.2f}",
+    "{0}",
+    "{}",
+    "unclosed {name"
+])
+def test_invalid_templates_are_rejected(body):
+    with pytest.raises(ValueError):
+        compile_template(body)
+
+
+def test_bind_substitutes_shared_values_once():
+    template = compile_template("<i>{promo}</i> for {first_name}").bind({"promo": "a<b"})
+    assert template.fields == {"first_name"}
+    assert template.render({"first_name": "Ann"}) == "<i>a&lt;b</i> for Ann"
+
+
+def test_personalize_drops_template_variables():
+    params = {
+        "message_type": "photo",
+        "content": "https://example.com/1.jpg",
+        "template": "promo",
+        "variables": {"promo": "x"},
+        "recipient_variables": {"1": {"code": "y"}}
+    }
+    result = personalize(params, 1, {1: "rendered"})
+
+    assert result["caption"] == "rendered"
+    assert result["chat_id"] == 1
+    assert "variables" not in result and "recipient_variables" not in result
+
+
+@pytest.fixture
+async def store():
+    await init_db()
+    async with async_session() as session:
+        await session.execute(delete(MessageTemplate))
+        await session.commit()
+    yield TemplateStore(cache_size=100, cache_ttl=60)
+    await log_sink.stop()
+    await engine.dispose()
+
+
+@pytest.mark.anyio
+async def test_saved_template_is_read_back(store):
+    await store.save("welcome", "Hi, {first_name}")
+
+    other = TemplateStore(cache_size=100, cache_ttl=60)
+    template = await other.get("welcome")
+    assert template.render({"first_name": "Ann"}) == "Hi, Ann"
+
+
+@pytest.mark.anyio
+async def test_failed_insert_is_not_cached(store, monkeypatch):
+    async def failed_insert(table_class, data):
+        return False
+
+    monkeypatch.setattr(templates, "add_to_table", failed_insert)
+    with pytest.raises(RuntimeError):
+        await store.save("welcome", "Hi, {first_name}")
+
+    with pytest.raises(ValueError):
+        await store.get("welcome")